@@ -1,6 +1,7 @@
 // controllers/impact_analysis.controller.js
 const path = require("path");
 const XLSX = require("xlsx");
+const { sequelize } = require("../models");
 
 // Helper to load Excel and convert to JSON
 function loadExcel(fileName) {
@@ -16,6 +17,66 @@ function getTariffRows() {
   return loadExcel("tariff_dataset_500_rows.xlsx");
 }
 
+// duty rate of a sheet row ("Duty Rate (%)" in the dataset)
+function dutyRateOf(r) {
+  return Number(
+    r["Duty Rate (%)"] || r["Duty Rate"] || r["duty rate"] || r["duty_rate"] || 0
+  );
+}
+
+// Answer precomputed by pipeline/impact_engine.py (table tariff_impact_results,
+// default 0-100 rate range only; unset filters are stored as 0 / "").
+// Returns null when the table has not been built, so the caller falls back
+// to scanning the sheet.
+async function getPrecomputedImpact(filters) {
+  let rows;
+  try {
+    rows = await sequelize.query(
+      `SELECT * FROM tariff_impact_results
+       WHERE year = ? AND product_category = ? AND subcategory = ?
+         AND origin_country = ? AND destination_country = ?`,
+      {
+        replacements: [
+          filters.year ? Number(filters.year) : 0,
+          filters.productCategoryId || "",
+          filters.subcategoryId || "",
+          filters.originCountryCode || "",
+          filters.destinationCountryCode || "",
+        ],
+        type: sequelize.QueryTypes.SELECT,
+      }
+    );
+  } catch (error) {
+    console.warn("tariff_impact_results unavailable:", error.message);
+    return null;
+  }
+  if (!rows.length) {
+    return { barChart: [], pieChart: [], summary: null };
+  }
+  const r = rows[0];
+  const summary = {
+    baseTariff: r.trump_cost,
+    antiDumping: r.anti_dumping,
+    countervailing: r.countervailing,
+    section301: r.section301,
+    totalDutyCost: r.total_duty_cost,
+  };
+  return {
+    barChart: [
+      { period: "Pre-Trump", tariffRate: r.pre_trump_rate, additionalCost: r.pre_trump_cost },
+      { period: "Trump Era", tariffRate: r.trump_rate, additionalCost: r.trump_cost },
+      { period: "Current", tariffRate: r.current_rate, additionalCost: r.current_cost },
+    ],
+    pieChart: [
+      { name: "Base Tariff", value: summary.baseTariff },
+      { name: "Anti-Dumping Duty", value: summary.antiDumping },
+      { name: "Countervailing Duty", value: summary.countervailing },
+      { name: "Section 301 Tariff", value: summary.section301 },
+    ],
+    summary,
+  };
+}
+
 module.exports = {
   // GET /api/impact-analysis/currency
   getCurrencyData: (req, res) => {
@@ -48,7 +109,7 @@ module.exports = {
   },
 
   // POST /api/impact-analysis/tariffimpact
-  getTariffImpactData: (req, res) => {
+  getTariffImpactData: async (req, res) => {
     try {
       const {
         minTaxRate = 0,
@@ -60,13 +121,16 @@ module.exports = {
         destinationCountryCode,
       } = req.body;
 
+      if (Number(minTaxRate) === 0 && Number(maxTaxRate) === 100) {
+        const precomputed = await getPrecomputedImpact(req.body);
+        if (precomputed) return res.json(precomputed);
+      }
+
       const allTariffs = getTariffRows(); // all rows from tariff_dataset_500_rows.xlsx
 
       // 1) filter rows using inputs and min/max tax rate
       const filtered = allTariffs.filter((r) => {
-        const dutyRate = Number(
-          r["Duty Rate"] || r["duty rate"] || r["duty_rate"] || 0
-        );
+        const dutyRate = dutyRateOf(r);
 
         if (year && Number(r["Year"]) !== Number(year)) return false;
         if (productCategoryId && r["Product Category"] !== productCategoryId)
@@ -93,9 +157,7 @@ module.exports = {
 
       // 2) take one row and treat duty rate as tariffRate
       const row = filtered[0];
-      const dutyRate = Number(
-        row["Duty Rate"] || row["duty rate"] || row["duty_rate"] || 0
-      );
+      const dutyRate = dutyRateOf(row);
 
       const shipmentValue = 100000; // base shipment value for cost calculation
 
@@ -0,0 +1,218 @@
+# bench_fixtures.py
+"""
+Offline stand-ins for the benchmark suite (benchmark.py):
+
+    write_synthetic_chapters  HTS chapter workbooks of any size, laid out
+                              like the hts.usitc.gov exports in chapters/
+    StubHtsServer             local HTTP server answering /reststop/ranges
+                              and /reststop/exportList from a directory
+
+The database side needs no stand-in: db_loader runs on db.SQLiteBackend.
+"""
+import os
+import json
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from openpyxl import Workbook
+
+from utils import ensure_dirs
+
+# same header and sheet name as the export workbooks
+CHAPTER_HEADER = [
+    "HTS Number",
+    "Indent",
+    "Description",
+    "Unit of Quantity",
+    "General Rate of Duty",
+    "Special Rate of Duty",
+    "Column 2 Rate of Duty",
+    "Quota Quantity",
+    "Additional Duties",
+]
+SHEET_NAME = "HTS data export"
+
+_WORDS = [
+    "fresh", "chilled", "frozen", "dried", "salted", "prepared", "preserved",
+    "bovine", "swine", "fish", "fillets", "meat", "cuts", "boneless", "whole",
+    "articles", "parts", "containing", "weighing", "exceeding", "valued",
+]
+_UNITS = ['["kg"]', '["No.","kg"]', '["doz."]', '["liters"]', '["m²"]', '["t"]']
+_SPECIAL = [
+    "Free (A+,AU,BH,CL,CO,D,E*,IL,JO,KR,MA,OM,P,PA,PE,S,SG)",
+    "Free (A,AU,BH,CA,CL,CO,D,E,IL,JO,KR,MA,MX,OM,P,PA,PE,SG)",
+    "Free (BH,CL,CO,JO,MA,OM,P,PE,S,SG) 1.7% (KR)",
+    "",
+]
+
+
+def _description(rng, label=False):
+    text = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(2, 8))).capitalize()
+    return text + ":" if label else text
+
+
+def _general_rate(rng):
+    kind = rng.random()
+    if kind < 0.3:
+        return "Free"
+    if kind < 0.75:
+        return f"{rng.randint(1, 350) / 10:g}%"
+    if kind < 0.9:
+        return f"{rng.randint(1, 600) / 10:g}¢/kg"
+    return f"{rng.randint(1, 30) / 10:g}¢/kg + {rng.randint(1, 200) / 10:g}%"
+
+
+def _chapter_rows(chapter, rng, subheadings=8):
+    """
+    Rows of one chapter in export order: headings (indent 0), up to
+    `subheadings` subheadings each (1), rate lines (2, or 3 below a
+    code-less "Other:" label) and statistical suffixes with a unit one
+    level deeper.
+    """
+    blank = ["", "", "", "", ""]
+    step = 10 if subheadings < 10 else 1
+    for heading in range(1, 100):
+        h = f"{chapter:02d}{heading:02d}"
+        yield [h, "0", _description(rng, label=True), *blank, ""]
+        for sub in range(1, rng.randint(subheadings // 2 + 1, subheadings + 1)):
+            s = f"{h}.{sub * step:02d}"
+            yield [s, "1", _description(rng, label=True), *blank, ""]
+            for item in range(1, rng.randint(2, 6)):
+                indent = 2
+                if rng.random() < 0.2:
+                    yield ["", "2", "Other:", *blank, ""]
+                    indent = 3
+                code = f"{s}.{item * 5:02d}"
+                rates = [_general_rate(rng), rng.choice(_SPECIAL), f"{rng.randint(10, 45)}%"]
+                if rng.random() < 0.4:
+                    # rate line that is itself the statistical line
+                    yield [code + ".00", str(indent), _description(rng), rng.choice(_UNITS),
+                           *rates, "", ""]
+                    continue
+                yield [code, str(indent), _description(rng), "", *rates, "", ""]
+                for stat in range(1, rng.randint(2, 5)):
+                    yield [f"{code}.{stat * 10:02d}", str(indent + 1), _description(rng),
+                           rng.choice(_UNITS), "", "", "", "", ""]
+
+
+def write_synthetic_chapter(path, chapter, rows, seed=0):
+    """Write a chapter workbook with `rows` data rows (up to ~50k)."""
+    rng = random.Random(seed * 1000 + chapter)
+    # ~8 rows per subheading; widen the headings until `rows` fit
+    subheadings = min(99, max(8, -(-rows // (99 * 5))))
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET_NAME)
+    ws.append(CHAPTER_HEADER)
+    written = 0
+    for row in _chapter_rows(chapter, rng, subheadings):
+        if written >= rows:
+            break
+        ws.append(row)
+        written += 1
+    tmp_path = path + ".part"
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+    return written
+
+
+def write_synthetic_chapters(out_dir, chapters=10, rows_per_chapter=2000, seed=0):
+    """Chapter_01.xlsx .. Chapter_NN.xlsx in out_dir; returns {chapter: rows}."""
+    ensure_dirs(out_dir)
+    return {
+        ch: write_synthetic_chapter(
+            os.path.join(out_dir, f"Chapter_{ch:02d}.xlsx"), ch, rows_per_chapter, seed
+        )
+        for ch in range(1, chapters + 1)
+    }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body=b"", content_type="text/plain", headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        stub = self.server.stub
+        try:
+            if url.path == "/reststop/ranges":
+                ch = int(query["docNumber"][0])
+                if not os.path.exists(stub.chapter_path(ch)):
+                    return self._send(404, b"not found")
+                body = json.dumps(
+                    {"Starting_Number": f"{ch:02d}01", "Ending_Number": f"{ch:02d}99"}
+                ).encode()
+                return self._send(200, body, "application/json")
+            if url.path == "/reststop/exportList":
+                path = stub.chapter_path(int(query["from"][0][:2]))
+                if not os.path.exists(path):
+                    return self._send(404, b"not found")
+                with open(path, "rb") as fh:
+                    body = fh.read()
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    stub.count("not_modified", 0)
+                    return self._send(304, headers={"ETag": etag})
+                stub.count("exports", len(body))
+                return self._send(200, body, "application/octet-stream", {"ETag": etag})
+            return self._send(200, b"ok")
+        except (KeyError, ValueError):
+            return self._send(400, b"bad request")
+
+
+class StubHtsServer:
+    """
+    Serves the workbooks of chapters_dir the way hts.usitc.gov does, on a
+    free local port, with ETag revalidation. Use as a context manager and
+    pass base_url to the downloader (base=...).
+    """
+
+    def __init__(self, chapters_dir, host="127.0.0.1", port=0):
+        self.chapters_dir = chapters_dir
+        self.stats = {"exports": 0, "not_modified": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chapter_path(self, chapter):
+        return os.path.join(self.chapters_dir, f"Chapter_{chapter:02d}.xlsx")
+
+    def count(self, key, size):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats["bytes"] += size
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="stub-hts", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        return False
+
@@ -0,0 +1,586 @@
+# benchmark.py
+"""
+Offline benchmark of the pipeline: synthetic chapter workbooks, served by
+a local stub of hts.usitc.gov (see bench_fixtures) and loaded by
+db_loader into a SQLite database in the run's work dir (db.SQLiteBackend),
+so runs need no network or database server and can be compared with each
+other.
+
+Scenarios:
+    batch   download all chapters, parse them into one file, load it
+            (the stages of run_pipeline, one after the other)
+    stream  run_streaming_pipeline with the three stages overlapping
+    search  build the full-text search index (search_index.py) from the
+            parsed chapters, update it (nothing changed, one chapter
+            changed) and time SEARCH_QUERIES against it and against the
+            LIKE scan it replaces
+
+batch and stream load with --load-mode (bulk: staging table + merge, or upsert).
+
+Every run also times the start-up of the unified CLI (cli.py), median
+of a few runs: `cli.py --help` on top of a bare interpreter must stay
+within config.CLI_STARTUP_BUDGET, and neither `--help` nor `download
+--help` may import a heavy module (STARTUP_COMMANDS).
+
+Each scenario runs in a fresh process, so its peak RSS is its own (worker
+processes are reported separately as children). Reported per scenario:
+wall seconds, rows, rows/sec, seconds per stage (wall time for batch,
+busy time for stream) and peak RSS in MB; for search also the query
+latency in ms (p50, p95, max over all queries and runs).
+
+The result is written to benchmarks/last_run.json and compared with the
+saved baseline, if any:
+
+    python benchmark.py --chapters 20 --rows 3000 --save-baseline
+    python benchmark.py --chapters 20 --rows 3000 --fail-on-regression
+    python benchmark.py --startup-only
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from logger import logger
+from config import BENCH_DIR, CLI_STARTUP_BUDGET, PARSE_ENGINE, PARSE_WORKERS, PIPELINE_QUEUE_SIZE
+
+SCENARIOS = ["batch", "stream", "search"]
+# delta mode also writes parsed/product_changes.json, so it is left out
+LOAD_MODES = ["bulk", "upsert"]
+from utils import ensure_dirs
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, RSS is not reported
+    resource = None
+
+LAST_RUN_PATH = os.path.join(BENCH_DIR, "last_run.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# metric -> +1 if higher is better, -1 if lower is better
+COMPARED_METRICS = {"rows_per_sec": 1, "seconds": -1, "peak_rss_mb": -1}
+# stage times and query latencies below these are too noisy to flag
+MIN_COMPARED_SECONDS = 0.25
+MIN_COMPARED_MS = 1.0
+
+# search scenario: queries over the synthetic descriptions, each run SEARCH_RUNS
+# times. bench_fixtures draws from ~20 words, so every query matches a large
+# share of the rows: the worst case for ranking, and the best for a LIKE scan
+SEARCH_QUERIES = [
+    "frozen fish",
+    '"fish fillets"',
+    "bone*",
+    "bovine OR swine",
+    "meat -salted",
+    "chilled boneless cuts",
+    "articles weighing exceeding",
+]
+SEARCH_RUNS = 20
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+# name -> (cli.py arguments, top-level modules the command must not import)
+STARTUP_COMMANDS = {
+    "help": (["--help"], ["pandas", "numpy", "openpyxl", "pyarrow", "requests", "mysql"]),
+    "download_help": (["download", "--help"], ["pandas", "numpy", "openpyxl", "pyarrow", "mysql"]),
+}
+STARTUP_RUNS = 7
+
+
+def peak_rss_mb():
+    """High-water RSS of this process and of its finished children, in MB."""
+    if resource is None:
+        return {"self": None, "children": None}
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    scale = 1 << 20 if sys.platform == "darwin" else 1 << 10
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def _rate(rows, seconds):
+    return round(rows / seconds, 1) if seconds else None
+
+
+def _sqlite_backend(work_dir):
+    from db import SQLiteBackend
+
+    return SQLiteBackend(os.path.join(work_dir, "hts.sqlite3"))
+
+
+def _count_products(backend):
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM product_table")
+        return cursor.fetchone()[0]
+
+
+def run_batch(base_url, work_dir, chapters, parse_workers, engine, load_mode):
+    """Download, parse and load one after the other; wall time per stage."""
+    from downloader import download_all_chapters_concurrent
+    from parser import parse_all_chapters
+    from parsed_io import parsed_path
+    from db_loader import load_csv_to_db
+
+    chapters_dir = os.path.join(work_dir, "chapters")
+    parsed_file = os.path.join(work_dir, os.path.basename(parsed_path()))
+    stages = {}
+    started = time.perf_counter()
+
+    t = time.perf_counter()
+    files = download_all_chapters_concurrent(
+        1, chapters, chapters_dir, rate=1000, burst=1000, base=base_url
+    )
+    stages["download"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    parse_all_chapters(
+        workers=parse_workers,
+        chapters_dir=chapters_dir,
+        engine=engine,
+        use_cache=False,
+        parsed_file=parsed_file,
+    )
+    stages["parse"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    backend = _sqlite_backend(work_dir)
+    load_csv_to_db(parsed_file, mode=load_mode, backend=backend)
+    stages["load"] = time.perf_counter() - t
+    rows = _count_products(backend)
+    backend.close()
+
+    seconds = time.perf_counter() - started
+    return {
+        "chapters": len(files),
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": _rate(rows, seconds),
+        "stage_seconds": {k: round(v, 3) for k, v in stages.items()},
+    }
+
+
+def run_stream(base_url, work_dir, chapters, parse_workers, engine, queue_size, load_mode):
+    """run_streaming_pipeline against the stub server and a SQLite database."""
+    from pipeline import run_streaming_pipeline
+    from parsed_io import parsed_path
+    from db_loader import ChapterLoader
+
+    backend = _sqlite_backend(work_dir)
+    with ChapterLoader(load_mode, backend=backend) as loader:
+        report = run_streaming_pipeline(
+            start_chapter=1,
+            end_chapter=chapters,
+            incremental=False,
+            queue_size=queue_size,
+            parse_workers=parse_workers,
+            engine=engine,
+            use_cache=False,
+            load_chapter=loader,
+            download_options={
+                "save_dir": os.path.join(work_dir, "chapters"),
+                "base": base_url,
+                "rate": 1000,
+                "burst": 1000,
+                "manifest_path": os.path.join(work_dir, "manifest.json"),
+            },
+            changed_file=os.path.join(
+                work_dir, os.path.basename(parsed_path("hts_changed_chapters"))
+            ),
+            record=False,
+            write_report=False,
+            checkpoint_path=None,
+            search_index=None,
+        )
+    backend.close()
+    return {
+        "chapters": report["loaded"],
+        "failed": report["failed"],
+        "rows": report["rows"],
+        "seconds": report["seconds"],
+        "rows_per_sec": _rate(report["rows"], report["seconds"]),
+        "stage_seconds": report["stage_seconds"],
+    }
+
+
+def _percentiles(ms):
+    ms = sorted(ms)
+    return {
+        "p50": round(ms[len(ms) // 2], 3),
+        "p95": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "max": round(ms[-1], 3),
+    }
+
+
+def _like_scan(conn, query):
+    """
+    The search without the index: every row whose description or path
+    contains the query's words (all of them, as ranking needs every match).
+    """
+    words = [w.strip('"*') for w in query.split() if w != "OR" and not w.startswith("-")]
+    where = " AND ".join("text LIKE ?" for _ in words)
+    return conn.execute(f"SELECT hts_code FROM product_table WHERE {where}",
+                        [f"%{w}%" for w in words]).fetchall()
+
+
+def run_search(base_url, work_dir, chapters, parse_workers, engine, runs=SEARCH_RUNS):
+    """Build and update the search index from the parsed chapters; time the queries."""
+    import sqlite3
+    from downloader import download_all_chapters_concurrent
+    from parser import parse_all_chapters
+    from parsed_io import parsed_path, read_parsed
+    from search_index import SEARCH_FIELDS, SearchIndex
+
+    chapters_dir = os.path.join(work_dir, "chapters")
+    parsed_file = os.path.join(work_dir, os.path.basename(parsed_path()))
+    download_all_chapters_concurrent(1, chapters, chapters_dir, rate=1000, burst=1000, base=base_url)
+    parse_all_chapters(workers=parse_workers, chapters_dir=chapters_dir, engine=engine,
+                       use_cache=False, parsed_file=parsed_file)
+    df = read_parsed(parsed_file)
+
+    stages = {}
+    index = SearchIndex(os.path.join(work_dir, "hts_search.sqlite3"))
+    t = time.perf_counter()
+    index.update(df, prune=True)
+    stages["build"] = time.perf_counter() - t
+    t = time.perf_counter()
+    index.update(df, prune=True)
+    stages["update_unchanged"] = time.perf_counter() - t
+    changed = df.copy()
+    first = changed.index[changed["chapter"] == 1]
+    changed.loc[first, "product"] = changed.loc[first, "product"].fillna("") + " revised"
+    t = time.perf_counter()
+    index.update(changed, prune=True)
+    stages["update_chapter"] = time.perf_counter() - t
+
+    # the table a LIKE search scans: product_table.product has no index
+    text = df[SEARCH_FIELDS].fillna("").astype(str).agg(" ".join, axis=1)
+    scan = sqlite3.connect(":memory:")
+    scan.execute("CREATE TABLE product_table (hts_code TEXT, text TEXT)")
+    scan.executemany("INSERT INTO product_table VALUES (?, ?)", zip(df["hts_code"].tolist(), text))
+
+    per_query, all_ms, like_ms = {}, [], []
+    for query in SEARCH_QUERIES:
+        ms = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            index.search(query)
+            ms.append((time.perf_counter() - t) * 1000)
+            t = time.perf_counter()
+            _like_scan(scan, query)
+            like_ms.append((time.perf_counter() - t) * 1000)
+        all_ms += ms
+        per_query[query] = {"hits": index.count(query), **_percentiles(ms)}
+    index.close()
+    scan.close()
+    return {
+        "chapters": chapters,
+        "rows": len(df),
+        "seconds": round(stages["build"], 3),
+        "rows_per_sec": _rate(len(df), stages["build"]),
+        "stage_seconds": {k: round(v, 3) for k, v in stages.items()},
+        "query_ms": _percentiles(all_ms),
+        "like_ms": _percentiles(like_ms),
+        "queries": per_query,
+    }
+
+
+def _run_scenario(name, base_url, options):
+    """Body of a scenario's process: run it in its own work dir, add peak RSS."""
+    work_dir = tempfile.mkdtemp(prefix=f"hts_bench_{name}_")
+    try:
+        if name == "batch":
+            result = run_batch(base_url, work_dir, options["chapters"],
+                               options["parse_workers"], options["engine"],
+                               options["load_mode"])
+        elif name == "search":
+            result = run_search(base_url, work_dir, options["chapters"],
+                                options["parse_workers"], options["engine"])
+        else:
+            result = run_stream(base_url, work_dir, options["chapters"],
+                                options["parse_workers"], options["engine"],
+                                options["queue_size"], options["load_mode"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def _median_seconds(command, runs):
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        times.append(time.perf_counter() - t)
+    return sorted(times)[len(times) // 2]
+
+
+def _imported_modules(command):
+    """Top-level modules a command imports, from python -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command[1:],
+        capture_output=True, text=True, check=True,
+    ).stderr
+    return {
+        line.rsplit("|", 1)[-1].strip().split(".")[0]
+        for line in stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+def measure_startup(runs=STARTUP_RUNS, budget=CLI_STARTUP_BUDGET):
+    """
+    Median wall time of each STARTUP_COMMANDS command in a fresh
+    interpreter, its overhead over `python -c pass`, and the forbidden
+    modules it imported. within_budget when `--help` stays within budget
+    and no command imported a forbidden module.
+    """
+    interpreter = _median_seconds([sys.executable, "-c", "pass"], runs)
+    commands = {}
+    for name, (args, forbidden) in STARTUP_COMMANDS.items():
+        command = [sys.executable, CLI_PATH] + args
+        seconds = _median_seconds(command, runs)
+        commands[name] = {
+            "seconds": round(seconds, 4),
+            "overhead_seconds": round(seconds - interpreter, 4),
+            "heavy_imports": sorted(_imported_modules(command) & set(forbidden)),
+        }
+    return {
+        "interpreter_seconds": round(interpreter, 4),
+        "budget_seconds": budget,
+        "commands": commands,
+        "within_budget": commands["help"]["overhead_seconds"] <= budget
+        and not any(c["heavy_imports"] for c in commands.values()),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    chapters=10,
+    rows_per_chapter=2000,
+    scenarios=SCENARIOS,
+    parse_workers=PARSE_WORKERS,
+    engine=PARSE_ENGINE,
+    queue_size=PIPELINE_QUEUE_SIZE,
+    seed=0,
+    load_mode="bulk",
+):
+    """Time the CLI start-up, generate the synthetic chapters, serve them and run each scenario."""
+    from bench_fixtures import StubHtsServer, write_synthetic_chapters
+
+    options = {
+        "chapters": chapters,
+        "rows_per_chapter": rows_per_chapter,
+        "parse_workers": parse_workers,
+        "engine": engine,
+        "queue_size": queue_size,
+        "seed": seed,
+        "load_mode": load_mode,
+    }
+    result = {
+        "run_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options,
+        "startup": measure_startup(),
+        "scenarios": {},
+    }
+    source_dir = tempfile.mkdtemp(prefix="hts_bench_source_")
+    try:
+        t = time.perf_counter()
+        written = write_synthetic_chapters(source_dir, chapters, rows_per_chapter, seed)
+        result["generate_seconds"] = round(time.perf_counter() - t, 3)
+        result["source_rows"] = sum(written.values())
+
+        with StubHtsServer(source_dir) as server:
+            for name in scenarios:
+                logger.info(f"Benchmark scenario {name}: {chapters} chapters x {rows_per_chapter} rows")
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result["scenarios"][name] = pool.submit(
+                        _run_scenario, name, server.base_url, options
+                    ).result()
+            result["server"] = dict(server.stats)
+    finally:
+        shutil.rmtree(source_dir, ignore_errors=True)
+    return result
+
+
+def save_result(result, path):
+    ensure_dirs(os.path.dirname(path))
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(result, fh, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_result(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _metrics(scenario):
+    """Flat {metric: value} of one scenario result, for comparison."""
+    values = {
+        "rows_per_sec": scenario.get("rows_per_sec"),
+        "seconds": scenario.get("seconds"),
+        "peak_rss_mb": (scenario.get("peak_rss_mb") or {}).get("self"),
+    }
+    for stage, seconds in scenario.get("stage_seconds", {}).items():
+        values[f"stage_seconds.{stage}"] = seconds
+    for stat, ms in scenario.get("query_ms", {}).items():
+        values[f"query_ms.{stat}"] = ms
+    return values
+
+
+def compare_results(current, baseline, tolerance=0.15):
+    """
+    Compare every metric of every scenario in both results. A metric is a
+    regression when it is worse than the baseline by more than tolerance
+    (a fraction). Returns a list of {scenario, metric, baseline, current,
+    change, regression} with change as a signed fraction of the baseline.
+    """
+    rows = []
+    for name, scenario in current["scenarios"].items():
+        if name not in baseline.get("scenarios", {}):
+            continue
+        old = _metrics(baseline["scenarios"][name])
+        for metric, value in _metrics(scenario).items():
+            before = old.get(metric)
+            if value is None or not before:
+                continue
+            direction = COMPARED_METRICS.get(metric, -1)
+            change = (value - before) / before
+            noisy = (
+                metric.startswith("stage_seconds.") and max(value, before) < MIN_COMPARED_SECONDS
+                or metric.startswith("query_ms.") and max(value, before) < MIN_COMPARED_MS
+            )
+            rows.append({
+                "scenario": name,
+                "metric": metric,
+                "baseline": before,
+                "current": value,
+                "change": round(change, 4),
+                "regression": not noisy and change * direction < -tolerance,
+            })
+    return rows
+
+
+def format_startup(startup):
+    lines = [
+        f"CLI start-up (interpreter {startup['interpreter_seconds']}s, "
+        f"budget +{startup['budget_seconds']}s for --help): "
+        + ("within budget" if startup["within_budget"] else "OVER BUDGET")
+    ]
+    for name, c in startup["commands"].items():
+        heavy = f"; imports {', '.join(c['heavy_imports'])}" if c["heavy_imports"] else ""
+        lines.append(f"  {name:<13} {c['seconds']}s (+{c['overhead_seconds']}s){heavy}")
+    return "\n".join(lines)
+
+
+def format_result(result):
+    lines = [
+        format_startup(result["startup"]),
+        f"{result['options']['chapters']} chapters, {result['source_rows']} source rows "
+        f"(generated in {result['generate_seconds']}s), commit {result['commit']}",
+    ]
+    for name, s in result["scenarios"].items():
+        stages = ", ".join(f"{k} {v}s" for k, v in s["stage_seconds"].items())
+        rss = s["peak_rss_mb"]
+        lines.append(
+            f"  {name:<7} {s['rows']} rows in {s['seconds']}s = {s['rows_per_sec']} rows/sec; "
+            f"{stages}; peak RSS {rss['self']} MB (workers {rss['children']} MB)"
+        )
+        if "query_ms" in s:
+            q, like = s["query_ms"], s["like_ms"]
+            lines.append(
+                f"          query p50 {q['p50']} ms, p95 {q['p95']} ms, max {q['max']} ms "
+                f"(LIKE scan p50 {like['p50']} ms, p95 {like['p95']} ms)"
+            )
+    return "\n".join(lines)
+
+
+def format_comparison(rows, tolerance):
+    lines = [f"Against baseline (tolerance {tolerance:.0%}):"]
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        lines.append(
+            f"  {r['scenario']:<7} {r['metric']:<22} {r['baseline']:>12} -> "
+            f"{r['current']:>12} ({r['change']:+.1%}){flag}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline pipeline benchmark with synthetic chapters.")
+    ap.add_argument("--chapters", type=int, default=10)
+    ap.add_argument("--rows", type=int, default=2000, help="data rows per chapter workbook")
+    ap.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    ap.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    ap.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--load-mode", choices=LOAD_MODES, default="bulk",
+                    help="db_loader mode used to load the SQLite database")
+    ap.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare with")
+    ap.add_argument("--save-baseline", action="store_true",
+                    help="store this run as the baseline")
+    ap.add_argument("--tolerance", type=float, default=0.15,
+                    help="allowed fraction a metric may worsen before it is a regression")
+    ap.add_argument("--fail-on-regression", action="store_true",
+                    help="exit with status 1 when a metric regressed or the CLI start-up is over budget")
+    ap.add_argument("--startup-only", action="store_true",
+                    help="only time the CLI start-up (no scenarios, not saved)")
+    args = ap.parse_args(argv)
+
+    if args.startup_only:
+        startup = measure_startup()
+        print(format_startup(startup))
+        sys.exit(1 if args.fail_on_regression and not startup["within_budget"] else 0)
+
+    result = run_benchmark(
+        chapters=args.chapters,
+        rows_per_chapter=args.rows,
+        scenarios=args.scenario,
+        parse_workers=args.parse_workers,
+        queue_size=args.queue_size,
+        seed=args.seed,
+        load_mode=args.load_mode,
+    )
+    save_result(result, LAST_RUN_PATH)
+    print(format_result(result))
+
+    regressed = not result["startup"]["within_budget"]
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        baseline = load_result(args.baseline)
+        if baseline["options"] != result["options"]:
+            print(f"Baseline {args.baseline} was run with other options "
+                  f"({baseline['options']}); not compared.")
+        else:
+            rows = compare_results(result, baseline, args.tolerance)
+            print(format_comparison(rows, args.tolerance))
+            regressed = regressed or any(r["regression"] for r in rows)
+    if args.save_baseline:
+        print(f"Baseline saved to {save_result(result, args.baseline)}")
+    sys.exit(1 if regressed and args.fail_on_regression else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# checkpoint.py
+"""
+Checkpoint journal of a pipeline run, continued by `pipeline.py --resume`.
+
+The journal (config.CHECKPOINT_PATH, revisions/run_journal.jsonl) is an
+append-only JSON-lines file with one record per finished unit of work.
+Each record is flushed and fsynced before the pipeline moves on, so a
+crash loses at most the unit in progress:
+
+    {"event": "start", "run": ..., "params": {...}}
+    {"stage": "download", "chapter": 84, "status": "changed", "path": ..., "sha256": ...}
+    {"stage": "parse", "chapters": [...], "path": ..., "sha256": ...}
+    {"stage": "revision", "chapters": [...]}
+    {"stage": "load", "chapters": [...], "sha256": ..., "rows": n}     a committed batch
+    {"stage": "load", "chapters": [...], "status": "done"}
+    {"event": "finish", "status": "ok" | "partial" | "failed"}
+
+Replaying the records gives the run's RunState. A run that did not finish
+"ok" can be resumed: loaded chapters are skipped, downloaded chapters
+whose files are unchanged are not fetched again, a parse of the same
+chapters is reused and a load continues after its last committed batch.
+A torn last line (the process died mid-write) is dropped.
+"""
+import os
+import json
+import threading
+from datetime import datetime, timezone
+
+from logger import logger
+from config import CHECKPOINT_PATH
+from utils import ensure_dirs, file_sha256
+
+DOWNLOADED = ("changed", "unchanged")
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def file_intact(path, sha256):
+    """True if path exists with the recorded content hash."""
+    return bool(path) and os.path.exists(path) and (sha256 is None or file_sha256(path) == sha256)
+
+
+class RunState:
+    """The progress of one run, rebuilt from its journal records."""
+
+    def __init__(self):
+        self.run = None
+        self.params = {}
+        self.finished = None  # status of the finish record, None while running
+        self.downloads = {}  # chapter -> last download record
+        self.parse = None  # last parse record
+        self.revisions = set()  # chapter tuples recorded in the revision store
+        self.load_rows = {}  # parsed-file sha256 -> product rows committed
+        self.loaded = set()  # chapters whose load finished
+
+    def apply(self, record):
+        event, stage = record.get("event"), record.get("stage")
+        if event == "start":
+            self.run, self.params = record["run"], record.get("params", {})
+        elif event == "finish":
+            self.finished = record["status"]
+        elif stage == "download":
+            self.downloads[record["chapter"]] = record
+        elif stage == "parse":
+            self.parse = record
+        elif stage == "revision":
+            self.revisions.add(tuple(record["chapters"]))
+        elif stage == "load" and record.get("status") == "done":
+            self.loaded.update(record["chapters"])
+        elif stage == "load":
+            self.load_rows[record["sha256"]] = record["rows"]
+
+    def downloaded(self, chapter):
+        """The chapter's download record if it needs no new download, else None."""
+        record = self.downloads.get(chapter)
+        if record is None or record["status"] not in DOWNLOADED:
+            return None
+        if record["status"] == "changed" and not file_intact(record["path"], record.get("sha256")):
+            return None
+        return record
+
+    def parsed(self, chapters):
+        """Path of an intact parse of exactly these chapters, or None."""
+        record = self.parse
+        if record and record["chapters"] == list(chapters) and file_intact(record["path"], record["sha256"]):
+            return record["path"]
+        return None
+
+
+class CheckpointJournal:
+    """Writer of the journal; use as a context manager after open()."""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.state = RunState()
+        self._fh = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def read(path=CHECKPOINT_PATH):
+        """(RunState, bytes of whole records) of the journal at path."""
+        state = RunState()
+        with open(path, "rb") as fh:
+            data = fh.read()
+        good = data[: data.rfind(b"\n") + 1]
+        for line in good.splitlines():
+            if line.strip():
+                state.apply(json.loads(line))
+        return state, len(good)
+
+    def open(self, params, resume=False):
+        """
+        Start journaling a run with params. With resume, continue the
+        journaled run instead when it did not finish ok and has the same
+        mode; returns True in that case. A new run replaces the journal.
+        """
+        if resume:
+            previous, size = self.read(self.path) if os.path.exists(self.path) else (RunState(), 0)
+            if previous.run is None or previous.finished == "ok":
+                logger.info("Nothing to resume: the last run finished. Starting a new run.")
+            elif previous.params.get("mode") != params.get("mode"):
+                logger.warning(
+                    f"The journaled run is a {previous.params.get('mode')} run, not "
+                    f"{params.get('mode')}; starting a new run."
+                )
+            else:
+                self.state = previous
+                self._fh = open(self.path, "r+", encoding="utf-8")
+                self._fh.truncate(size)  # drop a torn last line
+                self._fh.seek(size)
+                self.record(event="resume")
+                logger.info(
+                    f"Resuming run {previous.run}: {len(previous.loaded)} chapters loaded, "
+                    f"{sum(1 for ch in previous.downloads if previous.downloaded(ch))} downloaded"
+                )
+                return True
+        ensure_dirs(os.path.dirname(self.path) or ".")
+        self.state = RunState()
+        self._fh = open(self.path, "w", encoding="utf-8")
+        self.record(event="start", run=_utc_now(), params=params)
+        return False
+
+    def record(self, **entry):
+        """Append one record durably and apply it to the state."""
+        entry["at"] = _utc_now()
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self.state.apply(entry)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
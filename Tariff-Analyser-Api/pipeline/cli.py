@@ -0,0 +1,72 @@
+# cli.py
+"""
+One entry point for the pipeline's commands:
+
+    python cli.py download 1 10 --sync
+    python cli.py parse --stream
+    python cli.py load --mode delta
+    python cli.py run --stream
+    python cli.py diff previous latest --out diff.csv
+    python cli.py search "frozen shrimp"
+    python cli.py bench --chapters 5
+
+A command runs the main() of its module with the remaining arguments,
+so `cli.py <command> --help` lists the same options as running the
+module directly. The module is imported only when its command runs:
+`cli.py --help` loads the standard library and nothing else (no
+pandas, openpyxl, requests or database driver), and `download` never
+loads pandas. No module creates or opens anything on import: logs/ and
+automation.log appear with the first log record, and the data
+directories when something is written to them. benchmark.py measures
+the start-up time against config.CLI_STARTUP_BUDGET.
+"""
+import os
+import sys
+import argparse
+import importlib
+
+# command -> (module, arguments put before the user's, summary)
+COMMANDS = {
+    "download": ("downloader", [], "download chapter workbooks (--sync: only changed chapters)"),
+    "parse": ("parser", [], "parse the workbooks into parsed/hts_all_chapters"),
+    "load": ("db_loader", [], "load the parsed file into product_table"),
+    "parsed": ("parsed_io", [], "inspect a parsed file or export it as CSV"),
+    "run": ("pipeline", [], "download, parse and load (--stream: overlapped per chapter)"),
+    "diff": ("revision_store", ["diff"], "compare two stored revisions"),
+    "revisions": ("revision_store", [], "list or save revisions"),
+    "bench": ("benchmark", [], "offline benchmark with synthetic chapters"),
+    "index": ("hts_index", [], "build or query the HTS prefix index"),
+    "search": ("search_index", [], "full-text search of product descriptions"),
+    "load-impact": ("tariff_impact_analyser", [], "load the impact-analysis workbooks"),
+    "impact": ("impact_engine", [], "precompute or query tariff impact answers"),
+    "cube": ("impact_cube", [], "refresh or query the impact cube"),
+    "fx": ("fx", [], "convert amounts with the FX rate table"),
+}
+
+
+def build_parser():
+    width = max(map(len, COMMANDS))
+    listing = "\n".join(f"  {name:<{width}}  {summary}" for name, (_, _, summary) in COMMANDS.items())
+    ap = argparse.ArgumentParser(
+        description="HTS tariff pipeline.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"commands:\n{listing}\n\n`%(prog)s <command> --help` lists a command's options.",
+    )
+    ap.add_argument("command", choices=COMMANDS, metavar="command", help="one of the commands below")
+    ap.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the command")
+    return ap
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    module_name, leading, _ = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    # the command's usage and errors read "cli.py <command>" (a module's own
+    # subcommand, given as leading arguments, adds its name itself)
+    prog = os.path.basename(sys.argv[0])
+    sys.argv[0] = prog if leading else f"{prog} {args.command}"
+    return module.main(leading + args.args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 # config.py
 
 import os
+import json
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 REVISIONS_DIR = os.path.join(BASE_DIR, "revisions")
@@ -11,6 +12,35 @@ LOG_DIR = os.path.join(BASE_DIR, "logs")
 # Optional: base URL used by downloader
 HTS_ARCHIVE_URL = "https://hts.usitc.gov/"
 
+# Downloader: concurrent chapter downloads sharing one pooled session
+# (1 worker = the original sequential loop)
+DOWNLOAD_WORKERS = int(os.environ.get("HTS_DOWNLOAD_WORKERS", 4))
+# Downloader: token-bucket limit on requests to hts.usitc.gov
+DOWNLOAD_RATE = float(os.environ.get("HTS_DOWNLOAD_RATE", 4.0))  # requests/sec
+DOWNLOAD_BURST = int(os.environ.get("HTS_DOWNLOAD_BURST", 4))
+# Downloader: attempts per request (exponential backoff with jitter from
+# DOWNLOAD_RETRY_DELAY seconds) and the circuit breaker that stops calling the
+# site for CIRCUIT_RESET_SECONDS after CIRCUIT_FAILURES failures in a row
+DOWNLOAD_RETRIES = int(os.environ.get("HTS_DOWNLOAD_RETRIES", 4))
+DOWNLOAD_RETRY_DELAY = float(os.environ.get("HTS_DOWNLOAD_RETRY_DELAY", 2.0))
+CIRCUIT_FAILURES = int(os.environ.get("HTS_CIRCUIT_FAILURES", 8))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("HTS_CIRCUIT_RESET_SECONDS", 120))
+# Downloader: per-chapter range/validator/hash records for incremental sync
+MANIFEST_PATH = os.path.join(REVISIONS_DIR, "chapter_manifest.json")
+# Pipeline: checkpoint journal of the last run, continued by `pipeline.py --resume`
+CHECKPOINT_PATH = os.environ.get("HTS_CHECKPOINT_PATH", os.path.join(REVISIONS_DIR, "run_journal.jsonl"))
+
+# Parser: number of worker processes used to parse chapter workbooks
+# (1 = parse sequentially in the current process)
+PARSE_WORKERS = int(os.environ.get("HTS_PARSE_WORKERS", os.cpu_count() or 1))
+# Parser: hierarchy resolution engine ("vectorized" or the row-by-row "loop")
+PARSE_ENGINE = os.environ.get("HTS_PARSE_ENGINE", "vectorized")
+# Parser: sheet rows per batch for the streaming (bounded-memory) reader
+PARSE_BATCH_SIZE = int(os.environ.get("HTS_PARSE_BATCH_SIZE", 2000))
+# Parser: per-chapter cache of parsed rows keyed by workbook SHA-256
+PARSE_CACHE = os.environ.get("HTS_PARSE_CACHE", "1") != "0"
+PARSE_CACHE_DIR = os.path.join(PARSED_DIR, "cache")
+
 # MySQL connection (same as Sequelize config)
 DB_CONFIG = {
     "host": "127.0.0.1",
@@ -19,3 +49,64 @@ DB_CONFIG = {
     "password": "Gayu_1999",
     "database": "trump_tariff_db",
 }
+# Database backend (db.py): "mysql" or "sqlite" (a local file, no server needed),
+# and the number of pooled connections shared by all loaders in a process
+DB_BACKEND = "mysql"
+DB_POOL_SIZE = 4
+SQLITE_PATH = os.path.join(PARSED_DIR, "hts.sqlite3")
+
+# Optional JSON settings file: DB_CONFIG keys plus "backend", "pool_size",
+# "sqlite_path"; HTS_DB_* environment variables take precedence over it
+_DB_SETTINGS_FILE = os.environ.get("HTS_DB_CONFIG_FILE")
+if _DB_SETTINGS_FILE:
+    with open(_DB_SETTINGS_FILE, encoding="utf-8") as _fh:
+        _settings = json.load(_fh)
+    DB_BACKEND = _settings.pop("backend", DB_BACKEND)
+    DB_POOL_SIZE = int(_settings.pop("pool_size", DB_POOL_SIZE))
+    SQLITE_PATH = _settings.pop("sqlite_path", SQLITE_PATH)
+    DB_CONFIG.update(_settings)
+for _key, _env in [
+    ("host", "HTS_DB_HOST"),
+    ("port", "HTS_DB_PORT"),
+    ("user", "HTS_DB_USER"),
+    ("password", "HTS_DB_PASSWORD"),
+    ("database", "HTS_DB_NAME"),
+]:
+    if _env in os.environ:
+        DB_CONFIG[_key] = int(os.environ[_env]) if _key == "port" else os.environ[_env]
+DB_BACKEND = os.environ.get("HTS_DB_BACKEND", DB_BACKEND)
+DB_POOL_SIZE = int(os.environ.get("HTS_DB_POOL_SIZE", DB_POOL_SIZE))
+SQLITE_PATH = os.environ.get("HTS_SQLITE_PATH", SQLITE_PATH)
+
+# DB loader: "bulk" (LOAD DATA LOCAL INFILE + staging table), "upsert" (executemany)
+# or "delta" (only rows whose content fingerprint changed)
+DB_LOAD_MODE = os.environ.get("HTS_DB_LOAD_MODE", "bulk")
+# HTS prefix index (hts_index.py) built from the parsed CSV
+HTS_INDEX_PATH = os.path.join(PARSED_DIR, "hts_index.pkl")
+# Full-text product search (search_index.py): SQLite FTS5 sidecar updated by the
+# pipeline after each load (HTS_SEARCH_INDEX=0 to skip the update)
+SEARCH_INDEX_PATH = os.environ.get("HTS_SEARCH_INDEX_PATH", os.path.join(PARSED_DIR, "hts_search.sqlite3"))
+SEARCH_INDEX = os.environ.get("HTS_SEARCH_INDEX", "1") != "0"
+# Tariff impact engine (impact_engine.py): typed columns of the tariff dataset
+IMPACT_COLUMNS_PATH = os.path.join(PARSED_DIR, "tariff_columns.npz")
+# FX conversion (fx.py): rates file (currency, date, units per 1 FX_BASE_CURRENCY),
+# its cached array form, the size of the conversion LRU cache, and the currencies
+# ingestion adds converted amount columns for (comma-separated, e.g. "EUR,GBP")
+FX_RATES_PATH = os.environ.get("HTS_FX_RATES", os.path.join(PARSED_DIR, "fx_rates.csv"))
+FX_TABLE_PATH = os.path.join(PARSED_DIR, "fx_rates.npz")
+FX_BASE_CURRENCY = "USD"
+FX_CACHE_SIZE = int(os.environ.get("HTS_FX_CACHE_SIZE", 4096))
+FX_CONVERT = [c.strip().upper() for c in os.environ.get("HTS_FX_CONVERT", "").split(",") if c.strip()]
+# Parser -> loader handoff format: "parquet" (typed, dictionary-encoded) or "csv"
+PARSED_FORMAT = os.environ.get("HTS_PARSED_FORMAT", "parquet")
+# Streaming pipeline: max chapters waiting between download/parse/load stages
+PIPELINE_QUEUE_SIZE = int(os.environ.get("HTS_PIPELINE_QUEUE_SIZE", 4))
+# Offline benchmark suite (benchmark.py): last run and saved baselines
+BENCH_DIR = os.path.join(BASE_DIR, "benchmarks")
+# Start-up budget of the unified CLI (cli.py), checked by benchmark.py: seconds
+# `cli.py --help` may take on top of starting a bare interpreter
+CLI_STARTUP_BUDGET = float(os.environ.get("HTS_CLI_STARTUP_BUDGET", 0.05))
+# Metrics (metrics.py): JSON report of the last pipeline run, and an optional
+# Prometheus textfile-collector export (e.g. /var/lib/node_exporter/textfile/hts.prom)
+RUN_REPORT_PATH = os.environ.get("HTS_RUN_REPORT", os.path.join(LOG_DIR, "run_report.json"))
+PROMETHEUS_TEXTFILE = os.environ.get("HTS_PROMETHEUS_TEXTFILE") or None
@@ -0,0 +1,531 @@
+# db.py
+"""
+Shared database access for the loaders (db_loader, load_csv_to_mysql,
+tariff_impact_analyser).
+
+    from db import get_backend
+    backend = get_backend()
+    with backend.connection() as conn:
+        backend.create_table(conn, "t", [("code", "VARCHAR(32)")], primary_key=["code"])
+        conn.cursor().executemany(backend.upsert_sql("t", ["code"], "code", []), rows)
+        conn.commit()
+
+Two backends with the same API, chosen by config.DB_BACKEND:
+
+    mysql   mysql.connector connection pool; bulk loads with LOAD DATA
+            LOCAL INFILE, table swaps with one atomic RENAME TABLE.
+    sqlite  a local file (config.SQLITE_PATH), for laptops and benchmarks
+            without a MySQL server; bulk loads with executemany in one
+            transaction, table swaps in one transaction.
+
+Connections come from a pool of config.DB_POOL_SIZE per backend and
+process, so every stage of a pipeline run reuses the same connections.
+Connections handed out are wrappers exposing the DB-API connection
+(cursor, commit, rollback) plus .backend. Column types are written in
+MySQL syntax; the SQLite backend maps what SQLite does not accept.
+"""
+import os
+import re
+import queue
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from logger import logger
+from config import DB_BACKEND, DB_CONFIG, DB_POOL_SIZE, SQLITE_PATH
+
+TEXT_TYPES = {"TEXT", "MEDIUMTEXT", "LONGTEXT"}
+# MySQL can only index a prefix of TEXT columns (191 chars fits utf8mb4 in 767 bytes)
+TEXT_INDEX_PREFIX = 191
+# CREATE [UNIQUE] INDEX name ON table (columns) as stored in sqlite_master
+_INDEX_SQL = re.compile(r"CREATE\s+(UNIQUE\s+)?INDEX\s.*?\sON\s+\S+\s*(\(.*\))\s*$", re.S | re.I)
+_ON_UPDATE = re.compile(r"\s+ON UPDATE CURRENT_TIMESTAMP", re.I)
+
+
+def quote(name):
+    """Backtick-quoted identifier (accepted by MySQL and SQLite)."""
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+def _column_list(columns):
+    return ", ".join(quote(c) for c in columns)
+
+
+def row_tuples(df):
+    """Row tuples for executemany, with NULLs as None."""
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+class _Connection:
+    """A pooled DB-API connection that knows its backend."""
+
+    def __init__(self, raw, backend):
+        self.raw = raw
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class Backend:
+    """Connection pool and SQL dialect of one database."""
+
+    name = None
+    placeholder = "%s"
+    Error = Exception
+
+    def __init__(self, pool_size=DB_POOL_SIZE):
+        self.pool_size = max(1, pool_size)
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+
+    # ---------- connections ----------
+
+    def _acquire(self):
+        raise NotImplementedError
+
+    def _release(self, raw):
+        raise NotImplementedError
+
+    def ping(self, conn):
+        """Make sure conn is usable (reconnect if the server dropped it)."""
+
+    @contextmanager
+    def connection(self):
+        """
+        A pooled connection for the block; blocks while all pool_size
+        connections are in use. Uncommitted work is rolled back if the
+        block raises.
+        """
+        self._slots.acquire()
+        raw = None
+        try:
+            raw = self._acquire()
+            conn = _Connection(raw, self)
+            self.ping(conn)
+            try:
+                yield conn
+            except BaseException:
+                try:
+                    raw.rollback()
+                except self.Error:
+                    pass
+                raise
+        finally:
+            if raw is not None:
+                self._release(raw)
+            self._slots.release()
+
+    def close(self):
+        """Close the pooled connections."""
+
+    # ---------- SQL ----------
+
+    def placeholders(self, n):
+        return ", ".join([self.placeholder] * n)
+
+    def insert_sql(self, table, columns):
+        return (
+            f"INSERT INTO {quote(table)} ({_column_list(columns)}) "
+            f"VALUES ({self.placeholders(len(columns))})"
+        )
+
+    def upsert_sql(self, table, columns, key, update_columns, touch=None, add_columns=()):
+        """
+        INSERT of one row per parameter tuple that updates update_columns
+        (and sets the touch column to the current time) when the key
+        column(s) already exist. add_columns are incremented by the new
+        value instead of replaced (running totals).
+        """
+        raise NotImplementedError
+
+    def upsert_select_sql(self, table, columns, source, key, update_columns, touch=None):
+        """Like upsert_sql, with the rows taken from the table source."""
+        raise NotImplementedError
+
+    # ---------- schema ----------
+
+    def create_table(self, conn, table, columns, primary_key=None, auto_id=False,
+                     indexes=(), if_not_exists=True):
+        """
+        columns: [(name, MySQL type)]; auto_id adds an auto-increment id
+        primary key; indexes: [(index name, [columns])].
+        """
+        raise NotImplementedError
+
+    def table_exists(self, conn, table):
+        raise NotImplementedError
+
+    def table_columns(self, conn, table):
+        """Column names of table (empty if it does not exist)."""
+        raise NotImplementedError
+
+    def add_columns(self, conn, table, columns, indexes=()):
+        """ALTER table to add columns [(name, type)] and indexes [(name, [columns])]."""
+        raise NotImplementedError
+
+    def create_table_like(self, conn, table, source):
+        """Empty copy of source (columns, keys, indexes) named table."""
+        raise NotImplementedError
+
+    def swap_tables(self, conn, swaps):
+        """
+        Atomically replace each live table by its new copy ({live: new});
+        the new tables take the live names, the old contents are dropped.
+        Live tables that do not exist yet are simply created from new.
+        """
+        raise NotImplementedError
+
+    def drop_table(self, conn, table):
+        conn.cursor().execute(f"DROP TABLE IF EXISTS {quote(table)}")
+
+    # ---------- bulk writes ----------
+
+    def insert_many(self, conn, table, columns, records, batch_size=1000):
+        """executemany INSERT in batch_size chunks; returns the row count."""
+        sql = self.insert_sql(table, columns)
+        cursor = conn.cursor()
+        for i in range(0, len(records), batch_size):
+            cursor.executemany(sql, records[i : i + batch_size])
+        return len(records)
+
+    def bulk_load(self, conn, table, df, nullable=()):
+        """
+        Fastest way to append df (columns named like the table's) to
+        table and commit. Empty strings in nullable columns become NULL.
+        Raises self.Error when the server refuses; callers fall back to
+        insert_many.
+        """
+        raise NotImplementedError
+
+
+class MySQLBackend(Backend):
+    name = "mysql"
+    placeholder = "%s"
+
+    def __init__(self, config=None, pool_size=DB_POOL_SIZE):
+        try:
+            import mysql.connector
+            from mysql.connector import pooling
+        except ImportError as e:
+            raise ImportError(
+                "The mysql backend needs mysql-connector-python "
+                "(pip install mysql-connector-python), or set HTS_DB_BACKEND=sqlite"
+            ) from e
+        super().__init__(min(pool_size, pooling.CNX_POOL_MAXSIZE))
+        self.Error = mysql.connector.Error
+        # local infile is only used by bulk_load; the server still has to allow it
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name=f"hts_{id(self)}",
+            pool_size=self.pool_size,
+            pool_reset_session=True,
+            allow_local_infile=True,
+            **(config or DB_CONFIG),
+        )
+
+    def _acquire(self):
+        return self._pool.get_connection()
+
+    def _release(self, raw):
+        raw.close()  # hands a pooled connection back to the pool
+
+    def ping(self, conn):
+        conn.raw.ping(reconnect=True, attempts=3, delay=1)
+
+    def upsert_sql(self, table, columns, key, update_columns, touch=None, add_columns=()):
+        updates = [f"{quote(c)} = VALUES({quote(c)})" for c in update_columns]
+        updates += [f"{quote(c)} = {quote(c)} + VALUES({quote(c)})" for c in add_columns]
+        if touch:
+            updates.append(f"{quote(touch)} = CURRENT_TIMESTAMP")
+        return f"{self.insert_sql(table, columns)} ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+
+    def upsert_select_sql(self, table, columns, source, key, update_columns, touch=None):
+        updates = [f"{quote(c)} = s.{quote(c)}" for c in update_columns]
+        if touch:
+            updates.append(f"{quote(touch)} = CURRENT_TIMESTAMP")
+        return (
+            f"INSERT INTO {quote(table)} ({_column_list(columns)}) "
+            f"SELECT * FROM (SELECT {_column_list(columns)} FROM {quote(source)}) AS s "
+            f"ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+        )
+
+    def create_table(self, conn, table, columns, primary_key=None, auto_id=False,
+                     indexes=(), if_not_exists=True):
+        types = dict(columns)
+        lines = ["`id` INT AUTO_INCREMENT PRIMARY KEY"] if auto_id else []
+        lines += [f"{quote(name)} {sql_type}" for name, sql_type in columns]
+        if primary_key:
+            lines.append(f"PRIMARY KEY ({_column_list(primary_key)})")
+        for index, cols in indexes:
+            parts = [
+                quote(c) + (f"({TEXT_INDEX_PREFIX})" if types.get(c) in TEXT_TYPES else "")
+                for c in cols
+            ]
+            lines.append(f"INDEX {quote(index)} ({', '.join(parts)})")
+        exists = "IF NOT EXISTS " if if_not_exists else ""
+        conn.cursor().execute(
+            f"CREATE TABLE {exists}{quote(table)} (\n  " + ",\n  ".join(lines)
+            + "\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        )
+
+    def table_exists(self, conn, table):
+        cursor = conn.cursor()
+        cursor.execute("SHOW TABLES LIKE %s", (table,))
+        return cursor.fetchone() is not None
+
+    def table_columns(self, conn, table):
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT COLUMN_NAME FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+            """,
+            (table,),
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def add_columns(self, conn, table, columns, indexes=()):
+        changes = [f"ADD COLUMN {quote(name)} {sql_type}" for name, sql_type in columns]
+        changes += [f"ADD INDEX {quote(name)} ({_column_list(cols)})" for name, cols in indexes]
+        if changes:
+            conn.cursor().execute(f"ALTER TABLE {quote(table)} {', '.join(changes)}")
+
+    def create_table_like(self, conn, table, source):
+        conn.cursor().execute(f"CREATE TABLE {quote(table)} LIKE {quote(source)}")
+
+    def swap_tables(self, conn, swaps):
+        cursor = conn.cursor()
+        renames, dropped = [], []
+        for live, new in swaps.items():
+            if self.table_exists(conn, live):
+                old = f"{live}_old"
+                cursor.execute(f"DROP TABLE IF EXISTS {quote(old)}")
+                renames.append(f"{quote(live)} TO {quote(old)}")
+                dropped.append(old)
+            renames.append(f"{quote(new)} TO {quote(live)}")
+        # one RENAME TABLE statement is atomic across all the tables
+        cursor.execute("RENAME TABLE " + ", ".join(renames))
+        for old in dropped:
+            cursor.execute(f"DROP TABLE {quote(old)}")
+        conn.commit()
+
+    def bulk_load(self, conn, table, df, nullable=()):
+        """LOAD DATA LOCAL INFILE from a temporary CSV."""
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{table}_", suffix=".csv")
+        os.close(fd)
+        try:
+            df.to_csv(tmp_path, index=False, encoding="utf-8", lineterminator="\n")
+            column_list = ", ".join(f"@{c}" if c in nullable else quote(c) for c in df.columns)
+            nullifs = ", ".join(f"{quote(c)} = NULLIF(@{c}, '')" for c in nullable)
+            conn.cursor().execute(
+                f"""
+                LOAD DATA LOCAL INFILE %s INTO TABLE {quote(table)}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+                LINES TERMINATED BY '\\n'
+                IGNORE 1 LINES
+                ({column_list})
+                {"SET " + nullifs if nullifs else ""}
+                """,
+                (tmp_path,),
+            )
+            conn.commit()
+        finally:
+            os.remove(tmp_path)
+        return len(df)
+
+
+class SQLiteBackend(Backend):
+    name = "sqlite"
+    placeholder = "?"
+    Error = sqlite3.Error
+
+    def __init__(self, path=SQLITE_PATH, pool_size=DB_POOL_SIZE):
+        # every connection to ":memory:" would be a separate database
+        super().__init__(1 if path == ":memory:" else pool_size)
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        raw = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._all.append(raw)
+        return raw
+
+    def _release(self, raw):
+        self._idle.put(raw)
+
+    def close(self):
+        with self._lock:
+            for raw in self._all:
+                raw.close()
+            self._all.clear()
+        self._idle = queue.LifoQueue()
+
+    def _updates(self, update_columns, touch, add_columns=()):
+        updates = [f"{quote(c)} = excluded.{quote(c)}" for c in update_columns]
+        updates += [f"{quote(c)} = {quote(c)} + excluded.{quote(c)}" for c in add_columns]
+        if touch:
+            updates.append(f"{quote(touch)} = CURRENT_TIMESTAMP")
+        return ", ".join(updates)
+
+    def _conflict(self, key, update_columns, touch, add_columns=()):
+        keys = [key] if isinstance(key, str) else list(key)
+        updates = self._updates(update_columns, touch, add_columns)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return f"ON CONFLICT ({_column_list(keys)}) {action}"
+
+    def upsert_sql(self, table, columns, key, update_columns, touch=None, add_columns=()):
+        conflict = self._conflict(key, update_columns, touch, add_columns)
+        return f"{self.insert_sql(table, columns)} {conflict}"
+
+    def upsert_select_sql(self, table, columns, source, key, update_columns, touch=None):
+        # "WHERE true" keeps the parser from reading ON CONFLICT as a join clause
+        return (
+            f"INSERT INTO {quote(table)} ({_column_list(columns)}) "
+            f"SELECT {_column_list(columns)} FROM {quote(source)} WHERE true "
+            f"{self._conflict(key, update_columns, touch)}"
+        )
+
+    @staticmethod
+    def _type(sql_type):
+        return _ON_UPDATE.sub("", sql_type)
+
+    def _create_touch_trigger(self, conn, table, column):
+        # MySQL's ON UPDATE CURRENT_TIMESTAMP, unless the UPDATE sets column itself
+        conn.cursor().execute(
+            f"CREATE TRIGGER IF NOT EXISTS {quote(f'{table}__touch_{column}')} "
+            f"AFTER UPDATE ON {quote(table)} FOR EACH ROW "
+            f"WHEN NEW.{quote(column)} IS OLD.{quote(column)} BEGIN "
+            f"UPDATE {quote(table)} SET {quote(column)} = CURRENT_TIMESTAMP "
+            f"WHERE rowid = NEW.rowid; END"
+        )
+
+    def _create_indexes(self, conn, table, indexes):
+        # index names are per database in SQLite, so they carry the table name
+        for index, cols in indexes:
+            conn.cursor().execute(
+                f"CREATE INDEX IF NOT EXISTS {quote(f'{table}__{index}')} "
+                f"ON {quote(table)} ({_column_list(cols)})"
+            )
+
+    def create_table(self, conn, table, columns, primary_key=None, auto_id=False,
+                     indexes=(), if_not_exists=True):
+        lines = ["`id` INTEGER PRIMARY KEY AUTOINCREMENT"] if auto_id else []
+        lines += [f"{quote(name)} {self._type(sql_type)}" for name, sql_type in columns]
+        if primary_key:
+            lines.append(f"PRIMARY KEY ({_column_list(primary_key)})")
+        exists = "IF NOT EXISTS " if if_not_exists else ""
+        conn.cursor().execute(
+            f"CREATE TABLE {exists}{quote(table)} (\n  " + ",\n  ".join(lines) + "\n)"
+        )
+        self._create_indexes(conn, table, indexes)
+        for name, sql_type in columns:
+            if _ON_UPDATE.search(sql_type):
+                self._create_touch_trigger(conn, table, name)
+
+    def table_exists(self, conn, table):
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        return cursor.fetchone() is not None
+
+    def table_columns(self, conn, table):
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA table_info({quote(table)})")
+        return {row[1] for row in cursor.fetchall()}
+
+    def add_columns(self, conn, table, columns, indexes=()):
+        for name, sql_type in columns:
+            conn.cursor().execute(
+                f"ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {self._type(sql_type)}"
+            )
+        self._create_indexes(conn, table, indexes)
+
+    def _schema_sql(self, conn, table):
+        """{name: (type, sql)} of table's explicit indexes and touch triggers."""
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name, type, sql FROM sqlite_master "
+            "WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+            (table,),
+        )
+        return {name: (kind, sql) for name, kind, sql in cursor.fetchall()}
+
+    def _copy_schema(self, conn, table, schema_sql):
+        """Recreate indexes and triggers (from _schema_sql of another table) on table."""
+        for name, (kind, sql) in schema_sql.items():
+            suffix = name.split("__", 1)[-1]
+            if kind == "trigger":
+                self._create_touch_trigger(conn, table, suffix[len("touch_"):])
+                continue
+            match = _INDEX_SQL.match(sql)
+            conn.cursor().execute(
+                f"CREATE {match.group(1) or ''}INDEX IF NOT EXISTS "
+                f"{quote(f'{table}__{suffix}')} ON {quote(table)} {match.group(2)}"
+            )
+
+    def create_table_like(self, conn, table, source):
+        cursor = conn.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (source,))
+        row = cursor.fetchone()
+        if row is None:
+            raise sqlite3.OperationalError(f"no such table: {source}")
+        body = row[0][row[0].index("(") :]
+        cursor.execute(f"CREATE TABLE {quote(table)} {body}")
+        self._copy_schema(conn, table, self._schema_sql(conn, source))
+
+    def swap_tables(self, conn, swaps):
+        # SQLite DDL is transactional: the whole swap commits or nothing does
+        conn.commit()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            for live, new in swaps.items():
+                schema_sql = self._schema_sql(conn, new)
+                cursor.execute(f"DROP TABLE IF EXISTS {quote(live)}")
+                cursor.execute(f"ALTER TABLE {quote(new)} RENAME TO {quote(live)}")
+                # indexes and triggers keep the names they got on the new table
+                for name, (kind, _) in schema_sql.items():
+                    cursor.execute(f"DROP {kind.upper()} {quote(name)}")
+                self._copy_schema(conn, live, schema_sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def bulk_load(self, conn, table, df, nullable=()):
+        """One executemany in one transaction (SQLite has no LOAD DATA)."""
+        df = df.copy()
+        for col in nullable:
+            df[col] = df[col].mask(df[col].astype(str).eq(""))
+        self.insert_many(conn, table, list(df.columns), row_tuples(df), batch_size=len(df) or 1)
+        conn.commit()
+        return len(df)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=DB_BACKEND):
+    """The process-wide backend (and its connection pool) for name."""
+    with _backends_lock:
+        if name not in _backends:
+            if name == "mysql":
+                _backends[name] = MySQLBackend()
+            elif name == "sqlite":
+                _backends[name] = SQLiteBackend()
+            else:
+                raise ValueError(f"Unknown database backend {name!r} (mysql or sqlite)")
+            logger.info(f"Database backend: {name} (pool of {_backends[name].pool_size})")
+        return _backends[name]
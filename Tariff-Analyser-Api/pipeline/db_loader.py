@@ -1,135 +1,675 @@
 # db_loader.py
 import os
-import re
-import mysql.connector
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime, timezone
 import pandas as pd
 
 from logger import logger
-from config import DB_CONFIG, PARSED_DIR
+from metrics import metrics, ROW_BUCKETS
+from config import DB_LOAD_MODE, PARSED_DIR
+from db import get_backend, row_tuples
 from utils import ensure_dirs
+from parsed_io import parsed_path, read_parsed
+from duty_rates import (
+    RATE_COLUMNS,
+    SPECIAL_PROGRAM_COLUMNS,
+    add_rate_columns,
+    expand_special_programs,
+    rate_column_names,
+)
 
 
-def clean_unit(u):
-    if pd.isna(u) or u is None:
-        return ""
-    u = str(u).strip()
-    u = re.sub(r"[\[\]'\"]", "", u)
-    return u
+def clean_unit(units):
+    """Unit column without brackets and quotes (["kg"] -> kg)."""
+    return units.str.strip().str.replace(r"[\[\]'\"]", "", regex=True)
 
 
-def clean_duty(d):
-    if pd.isna(d) or d is None:
-        return ""
-    s = str(d).replace("\n", " ").strip()
-    s = re.sub(r"\s+", " ", s)
-    return s
+def clean_duty(duties):
+    """Rate text column on one line, runs of whitespace collapsed."""
+    return duties.str.replace("\n", " ", regex=False).str.strip().str.replace(r"\s+", " ", regex=True)
 
 
-def clean_hts(code):
-    if not code:
-        return ""
-    return str(code).strip().rstrip(".").replace("..", ".")
+def clean_hts(codes):
+    """HTS code column without a trailing dot or doubled dots."""
+    return codes.str.strip().str.rstrip(".").str.replace("..", ".", regex=False)
+
+
+# structured rate columns derived from the rate text (see duty_rates.py)
+RATE_FIELD_TYPES = {
+    "ad_valorem": "DECIMAL(9,4)",
+    "specific": "DECIMAL(12,6)",
+    "specific_unit": "VARCHAR(32)",
+    "compound": "TINYINT(1) NOT NULL DEFAULT 0",
+}
+RATE_INDEX_FIELDS = ["ad_valorem", "specific"]
+
+
+def _rate_column_ddl():
+    """(column name, definition) and (index name, [column]) for the rate columns."""
+    columns = [
+        (f"{prefix}_{field}", sql_type)
+        for prefix, _ in RATE_COLUMNS
+        for field, sql_type in RATE_FIELD_TYPES.items()
+    ]
+    indexes = [
+        (f"idx_{prefix}_{field}", [f"{prefix}_{field}"])
+        for prefix, _ in RATE_COLUMNS
+        for field in RATE_INDEX_FIELDS
+    ]
+    return columns, indexes
+
+
+def _add_missing_rate_columns(conn):
+    """Bring a product_table created before the rate columns existed up to date."""
+    existing = conn.backend.table_columns(conn, "product_table")
+    columns, indexes = _rate_column_ddl()
+    columns = [(name, sql_type) for name, sql_type in columns if name not in existing]
+    indexes = [(name, cols) for name, cols in indexes if cols[0] not in existing]
+    if columns or indexes:
+        conn.backend.add_columns(conn, "product_table", columns, indexes)
+        logger.info(
+            f"Added structured rate columns to product_table "
+            f"({len(columns) + len(indexes)} changes)."
+        )
+
+
+# product_table layout (an auto-increment id comes first); the structured
+# rate columns and last_updated follow
+PRODUCT_TABLE_COLUMNS = [
+    ("section", "VARCHAR(20)"),
+    ("chapter", "INT"),
+    ("main_category", "TEXT"),
+    ("subcategory", "TEXT"),
+    ("group_name", "TEXT"),
+    ("hts_code", "VARCHAR(100) UNIQUE"),
+    ("product", "LONGTEXT"),
+    ("unit_of_quantity", "VARCHAR(255)"),
+    ("general_rate_of_duty", "VARCHAR(255)"),
+    ("special_rate_of_duty", "VARCHAR(255)"),
+    ("column2_rate_of_duty", "VARCHAR(255)"),
+]
 
 
 def create_table_if_not_exists(conn):
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS product_table (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            section VARCHAR(20),
-            chapter INT,
-            main_category TEXT,
-            subcategory TEXT,
-            group_name TEXT,
-            hts_code VARCHAR(100) UNIQUE,
-            product LONGTEXT,
-            unit_of_quantity VARCHAR(255),
-            general_rate_of_duty VARCHAR(255),
-            special_rate_of_duty VARCHAR(255),
-            column2_rate_of_duty VARCHAR(255),
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                ON UPDATE CURRENT_TIMESTAMP
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """
+    columns, indexes = _rate_column_ddl()
+    conn.backend.create_table(
+        conn,
+        "product_table",
+        PRODUCT_TABLE_COLUMNS
+        + columns
+        + [("last_updated", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")],
+        auto_id=True,
+        indexes=indexes,
     )
+    _add_missing_rate_columns(conn)
     conn.commit()
     logger.info("Table product_table ready or already exists.")
 
 
-def load_csv_to_db(csv_path):
-    logger.info(f"Loading CSV into DB: {csv_path}")
+def create_fingerprint_table_if_not_exists(conn):
+    """
+    Side table for delta loads: one content fingerprint per hts_code the
+    pipeline loaded, with the chapter it came from and when it was written.
+    """
+    conn.backend.create_table(
+        conn,
+        "product_table_fingerprint",
+        [
+            ("hts_code", "VARCHAR(100)"),
+            ("fingerprint", "CHAR(32) NOT NULL"),
+            ("chapter", "INT"),
+            ("loaded_at", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ],
+        primary_key=["hts_code"],
+        indexes=[("idx_fingerprint_chapter", ["chapter"])],
+    )
+    conn.commit()
+
+
+SPECIAL_PROGRAM_TABLE = "product_special_program"
+SPECIAL_STAGING_TABLE = "product_special_program_staging"
+
+
+def create_special_program_table_if_not_exists(conn):
+    """
+    special_rate_of_duty expanded to one row per (hts_code, program_code),
+    so "codes free under program X" is an index seek instead of a LIKE scan.
+    """
+    conn.backend.create_table(
+        conn,
+        SPECIAL_PROGRAM_TABLE,
+        [
+            ("hts_code", "VARCHAR(100) NOT NULL"),
+            ("program_code", "VARCHAR(8) NOT NULL"),
+            ("chapter", "INT"),
+            ("rate", "VARCHAR(255)"),
+            ("ad_valorem", "DECIMAL(9,4)"),
+            ("specific_amount", "DECIMAL(12,6)"),
+        ],
+        primary_key=["hts_code", "program_code"],
+        indexes=[
+            ("idx_program_ad_valorem", ["program_code", "ad_valorem"]),
+            ("idx_program_chapter", ["chapter", "program_code"]),
+        ],
+    )
+    conn.commit()
+
+
+PRODUCT_COLUMNS = [
+    "section",
+    "chapter",
+    "main_category",
+    "subcategory",
+    "group_name",
+    "hts_code",
+    "product",
+    "unit_of_quantity",
+    "general_rate_of_duty",
+    "special_rate_of_duty",
+    "column2_rate_of_duty",
+] + rate_column_names()
+
+# columns refreshed when an hts_code already exists
+UPDATE_COLUMNS = [
+    "main_category",
+    "subcategory",
+    "group_name",
+    "product",
+    "unit_of_quantity",
+    "general_rate_of_duty",
+    "special_rate_of_duty",
+    "column2_rate_of_duty",
+] + rate_column_names()
+
+# columns written as NULL when empty in the bulk-load CSV
+NULLABLE_COLUMNS = ["chapter"] + [
+    c for c in rate_column_names() if not c.endswith("_compound")
+]
+
+STAGING_TABLE = "product_table_staging"
+LOAD_MODES = ["bulk", "upsert", "delta"]
+# delta mode: added/updated/removed codes of the last load (see save_change_summary)
+CHANGES_PATH = os.path.join(PARSED_DIR, "product_changes.json")
 
-    ensure_dirs(os.path.dirname(csv_path) or ".")
-    df = pd.read_csv(csv_path, dtype=str).fillna("")
 
+def read_product_file(path):
+    """
+    Read the parsed file (Parquet or CSV, see parsed_io; chapter arrives as
+    a nullable Int64) and prepare it with prepare_product_frame.
+    """
+    return prepare_product_frame(read_parsed(path))
+
+
+def prepare_product_frame(df):
+    """
+    Apply clean_hts/clean_unit/clean_duty to parsed rows
+    (chapter as a nullable Int64). Returns a frame with PRODUCT_COLUMNS.
+    The structured rate columns are parsed from the cleaned rate text (see
+    duty_rates.add_rate_columns).
+    """
+    df = df.copy()
     if "group" in df.columns:
         df.rename(columns={"group": "group_name"}, inplace=True)
+    for col in PRODUCT_COLUMNS:
+        if col not in df.columns:
+            df[col] = pd.NA if col == "chapter" else ""
 
-    conn = mysql.connector.connect(**DB_CONFIG)
+    df["hts_code"] = clean_hts(df["hts_code"])
+    df["unit_of_quantity"] = clean_unit(df["unit_of_quantity"])
+    for col in ["general_rate_of_duty", "special_rate_of_duty", "column2_rate_of_duty"]:
+        df[col] = clean_duty(df[col])
+    add_rate_columns(df)
+    return df[PRODUCT_COLUMNS]
 
-    try:
-        create_table_if_not_exists(conn)
-        cursor = conn.cursor()
-
-        insert_sql = """
-            INSERT INTO product_table
-            (section, chapter, main_category, subcategory, group_name,
-             hts_code, product, unit_of_quantity,
-             general_rate_of_duty, special_rate_of_duty, column2_rate_of_duty)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                main_category = VALUES(main_category),
-                subcategory = VALUES(subcategory),
-                group_name = VALUES(group_name),
-                product = VALUES(product),
-                unit_of_quantity = VALUES(unit_of_quantity),
-                general_rate_of_duty = VALUES(general_rate_of_duty),
-                special_rate_of_duty = VALUES(special_rate_of_duty),
-                column2_rate_of_duty = VALUES(column2_rate_of_duty),
-                last_updated = CURRENT_TIMESTAMP
+
+def _upsert_sql(backend):
+    return backend.upsert_sql(
+        "product_table", PRODUCT_COLUMNS, "hts_code", UPDATE_COLUMNS, touch="last_updated"
+    )
+
+
+def _count_batch(table, rows):
+    metrics.inc("hts_db_rows_written_total", rows, table=table)
+    metrics.observe("hts_db_batch_rows", rows, ROW_BUCKETS, table=table)
+
+
+def _upsert_rows(conn, df, batch_size=500, commit=True, start=0, on_commit=None):
+    """
+    Row-batch loader: executemany + upsert on hts_code, commit per batch,
+    from row start on. on_commit(rows) gets the rows committed so far.
+    """
+    cursor = conn.cursor()
+    records = row_tuples(df)
+    upsert_sql = _upsert_sql(conn.backend)
+
+    for i in range(start, len(records), batch_size):
+        batch = records[i : i + batch_size]
+        with metrics.timer("hts_db_batch_seconds", table="product_table"):
+            cursor.executemany(upsert_sql, batch)
+            if commit:
+                conn.commit()
+        _count_batch("product_table", len(batch))
+        logger.info(f"Inserted records {i+1} to {i+len(batch)}")
+        if commit and on_commit is not None:
+            on_commit(i + len(batch))
+
+
+def _bulk_load(conn, table, df, nullable):
+    """
+    Bulk-load df into table with the backend's fastest path (LOAD DATA
+    LOCAL INFILE on MySQL). Empty fields of the nullable columns are
+    stored as NULL.
+    """
+    with metrics.timer("hts_db_batch_seconds", table=table):
+        conn.backend.bulk_load(conn, table, df, nullable)
+    _count_batch(table, len(df))
+
+
+def _bulk_load_staging(conn, df):
+    """
+    Load df into a fresh staging table shaped like product_table with a
+    bulk load. Duplicate hts_codes keep the last row, as the upsert path
+    does.
+    """
+    df = df.drop_duplicates(subset="hts_code", keep="last")
+    conn.backend.drop_table(conn, STAGING_TABLE)
+    conn.backend.create_table_like(conn, STAGING_TABLE, "product_table")
+    _bulk_load(conn, STAGING_TABLE, df[PRODUCT_COLUMNS], NULLABLE_COLUMNS)
+    return len(df)
+
+
+def _promote_staging(conn, promote):
+    """
+    Make the staging rows visible in one step.
+    merge: a single INSERT ... SELECT upsert (keeps rows and ids not in
+           this load, e.g. products added through the API).
+    swap:  atomic table swap (RENAME TABLE on MySQL), replacing
+           product_table with exactly this load.
+    """
+    backend = conn.backend
+    if promote == "swap":
+        backend.swap_tables(conn, {"product_table": STAGING_TABLE})
+    else:
+        conn.cursor().execute(
+            backend.upsert_select_sql(
+                "product_table", PRODUCT_COLUMNS, STAGING_TABLE, "hts_code",
+                UPDATE_COLUMNS, touch="last_updated",
+            )
+        )
+        conn.commit()
+        backend.drop_table(conn, STAGING_TABLE)
+    conn.commit()
+
+
+def row_fingerprints(df):
+    """MD5 over all product columns of each row, as 32-char hex strings."""
+    text = df[PRODUCT_COLUMNS].astype(str).agg("\x1f".join, axis=1)
+    return text.map(lambda t: hashlib.md5(t.encode("utf-8")).hexdigest())
+
+
+def diff_fingerprints(new, live):
+    """
+    Classify a load against what is in the database.
+    new:  hts_code, fingerprint, chapter for the rows being loaded.
+    live: hts_code, fingerprint, chapter, dirty for every product_table row
+          (fingerprint/chapter are null for rows the pipeline never loaded,
+          dirty is true when the row was written after its fingerprint).
+    Rows are removed only if the pipeline loaded them (they have a
+    fingerprint) and they belong to a chapter present in this load.
+    Returns (added, updated, removed, unchanged) code lists.
+    """
+    merged = new.merge(live, on="hts_code", how="outer", suffixes=("", "_live"), indicator=True)
+    in_new = merged["_merge"] != "right_only"
+    in_live = merged["_merge"] != "left_only"
+
+    added = merged.loc[in_new & ~in_live, "hts_code"]
+    same = (merged["fingerprint"] == merged["fingerprint_live"]) & ~merged["dirty"].fillna(False).astype(bool)
+    both = in_new & in_live
+    updated = merged.loc[both & ~same, "hts_code"]
+    unchanged = merged.loc[both & same, "hts_code"]
+
+    scope = set(new["chapter"].dropna())
+    owned = merged["fingerprint_live"].notna() & merged["chapter_live"].isin(scope)
+    removed = merged.loc[~in_new & owned, "hts_code"]
+    return added.tolist(), updated.tolist(), removed.tolist(), unchanged.tolist()
+
+
+def _fetch_live_fingerprints(conn):
+    cursor = conn.cursor()
+    cursor.execute(
         """
+        SELECT p.hts_code, f.fingerprint, f.chapter,
+               (f.loaded_at IS NOT NULL AND p.last_updated > f.loaded_at) AS dirty
+        FROM product_table p
+        LEFT JOIN product_table_fingerprint f ON f.hts_code = p.hts_code
+        """
+    )
+    live = pd.DataFrame(cursor.fetchall(), columns=["hts_code", "fingerprint", "chapter", "dirty"])
+    live["chapter"] = live["chapter"].astype("Int64")
+    live["dirty"] = live["dirty"].astype(bool)
+    return live
 
-        records = []
-        for row in df.itertuples(index=False):
-            # chapter is optional / may be blank
-            chapter_val = None
-            try:
-                chapter_val = int(row.chapter) if str(row.chapter).strip() else None
-            except Exception:
-                chapter_val = None
-
-            records.append(
-                (
-                    getattr(row, "section", ""),
-                    chapter_val,
-                    getattr(row, "main_category", ""),
-                    getattr(row, "subcategory", ""),
-                    getattr(row, "group_name", ""),
-                    clean_hts(getattr(row, "hts_code", "")),
-                    getattr(row, "product", ""),
-                    clean_unit(getattr(row, "unit_of_quantity", "")),
-                    clean_duty(getattr(row, "general_rate_of_duty", "")),
-                    clean_duty(getattr(row, "special_rate_of_duty", "")),
-                    clean_duty(getattr(row, "column2_rate_of_duty", "")),
-                )
+
+def _delete_codes(conn, table, codes, batch_size=500):
+    cursor = conn.cursor()
+    for i in range(0, len(codes), batch_size):
+        batch = codes[i : i + batch_size]
+        placeholders = conn.backend.placeholders(len(batch))
+        cursor.execute(f"DELETE FROM {table} WHERE hts_code IN ({placeholders})", batch)
+
+
+def load_delta(conn, df, batch_size=500):
+    """
+    Write only what changed: insert new codes, update codes whose content
+    fingerprint differs, delete codes that disappeared from the loaded
+    chapters. Everything is committed in one transaction, so last_updated
+    only moves for rows that really changed. Returns the change summary.
+    """
+    create_fingerprint_table_if_not_exists(conn)
+    df = df.drop_duplicates(subset="hts_code", keep="last").reset_index(drop=True)
+    new = pd.DataFrame(
+        {"hts_code": df["hts_code"], "fingerprint": row_fingerprints(df), "chapter": df["chapter"]}
+    )
+    added, updated, removed, unchanged = diff_fingerprints(new, _fetch_live_fingerprints(conn))
+
+    changed = set(added) | set(updated)
+    write_mask = df["hts_code"].isin(changed)
+    cursor = conn.cursor()
+    try:
+        _upsert_rows(conn, df[write_mask], batch_size=batch_size, commit=False)
+        _delete_codes(conn, "product_table", removed, batch_size)
+        _delete_codes(conn, "product_table_fingerprint", removed, batch_size)
+        fp_records = row_tuples(new[write_mask])
+        fp_sql = conn.backend.upsert_sql(
+            "product_table_fingerprint", ["hts_code", "fingerprint", "chapter"], "hts_code",
+            ["fingerprint", "chapter"], touch="loaded_at",
+        )
+        for i in range(0, len(fp_records), batch_size):
+            cursor.executemany(fp_sql, fp_records[i : i + batch_size])
+        # fingerprints of rows deleted outside the pipeline
+        cursor.execute(
+            """
+            DELETE FROM product_table_fingerprint
+            WHERE NOT EXISTS (
+                SELECT 1 FROM product_table p
+                WHERE p.hts_code = product_table_fingerprint.hts_code
             )
+            """
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    summary = {
+        "loaded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "counts": {
+            "added": len(added),
+            "updated": len(updated),
+            "removed": len(removed),
+            "unchanged": len(unchanged),
+        },
+        "added": sorted(added),
+        "updated": sorted(updated),
+        "removed": sorted(removed),
+    }
+    logger.info(f"Delta load: {summary['counts']}")
+    return summary
+
+
+def load_special_programs(
+    conn, programs, chapters=(), codes=(), replace_all=False, bulk=True, batch_size=500
+):
+    """
+    Refresh product_special_program from the expanded programs frame.
+    Existing rows of the given chapters and hts codes (and of every code in
+    programs) are replaced in one transaction; replace_all rebuilds the
+    whole table. Rows are staged with a bulk load when bulk is set, with
+    executemany otherwise.
+    """
+    backend = conn.backend
+    create_special_program_table_if_not_exists(conn)
+    cursor = conn.cursor()
+    backend.drop_table(conn, SPECIAL_STAGING_TABLE)
+    backend.create_table_like(conn, SPECIAL_STAGING_TABLE, SPECIAL_PROGRAM_TABLE)
+    columns = ", ".join(SPECIAL_PROGRAM_COLUMNS)
+    nullable = ["chapter", "ad_valorem", "specific_amount"]
 
-        batch_size = 500
+    staged = False
+    if bulk:
+        try:
+            _bulk_load(conn, SPECIAL_STAGING_TABLE, programs, nullable)
+            staged = True
+        except backend.Error as e:
+            logger.warning(f"Bulk load of special programs unavailable ({e}); using executemany.")
+            conn.rollback()
+    if not staged:
+        records = row_tuples(programs[SPECIAL_PROGRAM_COLUMNS])
+        insert_sql = backend.insert_sql(SPECIAL_STAGING_TABLE, SPECIAL_PROGRAM_COLUMNS)
         for i in range(0, len(records), batch_size):
             batch = records[i : i + batch_size]
-            cursor.executemany(insert_sql, batch)
-            conn.commit()
-            logger.info(f"Inserted records {i+1} to {i+len(batch)}")
+            with metrics.timer("hts_db_batch_seconds", table=SPECIAL_STAGING_TABLE):
+                cursor.executemany(insert_sql, batch)
+            _count_batch(SPECIAL_STAGING_TABLE, len(batch))
+        conn.commit()
 
-        logger.info("CSV data loaded into DB successfully.")
+    try:
+        if replace_all:
+            cursor.execute(f"DELETE FROM {SPECIAL_PROGRAM_TABLE}")
+        else:
+            chapters = [int(c) for c in chapters]
+            if chapters:
+                placeholders = backend.placeholders(len(chapters))
+                cursor.execute(
+                    f"DELETE FROM {SPECIAL_PROGRAM_TABLE} WHERE chapter IN ({placeholders})",
+                    chapters,
+                )
+            _delete_codes(conn, SPECIAL_PROGRAM_TABLE, list(codes), batch_size)
+            # codes that moved to another chapter
+            cursor.execute(
+                f"""
+                DELETE FROM {SPECIAL_PROGRAM_TABLE}
+                WHERE hts_code IN (SELECT hts_code FROM {SPECIAL_STAGING_TABLE})
+                """
+            )
+        cursor.execute(
+            f"INSERT INTO {SPECIAL_PROGRAM_TABLE} ({columns}) "
+            f"SELECT {columns} FROM {SPECIAL_STAGING_TABLE}"
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
-        logger.info("Database connection closed.")
+        backend.drop_table(conn, SPECIAL_STAGING_TABLE)
+    logger.info(f"Special programs refreshed: {len(programs)} rows.")
+    return len(programs)
+
+
+def save_change_summary(summary, path=CHANGES_PATH):
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(summary, fh, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Change summary written to {path}")
+
+
+def load_csv_to_db(csv_path, mode=DB_LOAD_MODE, promote="merge", backend=None,
+                   skip_rows=0, on_commit=None):
+    """
+    Load the parsed file (Parquet or CSV) into product_table, over a pooled
+    connection of backend (default: db.get_backend()).
+    mode="bulk" streams the rows into a staging table with the backend's
+    bulk load (LOAD DATA LOCAL INFILE on MySQL) and promotes them in one
+    step (see _promote_staging); it falls back to the executemany path
+    ("upsert") if the server refuses local infile.
+    mode="delta" only writes added/changed/removed rows (see load_delta),
+    returns the change summary and saves it to parsed/product_changes.json.
+    product_special_program is refreshed for the same chapters (or, in
+    delta mode, the same codes) afterwards.
+    skip_rows and on_commit resume an interrupted load of the same file
+    (see load_frame).
+    """
+    logger.info(f"Loading parsed file into DB: {csv_path} (mode={mode})")
+
+    ensure_dirs(os.path.dirname(csv_path) or ".")
+    df = read_product_file(csv_path)
+
+    backend = backend or get_backend()
+    with backend.connection() as conn:
+        create_table_if_not_exists(conn)
+        summary = load_frame(conn, df, mode, promote, skip_rows, on_commit)
+        if summary is not None:
+            summary["csv"] = csv_path
+            save_change_summary(summary)
+    logger.info("Database connection returned to the pool.")
+    return summary
+
+
+def load_frame(conn, df, mode=DB_LOAD_MODE, promote="merge", skip_rows=0, on_commit=None):
+    """
+    Load prepared product rows (see prepare_product_frame) over an open
+    connection, then refresh their special programs. Returns the change
+    summary in delta mode, None otherwise.
+
+    on_commit(rows) is called with the product rows committed so far after
+    every commit that makes some durable: each batch in upsert mode, the
+    promotion in bulk mode (delta mode commits everything at once and is
+    simply redone). skip_rows is such a count from an interrupted load of
+    the same rows: upsert mode starts after them, bulk mode skips the
+    product rows when all of them were promoted.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode: {mode}")
+    started = time.perf_counter()
+    summary = None
+
+    if mode == "delta":
+        summary = load_delta(conn, df)
+        rows = sum(summary["counts"][k] for k in ("added", "updated", "removed"))
+
+    if mode == "bulk" and skip_rows >= len(df) > 0:
+        logger.info(f"All {len(df)} product rows were loaded before; refreshing special programs only.")
+        rows = 0
+    elif mode == "bulk":
+        try:
+            rows = _bulk_load_staging(conn, df)
+            _promote_staging(conn, promote)
+            if on_commit is not None:
+                on_commit(len(df))
+        except conn.backend.Error as e:
+            logger.warning(f"Bulk load unavailable ({e}); falling back to executemany.")
+            conn.rollback()
+            conn.backend.drop_table(conn, STAGING_TABLE)
+            mode = "upsert"
+
+    if mode == "upsert":
+        rows = len(df) - min(skip_rows, len(df))
+        _upsert_rows(conn, df, start=skip_rows, on_commit=on_commit)
+
+    programs = expand_special_programs(df)
+    if mode == "delta":
+        changed = summary["added"] + summary["updated"]
+        load_special_programs(
+            conn,
+            programs[programs["hts_code"].isin(changed)],
+            codes=changed + summary["removed"],
+            bulk=False,
+        )
+    else:
+        load_special_programs(
+            conn,
+            programs,
+            chapters=df["chapter"].dropna().unique(),
+            replace_all=(mode == "bulk" and promote == "swap"),
+            bulk=(mode == "bulk"),
+        )
+
+    elapsed = time.perf_counter() - started
+    metrics.observe("hts_db_load_seconds", elapsed, mode=mode)
+    logger.info(
+        f"Data loaded into DB successfully ({rows} rows in {elapsed:.2f}s, "
+        f"{rows / elapsed if elapsed else 0:.0f} rows/sec, mode={mode})."
+    )
+    return summary
+
+
+class ChapterLoader:
+    """
+    Load parsed chapters one at a time over one pooled connection of
+    backend (default: db.get_backend()), for the streaming pipeline. Call
+    it with a chapter's parsed rows (a frame in parsed_io column order);
+    returns the number of rows written. A failed chapter is rolled back and
+    the connection re-established for the next. Delta summaries of all
+    chapters are merged and saved on exit.
+    """
+
+    def __init__(self, mode=DB_LOAD_MODE, backend=None):
+        self.mode = mode
+        self.backend = backend or get_backend()
+        self.summary = None
+        self.conn = None
+        self._connection = None
+
+    def __enter__(self):
+        self._connection = self.backend.connection()
+        self.conn = self._connection.__enter__()
+        create_table_if_not_exists(self.conn)
+        return self
+
+    def __call__(self, parsed):
+        df = prepare_product_frame(parsed)
+        try:
+            self.backend.ping(self.conn)
+            # always merge: a per-chapter swap would drop every other chapter
+            summary = load_frame(self.conn, df, self.mode, promote="merge")
+        except Exception:
+            try:
+                self.conn.rollback()
+            except self.backend.Error:
+                pass
+            raise
+        if summary is not None:
+            self._merge_summary(summary)
+            return sum(summary["counts"][k] for k in ("added", "updated", "removed"))
+        return len(df)
+
+    def _merge_summary(self, summary):
+        if self.summary is None:
+            self.summary = summary
+            return
+        for key in ("added", "updated", "removed"):
+            self.summary[key] = sorted(self.summary[key] + summary[key])
+        for key, count in summary["counts"].items():
+            self.summary["counts"][key] += count
+        self.summary["loaded_at"] = summary["loaded_at"]
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.summary is not None:
+            save_change_summary(self.summary)
+        self._connection.__exit__(exc_type, exc, tb)
+        logger.info("Database connection returned to the pool.")
+        return False
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load the parsed HTS file into product_table.")
+    ap.add_argument("csv_path", nargs="?", default=parsed_path())
+    ap.add_argument("--mode", choices=LOAD_MODES, default=DB_LOAD_MODE)
+    ap.add_argument(
+        "--promote",
+        choices=["merge", "swap"],
+        default="merge",
+        help="bulk mode: merge into product_table, or replace it with an atomic rename",
+    )
+    args = ap.parse_args(argv)
+    if not os.path.exists(args.csv_path):
+        raise FileNotFoundError(f"{args.csv_path} not found. Run parser.py first.")
+    load_csv_to_db(args.csv_path, mode=args.mode, promote=args.promote)
 
 
 if __name__ == "__main__":
-    csv_path = os.path.join(PARSED_DIR, "hts_all_chapters.csv")
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"{csv_path} not found. Run parser.py first.")
-    load_csv_to_db(csv_path)
+    main()
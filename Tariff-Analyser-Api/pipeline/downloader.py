@@ -1,18 +1,34 @@
 # downloader.py
 """
 Download HTS chapters as true XLSX files using the website's REST endpoints.
-Usage: python downloader.py [start] [end]
+Usage: python downloader.py [start] [end] [--workers N] [--rate R]
 """
 import os
+import json
 import time
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from urllib.parse import urlencode
 import requests
+from requests.adapters import HTTPAdapter
 
 from logger import logger
-from utils import retry, ensure_dirs
-from config import CHAPTERS_DIR, HTS_ARCHIVE_URL
-
-ensure_dirs(CHAPTERS_DIR)
+from metrics import metrics
+from utils import retry, ensure_dirs, file_sha256, CircuitBreaker, TokenBucket
+from config import (
+    CHAPTERS_DIR,
+    HTS_ARCHIVE_URL,
+    MANIFEST_PATH,
+    DOWNLOAD_WORKERS,
+    DOWNLOAD_RATE,
+    DOWNLOAD_BURST,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_RETRY_DELAY,
+    CIRCUIT_FAILURES,
+    CIRCUIT_RESET_SECONDS,
+)
 
 BASE = "https://hts.usitc.gov"
 RANGES_ENDPOINT = "/reststop/ranges"
@@ -26,6 +42,17 @@ DEFAULT_HEADERS = {
     "Referer": "https://hts.usitc.gov/",
 }
 
+# HTTP statuses worth retrying; any other error status is final
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# one breaker for every request to the site, shared by all download threads
+UPSTREAM = CircuitBreaker("hts.usitc.gov", CIRCUIT_FAILURES, CIRCUIT_RESET_SECONDS)
+
+def _retryable(e: Exception) -> bool:
+    """Connection errors, timeouts, bad exports and RETRY_STATUSES responses."""
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code in RETRY_STATUSES
+    return True
+
 def _validate_xlsx_file(path: str) -> bool:
     try:
         if not os.path.exists(path):
@@ -36,11 +63,15 @@ def _validate_xlsx_file(path: str) -> bool:
     except Exception:
         return False
 
-@retry(times=3, delay=3, error_message="Failed to get range for chapter")
-def get_chapter_range(session: requests.Session, chapter_num: int) -> dict:
-    url = f"{BASE}{RANGES_ENDPOINT}"
+@retry(times=DOWNLOAD_RETRIES, delay=DOWNLOAD_RETRY_DELAY, error_message="Failed to get range for chapter",
+       retry_on=_retryable, breaker=UPSTREAM)
+def get_chapter_range(session: requests.Session, chapter_num: int, base: str = BASE,
+                      limiter: TokenBucket = None) -> dict:
+    url = f"{base}{RANGES_ENDPOINT}"
     params = {"docNumber": str(chapter_num)}
     logger.info("Fetching range for chapter %s", chapter_num)
+    if limiter:
+        limiter.acquire()
     r = session.get(url, params=params, headers=DEFAULT_HEADERS, timeout=30)
     r.raise_for_status()
     data = r.json()
@@ -49,11 +80,15 @@ def get_chapter_range(session: requests.Session, chapter_num: int) -> dict:
     logger.debug("Range for chapter %s: %s - %s", chapter_num, data["Starting_Number"], data["Ending_Number"])
     return data
 
-@retry(times=3, delay=3, error_message="Failed to download export XLSX")
-def download_export_xlsx(session: requests.Session, start_code: str, end_code: str, save_path: str, timeout=120) -> str:
+@retry(times=DOWNLOAD_RETRIES, delay=DOWNLOAD_RETRY_DELAY, error_message="Failed to download export XLSX",
+       retry_on=_retryable, breaker=UPSTREAM)
+def download_export_xlsx(session: requests.Session, start_code: str, end_code: str, save_path: str, timeout=120,
+                         base: str = BASE, limiter: TokenBucket = None) -> str:
     params = {"from": start_code, "to": end_code, "format": "XLSX", "styles": "true"}
-    url = f"{BASE}{EXPORT_ENDPOINT}"
+    url = f"{base}{EXPORT_ENDPOINT}"
     logger.info("Requesting export: from=%s to=%s", start_code, end_code)
+    if limiter:
+        limiter.acquire()
     with session.get(url, params=params, headers=DEFAULT_HEADERS, stream=True, timeout=timeout) as r:
         r.raise_for_status()
         ctype = r.headers.get("Content-Type", "")
@@ -75,55 +110,336 @@ def download_export_xlsx(session: requests.Session, start_code: str, end_code: s
         raise RuntimeError("Downloaded file failed validation.")
     return save_path
 
-def _prepare_session():
+def _count_download(chapter_num: int, result: str, size: int = 0):
+    metrics.inc("hts_downloads_total", result=result)
+    if size:
+        metrics.inc("hts_download_bytes_total", size, chapter=chapter_num)
+
+def _prepare_session(warmup_url: str = HTS_ARCHIVE_URL or BASE, pool_size: int = 10):
     session = requests.Session()
     session.headers.update(DEFAULT_HEADERS)
+    # one keep-alive pool sized for the number of threads sharing the session
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     try:
-        session.get(HTS_ARCHIVE_URL or BASE, timeout=20)
+        session.get(warmup_url, timeout=20)
     except Exception as e:
         logger.debug("Initial session GET failed but continuing: %s", e)
     return session
 
-def download_chapter(chapter_num: int, save_dir: str = CHAPTERS_DIR) -> str:
-    session = _prepare_session()
-    data = get_chapter_range(session, chapter_num)
-    start_code = data["Starting_Number"]
-    end_code = data["Ending_Number"]
-    filename = f"Chapter_{chapter_num:02d}.xlsx"
-    filepath = os.path.join(save_dir, filename)
-    downloaded = download_export_xlsx(session, start_code, end_code, filepath)
+def download_chapter(chapter_num: int, save_dir: str = CHAPTERS_DIR, session: requests.Session = None,
+                     base: str = BASE, limiter: TokenBucket = None) -> str:
+    if session is None:
+        session = _prepare_session()
+    with metrics.timer("hts_download_seconds"):
+        data = get_chapter_range(session, chapter_num, base=base, limiter=limiter)
+        start_code = data["Starting_Number"]
+        end_code = data["Ending_Number"]
+        filename = f"Chapter_{chapter_num:02d}.xlsx"
+        filepath = os.path.join(save_dir, filename)
+        ensure_dirs(save_dir)
+        downloaded = download_export_xlsx(session, start_code, end_code, filepath, base=base, limiter=limiter)
+    _count_download(chapter_num, "changed", os.path.getsize(downloaded))
     logger.info("Chapter %s downloaded to %s", chapter_num, downloaded)
     return downloaded
 
-def download_all_chapters(start: int = 1, end: int = 99, save_dir: str = CHAPTERS_DIR):
+def download_all_chapters_concurrent(start: int = 1, end: int = 99, save_dir: str = CHAPTERS_DIR,
+                                     workers: int = DOWNLOAD_WORKERS, rate: float = DOWNLOAD_RATE,
+                                     burst: int = DOWNLOAD_BURST, base: str = BASE):
+    """
+    Download chapters on a thread pool. At most `workers` chapters are in
+    flight, all threads share one pooled session, and every HTTP request
+    (retries included) first takes a token from a shared rate limiter.
+    Returns the downloaded paths in chapter order.
+    """
+    ensure_dirs(save_dir)
+    session = _prepare_session(warmup_url=f"{base}/", pool_size=workers)
+    limiter = TokenBucket(rate, burst)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(download_chapter, ch, save_dir, session, base, limiter): ch
+            for ch in range(start, end + 1)
+        }
+        for fut in as_completed(futures):
+            ch = futures[fut]
+            try:
+                results[ch] = fut.result()
+                logger.info("Completed Chapter %d -> %s", ch, results[ch])
+            except Exception as e:
+                _count_download(ch, "failed")
+                logger.exception("Failed to download Chapter %d: %s", ch, e)
+    session.close()
+    return [results[ch] for ch in sorted(results)]
+
+def download_all_chapters(start: int = 1, end: int = 99, save_dir: str = CHAPTERS_DIR,
+                          workers: int = DOWNLOAD_WORKERS, base: str = BASE):
+    if workers > 1:
+        return download_all_chapters_concurrent(start, end, save_dir, workers=workers, base=base)
     ensure_dirs(save_dir)
-    session = _prepare_session()
+    session = _prepare_session(warmup_url=f"{base}/")
     results = []
     for ch in range(start, end + 1):
         try:
             logger.info("Downloading chapter %d", ch)
-            data = get_chapter_range(session, ch)
-            start_code = data["Starting_Number"]
-            end_code = data["Ending_Number"]
-            filename = f"Chapter_{ch:02d}.xlsx"
-            filepath = os.path.join(save_dir, filename)
-            download_export_xlsx(session, start_code, end_code, filepath)
+            with metrics.timer("hts_download_seconds"):
+                data = get_chapter_range(session, ch, base=base)
+                start_code = data["Starting_Number"]
+                end_code = data["Ending_Number"]
+                filename = f"Chapter_{ch:02d}.xlsx"
+                filepath = os.path.join(save_dir, filename)
+                download_export_xlsx(session, start_code, end_code, filepath, base=base)
+            _count_download(ch, "changed", os.path.getsize(filepath))
             results.append(filepath)
             logger.info("Completed Chapter %d -> %s", ch, filepath)
             time.sleep(0.5)
         except Exception as e:
+            _count_download(ch, "failed")
             logger.exception("Failed to download Chapter %d: %s", ch, e)
     return results
 
-if __name__ == "__main__":
-    import sys
-    s = 1; e = 1
-    if len(sys.argv) == 1:
-        s, e = 1, 1
-    elif len(sys.argv) == 2:
-        s = int(sys.argv[1]); e = s
-    elif len(sys.argv) >= 3:
-        s = int(sys.argv[1]); e = int(sys.argv[2])
+# ---------- incremental sync (chapter manifest) ----------
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """Per-chapter download records keyed by chapter number (as a string)."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh).get("chapters", {})
+    except Exception as e:
+        logger.warning("Ignoring unreadable manifest %s: %s", path, e)
+        return {}
+
+def save_manifest(chapters: dict, path: str = MANIFEST_PATH):
+    ensure_dirs(os.path.dirname(path))
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"version": 1, "chapters": chapters}, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+def mark_loaded(paths, manifest_path: str = MANIFEST_PATH):
+    """Clear the pending flag of chapters whose rows reached the database."""
+    manifest = load_manifest(manifest_path)
+    names = {os.path.basename(p) for p in paths}
+    for entry in manifest.values():
+        if entry.get("file") in names:
+            entry.pop("pending", None)
+    save_manifest(manifest, manifest_path)
+
+@retry(times=DOWNLOAD_RETRIES, delay=DOWNLOAD_RETRY_DELAY, error_message="Failed to sync export XLSX",
+       retry_on=_retryable, breaker=UPSTREAM)
+def download_export_if_changed(session: requests.Session, start_code: str, end_code: str, save_path: str,
+                               validators: dict = None, local_sha256: str = None, timeout=120,
+                               base: str = BASE, limiter: TokenBucket = None):
+    """
+    Conditional export download. Sends If-None-Match/If-Modified-Since when
+    validators are given; a 304 leaves save_path untouched. A 200 is streamed
+    to a .part file while hashing, and only replaces save_path when the bytes
+    differ from local_sha256. Returns (changed, record).
+    """
+    params = {"from": start_code, "to": end_code, "format": "XLSX", "styles": "true"}
+    url = f"{base}{EXPORT_ENDPOINT}"
+    headers = dict(DEFAULT_HEADERS)
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    logger.info("Requesting export: from=%s to=%s (conditional=%s)", start_code, end_code,
+                "If-None-Match" in headers or "If-Modified-Since" in headers)
+    if limiter:
+        limiter.acquire()
+    with session.get(url, params=params, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 304:
+            logger.info("Export not modified: %s", save_path)
+            return False, {}
+        r.raise_for_status()
+        ctype = r.headers.get("Content-Type", "")
+        if "xml" in ctype.lower() or "html" in ctype.lower():
+            raise RuntimeError(f"Server returned non-XLSX content-type: {ctype}")
+        tmp_path = save_path + ".part"
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as fh:
+            for chunk in r.iter_content(chunk_size=8192):
+                if chunk:
+                    fh.write(chunk)
+                    digest.update(chunk)
+        record = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "size": os.path.getsize(tmp_path),
+            "sha256": digest.hexdigest(),
+        }
+    if not _validate_xlsx_file(tmp_path):
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+        raise RuntimeError("Downloaded file failed validation.")
+    if record["sha256"] == local_sha256:
+        os.remove(tmp_path)
+        logger.info("Export unchanged (same content hash): %s", save_path)
+        return False, record
+    os.replace(tmp_path, save_path)
+    logger.info("Saved changed export to %s", save_path)
+    return True, record
+
+def sync_chapter(chapter_num: int, entry: dict = None, save_dir: str = CHAPTERS_DIR,
+                 session: requests.Session = None, base: str = BASE, limiter: TokenBucket = None,
+                 force: bool = False):
+    """
+    Bring one chapter up to date against its manifest entry.
+    Returns (changed, path, new_entry).
+    """
+    if session is None:
+        session = _prepare_session()
+    entry = entry or {}
+    with metrics.timer("hts_download_seconds"):
+        data = get_chapter_range(session, chapter_num, base=base, limiter=limiter)
+        start_code = data["Starting_Number"]
+        end_code = data["Ending_Number"]
+        filepath = os.path.join(save_dir, f"Chapter_{chapter_num:02d}.xlsx")
+        ensure_dirs(save_dir)
+
+        local_sha = file_sha256(filepath) if os.path.exists(filepath) else None
+        # only revalidate when the range is unchanged and the local file is the one we recorded
+        same_range = (entry.get("start"), entry.get("end")) == (start_code, end_code)
+        trusted = not force and same_range and local_sha and local_sha == entry.get("sha256")
+
+        changed, record = download_export_if_changed(
+            session, start_code, end_code, filepath,
+            validators=entry if trusted else None,
+            local_sha256=None if force else local_sha,
+            base=base, limiter=limiter,
+        )
+    new_entry = dict(entry)
+    new_entry.update({k: v for k, v in record.items() if v is not None})
+    new_entry.update({
+        "start": start_code,
+        "end": end_code,
+        "file": os.path.basename(filepath),
+        "checked_at": _utc_now(),
+    })
+    # a chapter without a manifest entry was never loaded, even if its file
+    # is already on disk; pending stays set until mark_loaded(), so a failed
+    # parse/load is retried next run
+    if changed or not entry.get("sha256"):
+        new_entry["changed_at"] = new_entry["checked_at"]
+        new_entry["pending"] = True
+    changed = changed or bool(new_entry.get("pending"))
+    # a 200 whose content hash matched still transferred its bytes
+    _count_download(chapter_num, "changed" if changed else "unchanged", record.get("size", 0))
+    logger.info("Chapter %d %s", chapter_num, "changed" if changed else "unchanged")
+    return changed, filepath, new_entry
+
+def iter_sync_chapters(start: int = 1, end: int = 99, save_dir: str = CHAPTERS_DIR,
+                       workers: int = DOWNLOAD_WORKERS, rate: float = DOWNLOAD_RATE,
+                       burst: int = DOWNLOAD_BURST, base: str = BASE,
+                       manifest_path: str = MANIFEST_PATH, force: bool = False,
+                       chapters=None):
+    """
+    Generator behind sync_chapters: yields (chapter, status, path) as each
+    chapter finishes, status being "changed", "unchanged" or "failed" (path
+    None). At most `workers` chapters are in flight and the next one is only
+    started once a result has been consumed, so a slow consumer holds back
+    the downloads. The manifest is saved when the generator finishes.
+    chapters, when given, are the chapter numbers to sync instead of start..end.
+    """
+    ensure_dirs(save_dir)
+    manifest = load_manifest(manifest_path)
+    session = _prepare_session(warmup_url=f"{base}/", pool_size=workers)
+    limiter = TokenBucket(rate, burst)
+    todo = iter(range(start, end + 1) if chapters is None else chapters)
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            in_flight = {}
+
+            def submit_next():
+                ch = next(todo, None)
+                if ch is not None:
+                    fut = pool.submit(sync_chapter, ch, manifest.get(str(ch)), save_dir,
+                                      session, base, limiter, force)
+                    in_flight[fut] = ch
+
+            for _ in range(max(workers, 1)):
+                submit_next()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    ch = in_flight.pop(fut)
+                    try:
+                        changed, path, entry = fut.result()
+                        manifest[str(ch)] = entry
+                        status = "changed" if changed else "unchanged"
+                    except Exception as e:
+                        _count_download(ch, "failed")
+                        logger.exception("Failed to sync Chapter %d: %s", ch, e)
+                        status, path = "failed", None
+                    yield ch, status, path
+                    submit_next()
+    finally:
+        session.close()
+        save_manifest(manifest, manifest_path)
+
+
+def sync_chapters(start: int = 1, end: int = 99, save_dir: str = CHAPTERS_DIR,
+                  workers: int = DOWNLOAD_WORKERS, rate: float = DOWNLOAD_RATE,
+                  burst: int = DOWNLOAD_BURST, base: str = BASE,
+                  manifest_path: str = MANIFEST_PATH, force: bool = False,
+                  chapters=None) -> dict:
+    """
+    Incremental download of chapters start..end using the chapter manifest.
+    Unchanged chapters are revalidated with a conditional request (or a
+    content-hash comparison when the server sends no validators) and left
+    on disk as they are. Changed chapters stay "changed" on later runs until
+    mark_loaded() is called for them. chapters, when given, are the chapter
+    numbers to sync instead of start..end. Returns {"changed": [...],
+    "unchanged": [...], "failed": [chapter numbers]} with paths in chapter order.
+    """
+    outcome = {}
+    for ch, status, path in iter_sync_chapters(start, end, save_dir, workers, rate, burst,
+                                               base, manifest_path, force, chapters):
+        outcome[ch] = (status, ch if status == "failed" else path)
+
+    result = {"changed": [], "unchanged": [], "failed": []}
+    for ch in sorted(outcome):
+        status, value = outcome[ch]
+        result[status].append(value)
+    logger.info("Sync finished: %d changed, %d unchanged, %d failed",
+                len(result["changed"]), len(result["unchanged"]), len(result["failed"]))
+    return result
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Download HTS chapters as XLSX.")
+    ap.add_argument("start", type=int, nargs="?", default=1)
+    ap.add_argument("end", type=int, nargs="?")
+    ap.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS,
+                    help="concurrent chapter downloads (1 = sequential)")
+    ap.add_argument("--rate", type=float, default=DOWNLOAD_RATE,
+                    help="max requests per second in concurrent mode")
+    ap.add_argument("--base", default=BASE, help="HTS site base URL")
+    ap.add_argument("--sync", action="store_true",
+                    help="incremental mode: only fetch chapters changed since the last run")
+    ap.add_argument("--force", action="store_true",
+                    help="with --sync, ignore the manifest and treat every chapter as changed")
+    args = ap.parse_args(argv)
+    s = args.start
+    e = args.end if args.end is not None else s
     logger.info("Downloader invoked: chapters %d - %d", s, e)
-    files = download_all_chapters(start=s, end=e)
+    if args.sync:
+        files = sync_chapters(start=s, end=e, workers=args.workers, rate=args.rate,
+                              base=args.base, force=args.force)
+    elif args.workers > 1:
+        files = download_all_chapters_concurrent(start=s, end=e, workers=args.workers,
+                                                 rate=args.rate, base=args.base)
+    else:
+        files = download_all_chapters(start=s, end=e, workers=1, base=args.base)
     logger.info("Downloader finished. Files: %s", files)
+
+
+if __name__ == "__main__":
+    main()
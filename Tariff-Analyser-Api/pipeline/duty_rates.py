@@ -0,0 +1,172 @@
+# duty_rates.py
+"""
+Structured duty rates.
+
+Turns rate-of-duty text such as "6.8%", "1.5¢/kg + 3%", "$1.58/pr. + 35%"
+or "Free (A+,AU,BH)" into numbers:
+
+    ad_valorem       percent of value (Free -> 0)
+    specific         specific amount in US dollars (¢ converted)
+    specific_unit    unit the specific amount applies to ("kg", "liter", "each")
+    compound         1 when the rate combines more than one component or
+                     applies to part of the value only ("on the case")
+
+A compound rate gives its leading ad valorem and specific components:
+"56¢ each + 4.4% on the case + 2% on the strap" -> (4.4, 0.56, "each", 1).
+Text that is not a rate ("No change", "The rate applicable to each garment
+...") gives NULLs. A column holds only a few hundred distinct strings, so
+each one is parsed once (parse_rate is memoized) and the results are
+spread back over the rows.
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+RATE_FIELDS = ["ad_valorem", "specific", "specific_unit", "compound"]
+
+# (prefix of the derived columns, raw text column)
+RATE_COLUMNS = [
+    ("general", "general_rate_of_duty"),
+    ("special", "special_rate_of_duty"),
+    ("column2", "column2_rate_of_duty"),
+]
+
+_PERCENT = re.compile(r"(\d*\.?\d+)(?:\s+(\d+)/(\d+))?\s*%")
+_SPECIFIC = re.compile(r"(\$)?\s*(\d*\.?\d+)\s*(¢)?\s*(?:/\s*(.+)|(each))")
+_TAGS = re.compile(r"<sup>(.*?)</sup>|<[^>]+>")
+# what a component applies to or how it is adjusted: "on the battery",
+# "over 7", "for each other piece", "less 0.02¢/kg for each degree ..."
+_QUALIFIER = re.compile(r"\s+(?:on|over|for|less)\s.*$")
+
+UNPARSED = (None, None, None, 0)
+
+
+def _unit(text):
+    return re.sub(r"\s+", " ", text).strip().rstrip(".")[:32]
+
+
+@lru_cache(maxsize=None)
+def parse_rate(text):
+    """(ad_valorem, specific, specific_unit, compound) for one rate string."""
+    if not isinstance(text, str):
+        return UNPARSED
+    # special rates name their programs in parentheses; the leading rate is
+    # the one before the first program list
+    text = _TAGS.sub(lambda m: m.group(1) or "", text)
+    rate = re.sub(r"\s+", " ", text.split("(", 1)[0]).strip()
+    if not rate:
+        return UNPARSED
+    if rate.rstrip(".").lower() == "free":
+        return (0.0, None, None, 0)
+
+    ad_valorem = specific = unit = None
+    qualified = False
+    parts = [p.strip() for p in rate.split("+")]
+    # the first ad valorem and specific components; parsing stops at the
+    # first component that is neither
+    for part in parts:
+        core = _QUALIFIER.sub("", part)
+        qualified = qualified or core != part
+        m = _PERCENT.fullmatch(core)
+        if m:
+            if ad_valorem is None:
+                value = float(m.group(1))
+                if m.group(2):
+                    value += int(m.group(2)) / int(m.group(3))
+                ad_valorem = round(value, 4)
+            continue
+        m = _SPECIFIC.fullmatch(core)
+        if m:
+            if specific is None:
+                value = float(m.group(2)) / (100 if m.group(3) else 1)
+                specific = round(value, 6)
+                unit = _unit(m.group(4) or m.group(5))
+            continue
+        break
+    if ad_valorem is None and specific is None:
+        return UNPARSED
+    return (ad_valorem, specific, unit, int(len(parts) > 1 or qualified))
+
+
+def parse_rate_column(col):
+    """
+    Parse a column of rate strings. Returns a frame with RATE_FIELDS on
+    col's index; each distinct string is parsed only once.
+    """
+    codes, uniques = pd.factorize(col)
+    parsed = [parse_rate(u) for u in uniques] + [UNPARSED]  # code -1 = missing
+    table = pd.DataFrame(parsed, columns=RATE_FIELDS)
+    out = table.iloc[np.where(codes < 0, len(uniques), codes)].set_index(col.index)
+    return out.astype(
+        {"ad_valorem": "float64", "specific": "float64", "specific_unit": "object", "compound": "int8"}
+    )
+
+
+def add_rate_columns(df):
+    """
+    Add <prefix>_<field> columns (general_ad_valorem, column2_specific, ...)
+    next to the raw rate text columns of df, in place. Returns df.
+    """
+    for prefix, source in RATE_COLUMNS:
+        parsed = parse_rate_column(df[source])
+        for field in RATE_FIELDS:
+            df[f"{prefix}_{field}"] = parsed[field]
+    return df
+
+
+def rate_column_names():
+    return [f"{prefix}_{field}" for prefix, _ in RATE_COLUMNS for field in RATE_FIELDS]
+
+
+# ---------- special programs ----------
+# "Free (A+,AU,BH) 3.2% (JP) See 9822.04.25 (AU)" -> one (rate, program)
+# pair per program code listed in a group
+_PROGRAM_GROUP = re.compile(r"([^()]*)\(([^()]*)\)")
+_PROGRAM_CODE = re.compile(r"[A-Z][A-Z0-9]?[*+]?")
+
+SPECIAL_PROGRAM_COLUMNS = [
+    "hts_code", "chapter", "program_code", "rate", "ad_valorem", "specific_amount",
+]
+
+
+@lru_cache(maxsize=None)
+def split_special_programs(text):
+    """Tuple of (program_code, rate text) pairs in a special rate string."""
+    if not isinstance(text, str):
+        return ()
+    text = re.sub(r"\s+", " ", _TAGS.sub(lambda m: m.group(1) or "", text))
+    pairs, rate = {}, ""
+    for m in _PROGRAM_GROUP.finditer(text):
+        rate = m.group(1).strip() or rate  # "(A) (B)" shares the previous rate
+        for code in m.group(2).split(","):
+            code = code.strip()
+            if rate and _PROGRAM_CODE.fullmatch(code):
+                pairs[code] = rate[:255]
+    return tuple(pairs.items())
+
+
+def expand_special_programs(df):
+    """
+    One row per (hts_code, program_code) from the special_rate_of_duty
+    column of df, with the rate text and its parsed ad_valorem and
+    specific amount.
+    Rows without an hts_code are skipped; duplicate codes keep the last row,
+    as the product_table loaders do.
+    """
+    df = df[df["hts_code"].fillna("").str.strip() != ""]
+    df = df.drop_duplicates(subset="hts_code", keep="last")
+    codes, uniques = pd.factorize(df["special_rate_of_duty"])
+    pairs = [
+        (u, program, rate) + parse_rate(rate)[:2]
+        for u, text in enumerate(uniques)
+        for program, rate in split_special_programs(text)
+    ]
+    table = pd.DataFrame(pairs, columns=["u"] + SPECIAL_PROGRAM_COLUMNS[2:])
+    rows = pd.DataFrame(
+        {"hts_code": df["hts_code"].to_numpy(), "chapter": df["chapter"].to_numpy(), "u": codes}
+    )
+    out = rows.merge(table, on="u").drop(columns="u")
+    out["chapter"] = out["chapter"].astype("Int64")
+    return out[SPECIAL_PROGRAM_COLUMNS].reset_index(drop=True)
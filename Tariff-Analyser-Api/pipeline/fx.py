@@ -0,0 +1,372 @@
+# fx.py
+"""
+Currency conversion for impact figures and loaded amounts.
+
+currency_table and country_currency (parsed/currency.xlsx and
+iban_country_currency.csv) only name the currencies; the rates come from
+a rates file (config.FX_RATES_PATH, HTS_FX_RATES) in either shape:
+
+    currency,date,rate              one row per quote
+    date,EUR,GBP,...                one column per currency
+
+A rate is the number of units of the currency per 1 FX_BASE_CURRENCY
+(USD); rows without a date hold for every date. The quotes become a
+compact rate table: per-currency runs of (day, rate) sorted by day in
+flat int64/float64 arrays, cached in parsed/fx_rates.npz keyed by the
+SHA-256 of the rates file. A conversion is one searchsorted over the
+whole array of (currency, day) keys, taking the quote nearest to each
+date (the earlier one on a tie):
+
+    rates = RateTable.load_or_build()
+    rates.convert(amounts, "USD", "EUR", dates)          # arrays or scalars
+    rates.convert(100_000, "USD", currency_of("FRANCE"), "2025-03-01")
+
+Scalar conversions go through an LRU cache of recent (from, to, day)
+factors (FX_CACHE_SIZE entries). convert_columns() adds <column>_<CCY>
+copies of amount columns at load time (tariff_impact_analyser.py, when
+HTS_FX_CONVERT is set).
+
+    python fx.py --amount 100000 --from USD --to EUR --date 2025-03-01
+"""
+import os
+import re
+import argparse
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from logger import logger
+from config import FX_RATES_PATH, FX_TABLE_PATH, FX_BASE_CURRENCY, FX_CACHE_SIZE
+from utils import file_sha256
+from parsed_io import is_parquet
+from tariff_impact_analyser import SOURCES, normalize_columns
+from load_csv_to_mysql import COUNTRY_CSV
+
+CURRENCY_SOURCE = next(path for name, path, _ in SOURCES if name == "currency")
+TABLE_VERSION = 1
+
+# rates file columns (normalized, lower-case), first one present
+CURRENCY_COLUMNS = ["currency", "code", "currency_code", "iso_4217_code"]
+DATE_COLUMNS = ["date", "as_of", "rate_date"]
+RATE_COLUMNS = ["rate", "fx_rate", "rate_per_usd", "value"]
+
+# amount columns convert_columns() converts by default, the column naming their
+# currency (FX_BASE_CURRENCY when absent), and the date columns, first one present
+AMOUNT_COLUMNS = ["Trade_Value", "Trade_Value_(USD)", "Import_Value", "Value", "Amount"]
+ROW_CURRENCY_COLUMNS = ["Currency", "Currency_Code"]
+ROW_DATE_COLUMNS = ["Date", "Effective_Date"]
+
+_CODE = re.compile(r"(?<![A-Z])([A-Z]{3})(?![A-Z])")
+# day keys: currency index in the high 32 bits, day + 2**31 in the low ones
+_DAY_BIAS = 1 << 31
+LATEST = _DAY_BIAS - 1  # a day after every quote: the latest one is nearest
+
+
+def currency_code(value):
+    """ISO 4217 code in value ("eur", "EUR (€)"), or None."""
+    if not isinstance(value, str):
+        return None
+    match = _CODE.search(value.strip().upper())
+    return match.group(1) if match else None
+
+
+def currency_codes(path=CURRENCY_SOURCE):
+    """The ISO codes listed in parsed/currency.xlsx."""
+    df = pd.read_excel(path)
+    df.columns = [c.lower() for c in normalize_columns(df.columns)]
+    return {code for code in map(currency_code, df["iso_4217_code"]) if code}
+
+
+@lru_cache(maxsize=None)
+def country_currencies(path=COUNTRY_CSV):
+    """{COUNTRY (upper-case): ISO code} from iban_country_currency.csv."""
+    df = pd.read_csv(path, dtype=str).dropna(subset=["country", "code"])
+    return dict(zip(df["country"].str.strip().str.upper(), df["code"].str.strip()))
+
+
+def currency_of(countries):
+    """ISO code of a country name, or an object array of them for an array of names."""
+    lookup = country_currencies()
+    if isinstance(countries, str):
+        return lookup.get(countries.strip().upper())
+    codes, uniques = pd.factorize(pd.Series(countries, dtype=object).str.strip().str.upper())
+    mapped = np.array([lookup.get(c) for c in uniques] + [None], dtype=object)
+    return mapped[codes]  # code -1 (missing) picks the trailing None
+
+
+def to_days(dates):
+    """Days since 1970-01-01 (int64) for a date or array of dates; None -> LATEST."""
+    if dates is None:
+        return np.int64(LATEST)
+    if np.ndim(dates) == 0:
+        stamp = pd.Timestamp(dates)
+        return np.int64(LATEST) if pd.isna(stamp) else np.int64(stamp.value // 86_400_000_000_000)
+    stamps = pd.to_datetime(pd.Series(np.asarray(dates)), errors="coerce")
+    days = stamps.to_numpy("datetime64[D]").astype(np.int64)
+    days[stamps.isna().to_numpy()] = LATEST
+    return days
+
+
+def mid_year(years):
+    """July 1st of each year, the date convert_columns() uses for rows with only a Year."""
+    years = pd.to_numeric(pd.Series(np.atleast_1d(years)), errors="coerce")
+    return pd.to_datetime(years.astype("Int64").astype(str) + "-07-01", errors="coerce")
+
+
+def read_rates(path=FX_RATES_PATH):
+    """The rates file as a long frame of (currency, date, rate)."""
+    if path.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path)
+    elif is_parquet(path):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    df.columns = [c.lower() for c in normalize_columns(df.columns)]
+    date_column = next((c for c in DATE_COLUMNS if c in df.columns), None)
+    currency_column = next((c for c in CURRENCY_COLUMNS if c in df.columns), None)
+    if currency_column is None:
+        # wide: one column per currency
+        codes = {c: currency_code(c) for c in df.columns if c != date_column}
+        codes = {c: code for c, code in codes.items() if code}
+        if not codes:
+            raise ValueError(f"{path}: no currency column ({', '.join(CURRENCY_COLUMNS)}) or currency columns")
+        df = df.rename(columns=codes).melt(
+            id_vars=[date_column] if date_column else None,
+            value_vars=list(codes.values()), var_name="currency", value_name="rate",
+        )
+    else:
+        rate_column = next((c for c in RATE_COLUMNS if c in df.columns), None)
+        if rate_column is None:
+            raise ValueError(f"{path}: no rate column ({', '.join(RATE_COLUMNS)})")
+        df = df.rename(columns={currency_column: "currency", rate_column: "rate"})
+    df = df.rename(columns={date_column: "date"}) if date_column else df.assign(date=None)
+    return pd.DataFrame({
+        "currency": df["currency"].map(currency_code),
+        "date": pd.to_datetime(df["date"], errors="coerce"),
+        "rate": pd.to_numeric(df["rate"], errors="coerce"),
+    })
+
+
+class RateTable:
+    def __init__(self, codes, offsets, days, rates, base=FX_BASE_CURRENCY, source=None,
+                 cache_size=FX_CACHE_SIZE):
+        self.codes = list(codes)  # sorted ISO codes
+        self.offsets = offsets  # np.int64, quotes of codes[i] are [offsets[i], offsets[i + 1])
+        self.days = days  # np.int64 days since epoch, ascending within each currency
+        self.rates = rates  # np.float64 units per 1 base
+        self.base = base
+        self.source = source  # sha256 of the rates file
+        self._index = {code: i for i, code in enumerate(self.codes)}
+        currency = np.repeat(np.arange(len(self.codes), dtype=np.int64), np.diff(offsets))
+        self._keys = (currency << 32) | (days + _DAY_BIAS)
+        self._factor = lru_cache(maxsize=cache_size)(self._scalar_factor)
+
+    # ---------- build ----------
+    @classmethod
+    def from_frame(cls, df, base=FX_BASE_CURRENCY, source=None):
+        """Build from (currency, date, rate) rows; later duplicates of a quote win."""
+        df = df.dropna(subset=["currency", "rate"])
+        df = df[df["rate"] > 0]
+        days = to_days(df["date"].to_numpy()) if len(df) else np.zeros(0, dtype=np.int64)
+        # undated rates hold for every date: one quote at day 0 is nearest to all of them
+        days = np.where(days == LATEST, 0, days)
+        quotes = pd.DataFrame({"currency": df["currency"].to_numpy(), "day": days, "rate": df["rate"].to_numpy(float)})
+        quotes = quotes.drop_duplicates(["currency", "day"], keep="last").sort_values(["currency", "day"])
+        codes, counts = np.unique(quotes["currency"].to_numpy(str), return_counts=True)
+        known = _known_codes()
+        if known:
+            unknown = sorted(set(codes) - known - {base})
+            if unknown:
+                logger.warning(f"Rates for currencies not in currency_table: {', '.join(unknown)}")
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(
+            codes.tolist(),
+            offsets,
+            np.ascontiguousarray(quotes["day"].to_numpy(np.int64)),
+            np.ascontiguousarray(quotes["rate"].to_numpy(np.float64)),
+            base,
+            source,
+        )
+
+    @classmethod
+    def from_file(cls, path=FX_RATES_PATH, base=FX_BASE_CURRENCY):
+        return cls.from_frame(read_rates(path), base, source=file_sha256(path))
+
+    # ---------- persistence ----------
+    def save(self, path=FX_TABLE_PATH):
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as fh:
+            np.savez(
+                fh,
+                codes=np.array(self.codes, dtype=str),
+                offsets=self.offsets,
+                days=self.days,
+                rates=self.rates,
+                base=np.array(self.base),
+                version=np.array(TABLE_VERSION),
+                source=np.array(self.source or ""),
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"FX rate table saved to {path} ({len(self.codes)} currencies, {len(self)} quotes)")
+
+    @classmethod
+    def load(cls, path=FX_TABLE_PATH):
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != TABLE_VERSION:
+                raise ValueError(f"{path}: rate table version {int(z['version'])}, expected {TABLE_VERSION}")
+            return cls(
+                z["codes"].tolist(), z["offsets"], z["days"], z["rates"],
+                str(z["base"]), str(z["source"]) or None,
+            )
+
+    @classmethod
+    def load_or_build(cls, source_path=FX_RATES_PATH, path=FX_TABLE_PATH):
+        """Load the cached rate table, rebuilding it when the rates file has changed."""
+        source = file_sha256(source_path)
+        if os.path.exists(path):
+            try:
+                table = cls.load(path)
+                if table.source == source:
+                    return table
+            except Exception as e:
+                logger.warning(f"Rebuilding FX rate table ({e})")
+        table = cls.from_file(source_path)
+        table.save(path)
+        return table
+
+    # ---------- lookups ----------
+    def __len__(self):
+        return len(self.rates)
+
+    def _currency_index(self, currencies):
+        """
+        Index into codes per currency: -1 for the base currency, -2 for
+        unknown or missing ones. Scalars give a scalar.
+        """
+        def index(value):
+            code = currency_code(value)
+            if code == self.base:
+                return -1
+            return self._index.get(code, -2)
+
+        if np.ndim(currencies) == 0:
+            return np.int64(index(currencies))
+        codes, uniques = pd.factorize(pd.Series(np.asarray(currencies, dtype=object)))
+        mapped = np.array([index(v) for v in uniques] + [-2], dtype=np.int64)
+        return mapped[codes]
+
+    def _rates(self, currency, days):
+        """Rate of each (currency index, day): nearest quote, 1 for the base, NaN if unknown."""
+        currency, days = np.broadcast_arrays(np.asarray(currency, dtype=np.int64), np.asarray(days, dtype=np.int64))
+        out = np.full(currency.shape, np.nan)
+        out[currency == -1] = 1.0
+        quoted = currency >= 0
+        if not quoted.any() or not len(self):
+            return out
+        c, d = currency[quoted], days[quoted]
+        pos = np.searchsorted(self._keys, (c << 32) | (d + _DAY_BIAS))
+        first, last = self.offsets[c], self.offsets[c + 1] - 1
+        before = np.clip(pos - 1, first, last)
+        after = np.clip(pos, first, last)
+        nearer = np.where(self.days[after] - d < d - self.days[before], after, before)
+        out[quoted] = self.rates[nearer]
+        return out
+
+    def rate(self, currency, dates=None):
+        """Units of currency per 1 base on (or nearest to) each date; NaN where unknown."""
+        return self._rates(self._currency_index(currency), to_days(dates))
+
+    def _scalar_factor(self, from_currency, to_currency, day):
+        rates = self._rates(
+            np.array([self._currency_index(from_currency), self._currency_index(to_currency)]), day
+        )
+        return float(rates[1] / rates[0])
+
+    def convert(self, amounts, from_currency, to_currency, dates=None):
+        """
+        Amounts in from_currency expressed in to_currency at the quotes
+        nearest to dates (the latest quotes when None). Each argument is a
+        scalar or an array of the same length; NaN where a currency has no
+        rates. All-scalar conversions are served from the LRU cache.
+        """
+        scalar = all(np.ndim(v) == 0 for v in (from_currency, to_currency, dates))
+        if scalar:
+            day = int(to_days(dates))
+            factor = self._factor(currency_code(from_currency), currency_code(to_currency), day)
+            return np.asarray(amounts, dtype=np.float64) * factor
+        days = to_days(dates)
+        source = self._rates(self._currency_index(from_currency), days)
+        target = self._rates(self._currency_index(to_currency), days)
+        return np.asarray(amounts, dtype=np.float64) * (target / source)
+
+    def cache_info(self):
+        return self._factor.cache_info()
+
+
+def _known_codes():
+    try:
+        return currency_codes()
+    except Exception:
+        return set()
+
+
+def row_dates(df):
+    """The date each row's amounts are converted at: a Date column, else July 1st of its Year."""
+    column = next((c for c in ROW_DATE_COLUMNS if c in df.columns), None)
+    if column:
+        return pd.to_datetime(df[column], errors="coerce").to_numpy()
+    if "Year" in df.columns:
+        return mid_year(df["Year"]).to_numpy()
+    return None
+
+
+def convert_columns(df, to, columns=None, rates=None):
+    """
+    df with a <column>_<CCY> copy of each amount column (AMOUNT_COLUMNS
+    present by default) per currency in to. Amounts are in the row's
+    Currency column, or FX_BASE_CURRENCY, as of row_dates().
+    """
+    columns = [c for c in (columns or AMOUNT_COLUMNS) if c in df.columns]
+    if not columns or not to:
+        return df
+    rates = rates or RateTable.load_or_build()
+    currency_column = next((c for c in ROW_CURRENCY_COLUMNS if c in df.columns), None)
+    source = df[currency_column].to_numpy(object) if currency_column else rates.base
+    dates = row_dates(df)
+    df = df.copy()
+    for code in to:
+        # one factor per row, shared by every amount column
+        factor = rates.convert(np.ones(len(df)), source, code, dates)
+        for column in columns:
+            df[f"{column}_{code}"] = pd.to_numeric(df[column], errors="coerce").to_numpy(float) * factor
+        missing = int(np.isnan(factor).sum())
+        if missing:
+            logger.warning(f"No {code} rate for {missing} rows")
+    return df
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Convert amounts with the FX rate table.")
+    ap.add_argument("--rates", default=FX_RATES_PATH, help="rates file (currency,date,rate or wide)")
+    ap.add_argument("--rebuild", action="store_true", help="rebuild parsed/fx_rates.npz")
+    ap.add_argument("--amount", type=float, default=1.0)
+    ap.add_argument("--from", dest="from_currency", default=FX_BASE_CURRENCY, help="ISO code")
+    ap.add_argument("--to", dest="to_currency", help="ISO code")
+    ap.add_argument("--country", help="convert to this country's currency (iban_country_currency.csv)")
+    ap.add_argument("--date", help="YYYY-MM-DD (default: latest quotes)")
+    args = ap.parse_args(argv)
+
+    table = RateTable.from_file(args.rates) if args.rebuild else RateTable.load_or_build(args.rates)
+    if args.rebuild:
+        table.save()
+    target = args.to_currency or (currency_of(args.country) if args.country else None)
+    if target:
+        value = float(table.convert(args.amount, args.from_currency, target, args.date))
+        print(f"{args.amount:,.2f} {args.from_currency.upper()} = {value:,.2f} {target.upper()}")
+    else:
+        print(f"{len(table.codes)} currencies, {len(table)} quotes, base {table.base}")
+
+
+if __name__ == "__main__":
+    main()
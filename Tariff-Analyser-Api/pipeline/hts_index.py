@@ -0,0 +1,228 @@
+# hts_index.py
+"""
+In-memory prefix index over the parsed HTS codes.
+
+Codes are keyed by their digits ("8471.30.01.00" -> "8471300100") and kept
+in one sorted list, so every prefix is a contiguous slice found with two
+binary searches. Each code also carries its parent in the index (the
+longest proper prefix that is itself a code) and its hierarchy path:
+section, chapter, main_category, subcategory, group.
+
+    idx = HtsIndex.load_or_build()
+    idx.prefix("8471")          # every code under heading 8471
+    idx.children("0901")        # top-level codes under heading 0901
+    idx.ancestors("0901.21.00.20")
+    idx.path("0901.21.00.20")
+"""
+import os
+import re
+import pickle
+import argparse
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from logger import logger
+from config import HTS_INDEX_PATH
+from utils import file_sha256
+from parsed_io import parsed_path, read_parsed
+
+PATH_FIELDS = ["section", "chapter", "main_category", "subcategory", "group"]
+INDEX_VERSION = 1
+
+PARSED_FILE = parsed_path()
+
+
+def hts_key(code):
+    """Digits of an HTS code or prefix ("0901.21" -> "090121")."""
+    return re.sub(r"\D", "", str(code))
+
+
+class HtsIndex:
+    def __init__(self, keys, codes, parents, paths, categories, source=None):
+        self.keys = keys  # sorted digit keys
+        self.codes = codes  # codes as printed, same order
+        self.parents = parents  # np.int32 position of the parent, -1 for none
+        self.paths = paths  # {field: np.int32 category codes}
+        self.categories = categories  # {field: list of values}
+        self.source = source  # sha256 of the parsed file the index was built from
+        self._pos = {k: i for i, k in enumerate(keys)}
+
+    # ---------- build ----------
+    @classmethod
+    def from_frame(cls, df, source=None):
+        """Build from parsed rows (hts_code plus PATH_FIELDS); later duplicates win."""
+        df = df.assign(key=df["hts_code"].fillna("").map(hts_key))
+        df = df[df["key"] != ""].drop_duplicates(subset="key", keep="last")
+        df = df.sort_values("key", kind="stable")
+
+        keys = df["key"].tolist()
+        parents = np.full(len(keys), -1, dtype=np.int32)
+        stack = []
+        for i, key in enumerate(keys):
+            while stack and not key.startswith(keys[stack[-1]]):
+                stack.pop()
+            if stack:
+                parents[i] = stack[-1]
+            stack.append(i)
+
+        paths, categories = {}, {}
+        for field in PATH_FIELDS:
+            values = df[field] if field in df.columns else pd.Series("", index=df.index)
+            codes, uniques = pd.factorize(values.astype(object).where(values.notna(), "").astype(str))
+            paths[field] = codes.astype(np.int32)
+            categories[field] = list(uniques)
+        codes = df["hts_code"].str.strip().tolist()
+        return cls(keys, codes, parents, paths, categories, source)
+
+    @classmethod
+    def from_file(cls, parsed_file=PARSED_FILE):
+        """Build from a parsed file (Parquet or CSV, see parsed_io)."""
+        df = read_parsed(parsed_file, columns=["hts_code"] + PATH_FIELDS)
+        return cls.from_frame(df, source=file_sha256(parsed_file))
+
+    # ---------- persistence ----------
+    def save(self, path=HTS_INDEX_PATH):
+        state = {
+            "version": INDEX_VERSION,
+            "keys": self.keys,
+            "codes": self.codes,
+            "parents": self.parents,
+            "paths": self.paths,
+            "categories": self.categories,
+            "source": self.source,
+        }
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as fh:
+            pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        logger.info(f"HTS index saved to {path} ({len(self)} codes)")
+
+    @classmethod
+    def load(cls, path=HTS_INDEX_PATH):
+        with open(path, "rb") as fh:
+            state = pickle.load(fh)
+        if state.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path}: index version {state.get('version')}, expected {INDEX_VERSION}")
+        state.pop("version")
+        return cls(**state)
+
+    @classmethod
+    def load_or_build(cls, parsed_file=PARSED_FILE, path=HTS_INDEX_PATH):
+        """Load the saved index, rebuilding it when the parsed file has changed."""
+        source = file_sha256(parsed_file)
+        if os.path.exists(path):
+            try:
+                index = cls.load(path)
+                if index.source == source:
+                    return index
+            except Exception as e:
+                logger.warning(f"Rebuilding HTS index ({e})")
+        index = cls.from_file(parsed_file)
+        index.save(path)
+        return index
+
+    # ---------- queries ----------
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, code):
+        return hts_key(code) in self._pos
+
+    def _range(self, prefix):
+        key = hts_key(prefix)
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + ":", lo)  # ":" sorts right after "9"
+        return key, lo, hi
+
+    def prefix(self, prefix):
+        """Codes starting with prefix (including an exact match), in order."""
+        _, lo, hi = self._range(prefix)
+        return self.codes[lo:hi]
+
+    def count(self, prefix):
+        _, lo, hi = self._range(prefix)
+        return hi - lo
+
+    def descendants(self, code):
+        """Codes strictly below code."""
+        key, lo, hi = self._range(code)
+        if lo < hi and self.keys[lo] == key:
+            lo += 1
+        return self.codes[lo:hi]
+
+    def children(self, code):
+        """
+        Codes directly below code: descendants whose parent is code itself,
+        or lies outside the prefix (so a heading like "0901" that is not a
+        code of its own still has children).
+        """
+        key, lo, hi = self._range(code)
+        start = lo + 1 if lo < hi and self.keys[lo] == key else lo
+        return [
+            self.codes[i]
+            for i in range(start, hi)
+            if self.parents[i] < start or self.parents[i] >= hi
+        ]
+
+    def parent(self, code):
+        """Closest ancestor present in the index, or None."""
+        chain = self.ancestors(code)
+        return chain[-1] if chain else None
+
+    def ancestors(self, code):
+        """Codes above code, outermost first."""
+        key = hts_key(code)
+        i = self._pos.get(key)
+        if i is not None:
+            i = self.parents[i]
+        else:
+            # not a code itself: start from its longest indexed prefix
+            i = next((self._pos[key[:n]] for n in range(len(key) - 1, 0, -1) if key[:n] in self._pos), -1)
+        chain = []
+        while i >= 0:
+            chain.append(self.codes[i])
+            i = self.parents[i]
+        return chain[::-1]
+
+    def path(self, code):
+        """Hierarchy path of code as a dict, or None if code is not indexed."""
+        i = self._pos.get(hts_key(code))
+        if i is None:
+            return None
+        out = {"hts_code": self.codes[i]}
+        for field in PATH_FIELDS:
+            out[field] = self.categories[field][self.paths[field][i]]
+        return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build or query the HTS prefix index.")
+    ap.add_argument("--parsed-file", default=PARSED_FILE)
+    ap.add_argument("--index", default=HTS_INDEX_PATH)
+    ap.add_argument("--rebuild", action="store_true", help="rebuild even if the parsed file is unchanged")
+    ap.add_argument("--prefix", help="list codes under a prefix")
+    ap.add_argument("--children", help="list the direct children of a code or heading")
+    ap.add_argument("--ancestors", help="list the ancestors of a code")
+    ap.add_argument("--path", help="print the hierarchy path of a code")
+    args = ap.parse_args(argv)
+
+    if args.rebuild:
+        index = HtsIndex.from_file(args.parsed_file)
+        index.save(args.index)
+    else:
+        index = HtsIndex.load_or_build(args.parsed_file, args.index)
+    for query, method in [
+        (args.prefix, index.prefix),
+        (args.children, index.children),
+        (args.ancestors, index.ancestors),
+    ]:
+        if query:
+            print("\n".join(method(query)))
+    if args.path:
+        print(index.path(args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# impact_cube.py
+"""
+Materialized aggregation cube over the ingested tariff dataset
+(tariff_table, loaded by tariff_impact_analyser.py).
+
+tariff_impact_cube has one cell per combination of Year x
+Product_Category x Subcategory x Origin_Country x Destination_Country
+values, where each dimension is either a value or rolled up to "any" (0
+for the year, "" for text, as in impact_engine). Every group-by and
+roll-up the dashboards ask for is therefore a set of cells found by key.
+Each cell keeps additive totals:
+
+    row_count          source rows in the cell
+    rate_sum           sum of their duty rates
+    trade_value        sum of their trade values
+    weighted_rate_sum  sum of duty rate x trade value
+
+lookup() and slice_cube() derive the average duty rate, the
+trade-weighted duty rate and the duty amount (weighted_rate_sum / 100)
+from these totals. The trade value is read from the dataset's trade value
+column when it has one. Without one, every row counts as the endpoint's
+fixed shipment (impact_engine.SHIPMENT_VALUE).
+
+Refreshes are incremental. tariff_impact_cube_rows keeps a 64-bit content
+hash and a copy count for each distinct source row. A refresh aggregates
+only the rows added (+1) or removed (-1) since the last one, and adds
+those signed totals into the cells with an additive upsert. Cells left
+with no rows are deleted.
+
+    python impact_cube.py                     # refresh from tariff_table
+    python impact_cube.py --rebuild
+    python impact_cube.py --lookup --year 2025 --product-category Chemicals
+    python impact_cube.py --slice year subcategory --product-category Chemicals
+"""
+import time
+import argparse
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from logger import logger
+from db import get_backend, row_tuples
+from impact_engine import (
+    FILTERS,
+    KEY_SCHEMA,
+    RATE_COLUMNS,
+    SHIPMENT_VALUE,
+    SOURCE_TABLE,
+    combined_key,
+    read_source,
+    read_table,
+    write_results_file,
+)
+
+CUBE_TABLE = "tariff_impact_cube"
+ROWS_TABLE = "tariff_impact_cube_rows"
+DIMENSIONS = list(FILTERS)
+# trade value column of the dataset, first one present
+TRADE_VALUE_COLUMNS = ["Trade_Value", "Trade_Value_(USD)", "Import_Value", "Value"]
+
+MEASURES = ["row_count", "rate_sum", "trade_value", "weighted_rate_sum"]
+CUBE_SCHEMA = KEY_SCHEMA + [
+    ("row_count", "BIGINT NOT NULL"),
+    ("rate_sum", "DOUBLE NOT NULL"),
+    ("trade_value", "DOUBLE NOT NULL"),
+    ("weighted_rate_sum", "DOUBLE NOT NULL"),
+]
+# the primary key serves lookups led by year; these serve slices by the others
+CUBE_INDEXES = [
+    ("idx_cube_category", ["product_category", "subcategory"]),
+    ("idx_cube_route", ["origin_country", "destination_country"]),
+]
+ROW_COLUMNS = DIMENSIONS + ["duty_rate", "trade_value"]
+ROWS_SCHEMA = [
+    ("row_hash", "BIGINT NOT NULL"),
+    ("copies", "INT NOT NULL"),
+    ("year", "INT NOT NULL"),
+] + [(name, "VARCHAR(191)") for name in DIMENSIONS if name != "year"] + [
+    ("duty_rate", "DOUBLE"),
+    ("trade_value", "DOUBLE"),
+]
+
+
+def source_rows(df):
+    """
+    Cube input rows of a dataset frame (normalized column names): the
+    dimensions (year 0 and text None where missing), duty_rate, trade_value
+    and row_hash, a 64-bit hash of all of them.
+    """
+    rows = pd.DataFrame(index=df.index)
+    for name in DIMENSIONS:
+        column = FILTERS[name]
+        values = df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if name == "year":
+            rows[name] = pd.to_numeric(values, errors="coerce").fillna(0).astype(np.int64)
+        else:
+            rows[name] = values.astype(str).where(values.notna(), None).astype(object)
+    rate_column = next((c for c in RATE_COLUMNS if c in df.columns), None)
+    rows["duty_rate"] = (
+        pd.to_numeric(df[rate_column], errors="coerce").fillna(0).astype(float)
+        if rate_column else 0.0
+    )
+    value_column = next((c for c in TRADE_VALUE_COLUMNS if c in df.columns), None)
+    rows["trade_value"] = (
+        pd.to_numeric(df[value_column], errors="coerce").fillna(0).astype(float)
+        if value_column else float(SHIPMENT_VALUE)
+    )
+    rows["row_hash"] = pd.util.hash_pandas_object(rows[ROW_COLUMNS], index=False).to_numpy().view(np.int64)
+    return rows.reset_index(drop=True)
+
+
+def aggregate(rows, weights):
+    """
+    Cube cells (dimension keys plus MEASURES) of rows, each row counted
+    weights times (negative for removed rows). Rows missing a dimension
+    only reach the cells where it is rolled up.
+    """
+    n = len(rows)
+    weights = np.asarray(weights, dtype=np.float64)
+    rate = rows["duty_rate"].to_numpy(np.float64)
+    value = rows["trade_value"].to_numpy(np.float64)
+    contributions = {
+        "row_count": weights,
+        "rate_sum": weights * rate,
+        "trade_value": weights * value,
+        "weighted_rate_sum": weights * rate * value,
+    }
+    dims = {}
+    for name in DIMENSIONS:
+        values = rows[name]
+        missing = values.eq(0) if name == "year" else values.isna()
+        codes, uniques = pd.factorize(values.mask(missing))
+        dims[name] = (codes.astype(np.int64), np.asarray(uniques, dtype=object))
+
+    frames = []
+    for k in range(len(DIMENSIONS) + 1):
+        for subset in combinations(DIMENSIONS, k):
+            keep = np.ones(n, dtype=bool)
+            for name in subset:
+                keep &= dims[name][0] >= 0
+            idx = np.flatnonzero(keep)
+            if not len(idx):
+                continue
+            key, size = combined_key(
+                len(idx), [dims[name][0][idx] for name in subset], [len(dims[name][1]) for name in subset]
+            )
+            groups = np.flatnonzero(np.bincount(key, minlength=size))
+            first = np.full(size, len(idx))
+            np.minimum.at(first, key, np.arange(len(idx)))
+            first = idx[first[groups]]
+            cell = {}
+            for name in DIMENSIONS:
+                if name in subset:
+                    codes, uniques = dims[name]
+                    cell[name] = uniques[codes[first]]
+                else:
+                    cell[name] = 0 if name == "year" else ""
+            for measure, values in contributions.items():
+                cell[measure] = np.bincount(key, weights=values[idx], minlength=size)[groups]
+            frames.append(pd.DataFrame(cell))
+
+    if not frames:
+        return pd.DataFrame(columns=[name for name, _ in CUBE_SCHEMA])
+    cells = pd.concat(frames, ignore_index=True)
+    cells["year"] = cells["year"].astype(np.int64)
+    cells["row_count"] = cells["row_count"].round().astype(np.int64)
+    # a row replaced by another in the same cell can cancel out completely
+    return cells[cells[MEASURES].ne(0).any(axis=1)].reset_index(drop=True)
+
+
+def create_cube_tables(conn):
+    backend = conn.backend
+    backend.create_table(
+        conn, CUBE_TABLE, CUBE_SCHEMA,
+        primary_key=[name for name, _ in KEY_SCHEMA], indexes=CUBE_INDEXES,
+    )
+    backend.create_table(conn, ROWS_TABLE, ROWS_SCHEMA, primary_key=["row_hash"])
+    conn.commit()
+
+
+def _fetch_rows(conn, hashes, batch_size=500):
+    """Stored cube input rows (see source_rows) of the given hashes, indexed by row_hash."""
+    cursor = conn.cursor()
+    columns = ["row_hash"] + ROW_COLUMNS
+    out = []
+    for i in range(0, len(hashes), batch_size):
+        batch = hashes[i : i + batch_size]
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {ROWS_TABLE} "
+            f"WHERE row_hash IN ({conn.backend.placeholders(len(batch))})",
+            batch,
+        )
+        out.extend(cursor.fetchall())
+    return pd.DataFrame(out, columns=columns).set_index("row_hash")
+
+
+def refresh_cube(df=None, rebuild=False, backend=None, batch_size=5000):
+    """
+    Bring the cube up to date with the dataset df (default: tariff_table).
+    Only rows added or removed since the last refresh are aggregated; with
+    rebuild the cube is recomputed from scratch. Returns a summary dict.
+    """
+    started = time.perf_counter()
+    backend = backend or get_backend()
+    if df is None:
+        df = read_table(SOURCE_TABLE, backend)
+    rows = source_rows(df)
+    copies = rows.groupby("row_hash", sort=False).size()
+    distinct = rows.drop_duplicates("row_hash").set_index("row_hash")
+
+    with backend.connection() as conn:
+        create_cube_tables(conn)
+        cursor = conn.cursor()
+        try:
+            if rebuild:
+                cursor.execute(f"DELETE FROM {CUBE_TABLE}")
+                cursor.execute(f"DELETE FROM {ROWS_TABLE}")
+            cursor.execute(f"SELECT row_hash, copies FROM {ROWS_TABLE}")
+            stored = pd.DataFrame(cursor.fetchall(), columns=["row_hash", "copies"])
+            stored = stored.set_index("row_hash")["copies"].astype(np.int64)
+
+            diff = copies.sub(stored, fill_value=0).astype(np.int64)
+            diff = diff[diff != 0]
+            is_new = diff.index.isin(distinct.index)
+            gone = diff.index[~is_new]
+            parts = [distinct.loc[diff.index[is_new]]]
+            if len(gone):
+                parts.append(_fetch_rows(conn, gone.tolist()).loc[gone])
+            delta = pd.concat(parts)
+            weights = diff.loc[delta.index]
+
+            cells = aggregate(delta[ROW_COLUMNS], weights.to_numpy())
+            keys = [name for name, _ in KEY_SCHEMA]
+            cube_sql = backend.upsert_sql(CUBE_TABLE, keys + MEASURES, keys, [], add_columns=MEASURES)
+            row_sql = backend.upsert_sql(
+                ROWS_TABLE, ["row_hash", "copies"] + ROW_COLUMNS, "row_hash", [], add_columns=["copies"]
+            )
+            stored_rows = delta[ROW_COLUMNS].assign(copies=weights)
+            stored_rows = stored_rows.reset_index()[["row_hash", "copies"] + ROW_COLUMNS]
+            for sql, frame in [(cube_sql, cells[keys + MEASURES]), (row_sql, stored_rows)]:
+                records = row_tuples(frame)
+                for i in range(0, len(records), batch_size):
+                    cursor.executemany(sql, records[i : i + batch_size])
+            cursor.execute(f"DELETE FROM {CUBE_TABLE} WHERE row_count = 0")
+            cursor.execute(f"DELETE FROM {ROWS_TABLE} WHERE copies = 0")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    summary = {
+        "rows": len(rows),
+        "added": int(weights[weights > 0].sum()),
+        "removed": int(-weights[weights < 0].sum()),
+        "cells_updated": len(cells),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Impact cube refreshed: {summary}")
+    return summary
+
+
+def _with_rates(cells):
+    cells = cells.copy()
+    count = cells["row_count"].astype(float)
+    value = cells["trade_value"].astype(float)
+    cells["avg_duty_rate"] = cells["rate_sum"] / count.where(count != 0)
+    cells["weighted_duty_rate"] = cells["weighted_rate_sum"] / value.where(value != 0)
+    cells["duty_amount"] = cells["weighted_rate_sum"] / 100
+    return cells
+
+
+def slice_cube(by=(), backend=None, **filters):
+    """
+    Cells with the dimensions in by broken out (every value), the filtered
+    dimensions fixed and all others rolled up, with the derived rates;
+    one frame row per cell. Filters are named as in impact_engine.FILTERS.
+    """
+    unknown = (set(filters) | set(by)) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown dimensions: {', '.join(sorted(unknown))}")
+    backend = backend or get_backend()
+    where, params = [], []
+    for name in DIMENSIONS:
+        value = filters.get(name)
+        any_value = 0 if name == "year" else ""
+        if name in by:
+            where.append(f"{name} <> {backend.placeholder}")
+            params.append(any_value)
+        else:
+            where.append(f"{name} = {backend.placeholder}")
+            params.append((int(value) if name == "year" else str(value)) if value else any_value)
+    columns = [name for name, _ in CUBE_SCHEMA]
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {CUBE_TABLE} WHERE {' AND '.join(where)}", params
+        )
+        cells = pd.DataFrame(cursor.fetchall(), columns=columns)
+    return _with_rates(cells).sort_values(list(by)).reset_index(drop=True) if by else _with_rates(cells)
+
+
+def lookup(backend=None, **filters):
+    """The cell of a filter combination (unset dimensions rolled up) as a dict, or None."""
+    cells = slice_cube((), backend, **filters)
+    return cells.iloc[0].to_dict() if len(cells) else None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Refresh or query the tariff impact cube.")
+    ap.add_argument("--source", help=f"dataset file to aggregate instead of {SOURCE_TABLE}")
+    ap.add_argument("--rebuild", action="store_true", help="recompute the cube from scratch")
+    ap.add_argument("--out", help="also export the cube to a Parquet or CSV file")
+    ap.add_argument("--lookup", action="store_true", help="print the cell of the filters below")
+    ap.add_argument("--slice", nargs="+", choices=DIMENSIONS, metavar="DIM",
+                    help="print the cells broken out by these dimensions")
+    for name in DIMENSIONS:
+        ap.add_argument("--" + name.replace("_", "-"), type=int if name == "year" else str)
+    args = ap.parse_args(argv)
+    filters = {name: getattr(args, name) for name in DIMENSIONS}
+
+    if args.lookup:
+        print(lookup(**filters))
+    elif args.slice:
+        print(slice_cube(args.slice, **filters).to_string(index=False))
+    else:
+        refresh_cube(read_source(args.source) if args.source else None, rebuild=args.rebuild)
+        if args.out:
+            write_results_file(read_table(CUBE_TABLE), args.out)
+
+
+if __name__ == "__main__":
+    main()
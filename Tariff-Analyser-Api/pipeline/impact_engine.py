@@ -0,0 +1,478 @@
+# impact_engine.py
+"""
+Tariff impact engine over the impact-analysis dataset (the tariff
+workbook loaded into tariff_table by tariff_impact_analyser.py).
+
+The dataset is read once into typed columns (year as int32, the filter
+dimensions as int32 category codes, the duty rate as float64) and cached
+in parsed/tariff_columns.npz, keyed by the SHA-256 of the source. Filters
+and the metrics of the /api/impact-analysis/tariffimpact endpoint are
+NumPy expressions over whole columns, so a query costs a few passes over
+contiguous arrays however many rows there are:
+
+    engine = ImpactEngine.load_or_build()
+    engine.impact(year=2025, product_category="Chemicals", max_rate=20)
+
+As in the endpoint, a filter combination is answered from the duty rate
+of its first matching row. precompute() answers every combination of the
+filter dimensions (each set to a value or "any") for the default rate
+range with one grouped pass per set of dimensions, and write_results() replaces
+tariff_impact_results with them. "Any" is stored as 0 for the year and
+"" for the text dimensions, so the API looks an answer up by primary key
+instead of scanning the workbook.
+
+    python impact_engine.py                                  # rebuild tariff_impact_results
+    python impact_engine.py --out parsed/tariff_impact.parquet --skip-db
+    python impact_engine.py --query --year 2025 --product-category Chemicals
+    python impact_engine.py --query --year 2025 --currency EUR
+
+Amounts are in US dollars; impact(currency=...) converts them with the
+FX rate table (fx.py) at the matched row's year.
+"""
+import os
+import json
+import time
+import argparse
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from logger import logger
+from config import IMPACT_COLUMNS_PATH
+from db import get_backend, row_tuples
+from utils import file_sha256
+from parsed_io import is_parquet
+from tariff_impact_analyser import SOURCES, normalize_columns
+from fx import RateTable, mid_year
+
+SOURCE = next(path for name, path, _ in SOURCES if name == "tariff")
+SOURCE_TABLE = next(table for name, _, table in SOURCES if name == "tariff")
+RESULTS_TABLE = "tariff_impact_results"
+COLUMNS_VERSION = 1
+
+# filter argument -> dataset column (normalized names, see normalize_columns)
+FILTERS = {
+    "year": "Year",
+    "product_category": "Product_Category",
+    "subcategory": "Subcategory",
+    "origin_country": "Origin_Country",
+    "destination_country": "Destination_Country",
+}
+TEXT_FILTERS = [name for name in FILTERS if name != "year"]
+# duty rate column, first one present (the endpoint accepts the same spellings)
+RATE_COLUMNS = ["Duty_Rate_(%)", "Duty_Rate", "duty_rate"]
+DEFAULT_MIN_RATE = 0.0
+DEFAULT_MAX_RATE = 100.0
+
+# impact model of the endpoint: a fixed shipment, period multipliers on the
+# duty rate, and extra duties as shares of the Trump-era base tariff
+SHIPMENT_VALUE = 100_000
+PERIODS = [("Pre-Trump", "pre_trump", 0.5), ("Trump Era", "trump", 1.0), ("Current", "current", 0.8)]
+DUTY_COMPONENTS = [
+    ("Base Tariff", "base_tariff", 1.0),
+    ("Anti-Dumping Duty", "anti_dumping", 0.3),
+    ("Countervailing Duty", "countervailing", 0.2),
+    ("Section 301 Tariff", "section301", 0.36),
+]
+# metrics that are amounts (USD) rather than rates
+MONEY_METRICS = (
+    [f"{key}_cost" for _, key, _ in PERIODS]
+    + [key for _, key, _ in DUTY_COMPONENTS if key != "base_tariff"]
+    + ["total_duty_cost"]
+)
+
+# tariff_impact_results: 4 x VARCHAR(191) + INT keeps the primary key
+# within InnoDB's 3072-byte limit in utf8mb4
+KEY_SCHEMA = [("year", "INT NOT NULL")] + [(name, "VARCHAR(191) NOT NULL") for name in TEXT_FILTERS]
+RESULT_SCHEMA = (
+    KEY_SCHEMA
+    + [("matched", "INT"), ("duty_rate", "DOUBLE"), ("min_rate", "DOUBLE"),
+       ("avg_rate", "DOUBLE"), ("max_rate", "DOUBLE")]
+    + [(f"{key}_{kind}", "DOUBLE") for _, key, _ in PERIODS for kind in ("rate", "cost")]
+    + [(key, "DOUBLE") for _, key, _ in DUTY_COMPONENTS if key != "base_tariff"]
+    + [("total_duty_cost", "DOUBLE")]
+)
+
+
+def impact_metrics(rates):
+    """Endpoint metrics for an array of duty rates, as {column: array}."""
+    rates = np.asarray(rates, dtype=np.float64)
+    out = {}
+    for _, key, multiplier in PERIODS:
+        out[f"{key}_rate"] = rates * multiplier
+        out[f"{key}_cost"] = SHIPMENT_VALUE * out[f"{key}_rate"] / 100
+    base = out["trump_cost"]
+    total = base
+    for _, key, share in DUTY_COMPONENTS[1:]:
+        out[key] = base * share
+        total = total + out[key]
+    out["total_duty_cost"] = total
+    return out
+
+
+def impact_response(row):
+    """The endpoint's {barChart, pieChart, summary} for one row of metrics."""
+    bar_chart = [
+        {
+            "period": period,
+            "tariffRate": float(row[f"{key}_rate"]),
+            "additionalCost": float(row[f"{key}_cost"]),
+        }
+        for period, key, _ in PERIODS
+    ]
+    components = {"baseTariff": float(row["trump_cost"])}
+    components.update(
+        (_camel(key), float(row[key])) for _, key, _ in DUTY_COMPONENTS[1:]
+    )
+    pie_chart = [
+        {"name": name, "value": value}
+        for (name, _, _), value in zip(DUTY_COMPONENTS, components.values())
+    ]
+    summary = dict(components, totalDutyCost=float(row["total_duty_cost"]))
+    return {"barChart": bar_chart, "pieChart": pie_chart, "summary": summary}
+
+
+EMPTY_RESPONSE = {"barChart": [], "pieChart": [], "summary": None}
+
+
+def _camel(key):
+    head, *rest = key.split("_")
+    return head + "".join(part.capitalize() for part in rest)
+
+
+def read_table(table=SOURCE_TABLE, backend=None):
+    """The ingested dataset (tariff_impact_analyser.py) as a frame."""
+    backend = backend or get_backend()
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM `{table}`")
+        columns = [d[0] for d in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+
+def combined_key(n, codes, radices):
+    """
+    One int64 key per row for a combination of dimensions: codes are the
+    rows' codes per dimension (all >= 0), radices the number of values of
+    each. The key is a mixed-radix number, compacted with np.unique
+    whenever the key space would outgrow the rows, so per-group
+    reductions can be bincounts over a small dense range instead of sorts.
+    Returns (key, size) with 0 <= key < size.
+    """
+    key = np.zeros(n, dtype=np.int64)
+    size = 1
+    for dim_codes, radix in zip(codes, radices):
+        if size * radix > max(4 * n, 1 << 16):
+            uniques, key = np.unique(key, return_inverse=True)
+            key, size = key.ravel(), len(uniques)
+        key = key * radix + dim_codes
+        size *= radix
+    return key, size
+
+
+def read_source(path):
+    """The tariff dataset (xlsx, csv or Parquet) with normalized column names."""
+    if path.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path)
+    elif is_parquet(path):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    df.columns = normalize_columns(df.columns)
+    return df
+
+
+class ImpactEngine:
+    def __init__(self, year, codes, categories, rate, source=None):
+        self.year = year  # np.int32, 0 where missing
+        self.codes = codes  # {filter: np.int32 category codes, -1 where missing}
+        self.categories = categories  # {filter: list of values}
+        self.rate = rate  # np.float64 duty rate, 0 where missing
+        self.source = source  # sha256 of the dataset the columns were built from
+        self._lookup = {name: {v: i for i, v in enumerate(values)} for name, values in categories.items()}
+
+    # ---------- build ----------
+    @classmethod
+    def from_frame(cls, df, source=None):
+        """Build from dataset rows with normalized column names."""
+        year = pd.to_numeric(df.get("Year", pd.Series(index=df.index, dtype=float)), errors="coerce")
+        codes, categories = {}, {}
+        for name in TEXT_FILTERS:
+            column = FILTERS[name]
+            if column in df.columns:
+                name_codes, uniques = pd.factorize(df[column])
+            else:
+                name_codes, uniques = np.full(len(df), -1), []
+            codes[name] = np.asarray(name_codes, dtype=np.int32)
+            # values compare as text, as the request sends them
+            categories[name] = [str(v) for v in uniques]
+        rate_column = next((c for c in RATE_COLUMNS if c in df.columns), None)
+        if rate_column is None:
+            logger.warning(f"No duty rate column ({', '.join(RATE_COLUMNS)}); rates are 0")
+            rate = np.zeros(len(df))
+        else:
+            rate = pd.to_numeric(df[rate_column], errors="coerce").fillna(0).to_numpy(np.float64)
+        return cls(
+            year.fillna(0).to_numpy(np.int32),
+            codes,
+            categories,
+            np.ascontiguousarray(rate),
+            source,
+        )
+
+    @classmethod
+    def from_file(cls, path=SOURCE):
+        return cls.from_frame(read_source(path), source=file_sha256(path))
+
+    @classmethod
+    def from_db(cls, table=SOURCE_TABLE, backend=None):
+        """Build from the ingested table (tariff_impact_analyser.py) instead of the workbook."""
+        return cls.from_frame(read_table(table, backend))
+
+    # ---------- persistence ----------
+    def save(self, path=IMPACT_COLUMNS_PATH):
+        arrays = {"year": self.year, "rate": self.rate}
+        for name in TEXT_FILTERS:
+            arrays[f"codes__{name}"] = self.codes[name]
+            arrays[f"categories__{name}"] = np.array(self.categories[name], dtype=str)
+        arrays["version"] = np.array(COLUMNS_VERSION)
+        arrays["source"] = np.array(self.source or "")
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp_path, path)
+        logger.info(f"Tariff columns saved to {path} ({len(self)} rows)")
+
+    @classmethod
+    def load(cls, path=IMPACT_COLUMNS_PATH):
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != COLUMNS_VERSION:
+                raise ValueError(f"{path}: columns version {int(z['version'])}, expected {COLUMNS_VERSION}")
+            return cls(
+                z["year"],
+                {name: z[f"codes__{name}"] for name in TEXT_FILTERS},
+                {name: z[f"categories__{name}"].tolist() for name in TEXT_FILTERS},
+                z["rate"],
+                str(z["source"]) or None,
+            )
+
+    @classmethod
+    def load_or_build(cls, source_path=SOURCE, path=IMPACT_COLUMNS_PATH):
+        """Load the cached columns, rebuilding them when the dataset has changed."""
+        source = file_sha256(source_path)
+        if os.path.exists(path):
+            try:
+                engine = cls.load(path)
+                if engine.source == source:
+                    return engine
+            except Exception as e:
+                logger.warning(f"Rebuilding tariff columns ({e})")
+        engine = cls.from_file(source_path)
+        engine.save(path)
+        return engine
+
+    # ---------- queries ----------
+    def __len__(self):
+        return len(self.rate)
+
+    def mask(self, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE, **filters):
+        """
+        Rows matching the filters (keyword arguments named as in FILTERS;
+        None, "" and 0 mean any) with a duty rate in [min_rate, max_rate].
+        """
+        unknown = set(filters) - set(FILTERS)
+        if unknown:
+            raise TypeError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        mask = self.rate >= float(min_rate)
+        mask &= self.rate <= float(max_rate)
+        if filters.get("year"):
+            mask &= self.year == int(filters["year"])
+        for name in TEXT_FILTERS:
+            value = filters.get(name)
+            if not value:
+                continue
+            code = self._lookup[name].get(str(value))
+            if code is None:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.codes[name] == code
+        return mask
+
+    def count(self, **filters):
+        return int(np.count_nonzero(self.mask(**filters)))
+
+    def impact(self, currency=None, date=None, rates=None, **filters):
+        """
+        The endpoint's response for a filter combination (see mask), with
+        amounts converted to currency when given: at date, else mid-year of
+        the matched row's year, using rates (fx.RateTable, loaded from the
+        rates file by default).
+        """
+        mask = self.mask(**filters)
+        first = int(mask.argmax())
+        if not mask[first]:
+            return dict(EMPTY_RESPONSE)
+        metrics = impact_metrics(self.rate[first : first + 1])
+        if currency:
+            rates = rates or RateTable.load_or_build()
+            if date is None and self.year[first]:
+                date = mid_year(self.year[first])[0]
+            factor = float(rates.convert(1.0, "USD", currency, date))
+            for key in MONEY_METRICS:
+                metrics[key] = metrics[key] * factor
+        return impact_response({key: values[0] for key, values in metrics.items()})
+
+    # ---------- precomputed answers ----------
+    def _dimension(self, name):
+        """(codes, values) of a filter dimension; code -1 where missing."""
+        if name != "year":
+            return self.codes[name].astype(np.int64), self.categories[name]
+        values, codes = np.unique(self.year, return_inverse=True)
+        codes = codes.astype(np.int64).ravel()
+        codes[self.year == 0] = -1
+        return codes, values.tolist()
+
+    def precompute(self, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE):
+        """
+        Answers for every combination of filter values present in the data
+        (each dimension set or "any") with rates in [min_rate, max_rate]:
+        one row per combination with the key columns, matched row count,
+        the first match's duty rate and its metrics, and min/avg/max rate.
+        Dimensions the dataset does not have are always "any".
+        """
+        started = time.perf_counter()
+        in_range = (self.rate >= min_rate) & (self.rate <= max_rate)
+        dims = {name: self._dimension(name) for name in FILTERS}
+        present = [name for name, (codes, _) in dims.items() if (codes >= 0).any()]
+
+        frames = []
+        for k in range(len(present) + 1):
+            for subset in combinations(present, k):
+                keep = in_range.copy()
+                for name in subset:
+                    keep &= dims[name][0] >= 0
+                rows = np.flatnonzero(keep)
+                if len(rows):
+                    frames.append(self._group(rows, subset, dims))
+        results = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=[name for name, _ in RESULT_SCHEMA]
+        )
+        for key, values in impact_metrics(results["duty_rate"].to_numpy(np.float64)).items():
+            if key != "base_tariff":
+                results[key] = values
+        logger.info(
+            f"Precomputed {len(results)} impact answers from {len(self)} rows "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return results[[name for name, _ in RESULT_SCHEMA]]
+
+    def _group(self, rows, subset, dims):
+        key, size = combined_key(
+            len(rows), [dims[name][0][rows] for name in subset], [len(dims[name][1]) for name in subset]
+        )
+        counts = np.bincount(key, minlength=size)
+        groups = np.flatnonzero(counts)
+        counts = counts[groups]
+        rates = self.rate[rows]
+        # rows are ascending, so the smallest position is the first match
+        first = np.full(size, len(rows))
+        np.minimum.at(first, key, np.arange(len(rows)))
+        low = np.full(size, np.inf)
+        np.minimum.at(low, key, rates)
+        high = np.full(size, -np.inf)
+        np.maximum.at(high, key, rates)
+        sums = np.bincount(key, weights=rates, minlength=size)
+        first = rows[first[groups]]
+
+        out = {}
+        for name in FILTERS:
+            if name in subset:
+                codes, values = dims[name]
+                out[name] = np.asarray(values, dtype=object)[codes[first]]
+            else:
+                out[name] = 0 if name == "year" else ""
+        out["matched"] = counts
+        out["duty_rate"] = self.rate[first]
+        out["min_rate"] = low[groups]
+        out["avg_rate"] = sums[groups] / counts
+        out["max_rate"] = high[groups]
+        return pd.DataFrame(out)
+
+
+def write_results(results, table=RESULTS_TABLE, backend=None, batch_size=5000):
+    """Replace table with the precomputed answers (built as <table>_new, swapped in)."""
+    backend = backend or get_backend()
+    new_table = f"{table}_new"
+    with backend.connection() as conn:
+        try:
+            backend.drop_table(conn, new_table)
+            backend.create_table(
+                conn, new_table, RESULT_SCHEMA,
+                primary_key=[name for name, _ in KEY_SCHEMA], if_not_exists=False,
+            )
+            try:
+                backend.bulk_load(conn, new_table, results)
+            except backend.Error as e:
+                logger.warning(f"Bulk load unavailable ({e}); using executemany.")
+                conn.rollback()
+                backend.insert_many(conn, new_table, list(results.columns), row_tuples(results), batch_size)
+                conn.commit()
+            backend.swap_tables(conn, {table: new_table})
+        except Exception:
+            conn.rollback()
+            backend.drop_table(conn, new_table)
+            raise
+    logger.info(f"{table}: {len(results)} precomputed answers")
+
+
+def write_results_file(results, path):
+    """Precomputed answers as Parquet or CSV (by extension)."""
+    tmp_path = path + ".part"
+    if is_parquet(path):
+        results.to_parquet(tmp_path, index=False, compression="zstd")
+    else:
+        results.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    logger.info(f"Precomputed answers written to {path}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Precompute or query tariff impact answers.")
+    ap.add_argument("--source", default=SOURCE, help="tariff dataset (xlsx, csv or Parquet)")
+    ap.add_argument("--from-db", action="store_true", help=f"read the dataset from {SOURCE_TABLE}")
+    ap.add_argument("--columns", default=IMPACT_COLUMNS_PATH, help="typed column cache")
+    ap.add_argument("--rebuild", action="store_true", help="rebuild the column cache")
+    ap.add_argument("--out", help="also write the answers to a Parquet or CSV file")
+    ap.add_argument("--skip-db", action="store_true", help=f"do not replace {RESULTS_TABLE}")
+    ap.add_argument("--query", action="store_true", help="print the answer for the filters below")
+    for name in FILTERS:
+        ap.add_argument("--" + name.replace("_", "-"), type=int if name == "year" else str)
+    ap.add_argument("--min-rate", type=float, default=DEFAULT_MIN_RATE, help="--query only")
+    ap.add_argument("--max-rate", type=float, default=DEFAULT_MAX_RATE, help="--query only")
+    ap.add_argument("--currency", help="--query only: convert amounts to this ISO currency (fx.py)")
+    args = ap.parse_args(argv)
+
+    if args.from_db:
+        engine = ImpactEngine.from_db()
+    elif args.rebuild:
+        engine = ImpactEngine.from_file(args.source)
+        engine.save(args.columns)
+    else:
+        engine = ImpactEngine.load_or_build(args.source, args.columns)
+
+    if args.query:
+        filters = {name: getattr(args, name) for name in FILTERS}
+        print(json.dumps(engine.impact(
+            min_rate=args.min_rate, max_rate=args.max_rate, currency=args.currency, **filters
+        ), indent=2))
+    else:
+        # the API only looks up the default rate range
+        results = engine.precompute()
+        if args.out:
+            write_results_file(results, args.out)
+        if not args.skip_db:
+            write_results(results)
+
+
+if __name__ == "__main__":
+    main()
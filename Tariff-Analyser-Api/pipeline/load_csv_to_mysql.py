@@ -1,118 +1,124 @@
 import os
-import math
+import argparse
+import numpy as np
 import pandas as pd
-import mysql.connector
-
-DB_CONFIG = dict(
-    host="localhost",
-    user="root",
-    password="102006",
-    database="trump_tariff_db",
-)
-
-BASE_DIR = os.path.dirname(__file__)
-HTS_CSV = os.path.join(BASE_DIR, "parsed", "hts_2022_2025_duties_with_categories.csv")
-COUNTRY_CSV = os.path.join(BASE_DIR, "parsed", "iban_country_currency.csv")
 
+from logger import logger
+from config import PARSED_DIR
+from db import get_backend, row_tuples
+
+HTS_CSV = os.path.join(PARSED_DIR, "hts_2022_2025_duties_with_categories.csv")
+COUNTRY_CSV = os.path.join(PARSED_DIR, "iban_country_currency.csv")
+
+BATCH_SIZE = 1000
+
+# table -> columns after the auto-increment id (duty columns as VARCHAR/TEXT)
+TABLES = {
+    "hts_full": [
+        ("hts_code", "VARCHAR(32)"),
+        ("industry", "TEXT"),
+        ("sub_industry", "TEXT"),
+        ("general_duty", "TEXT"),
+        ("special_duty", "TEXT"),
+        ("column2_duty", "TEXT"),
+        ("year", "INT"),
+    ],
+    "country_currency": [
+        ("country", "VARCHAR(128)"),
+        ("currency", "VARCHAR(128)"),
+        ("code", "VARCHAR(8)"),
+    ],
+}
+
+
+def to_int_or_none(col):
+    """Column-wise int(v) with None for missing or unconvertible values."""
+    if pd.api.types.is_bool_dtype(col):
+        return col.astype("Int64")
+    if pd.api.types.is_numeric_dtype(col):
+        values = col.astype(float)
+        return pd.Series(np.trunc(values), index=col.index).where(np.isfinite(values)).astype("Int64")
+    text = col.astype(str).str.strip()
+    return pd.to_numeric(text.where(text.str.fullmatch(r"[+-]?\d+")), errors="coerce").astype("Int64")
+
+
+def clean_str(col):
+    # keep original text (including ¢/kg etc.), just strip whitespace
+    return col.astype(str).str.strip().where(col.notna(), None)
 
-def to_int_or_none(v):
-    if v is None or (isinstance(v, float) and math.isnan(v)):
-        return None
-    try:
-        return int(v)
-    except Exception:
-        return None
 
+def _column(df, name):
+    return df[name] if name in df.columns else pd.Series(None, index=df.index, dtype=object)
 
-def clean_str(v):
-    if pd.isna(v):
-        return None
-    # keep original text (including ¢/kg etc.), just strip whitespace
-    return str(v).strip()
-
-
-def main():
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-
-    # create tables if they do not exist (duty columns as VARCHAR/TEXT)
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS hts_full (
-          id INT AUTO_INCREMENT PRIMARY KEY,
-          hts_code VARCHAR(32),
-          industry TEXT,
-          sub_industry TEXT,
-          general_duty TEXT,
-          special_duty TEXT,
-          column2_duty TEXT,
-          year INT
-        )
-        """
-    )
 
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS country_currency (
-          id INT AUTO_INCREMENT PRIMARY KEY,
-          country VARCHAR(128),
-          currency VARCHAR(128),
-          code VARCHAR(8)
-        )
-        """
-    )
+def insert_batches(conn, table, columns, frame, batch_size=BATCH_SIZE):
+    """
+    Insert frame in chunks of batch_size rows. For INSERT ... VALUES the
+    MySQL connector folds each executemany() chunk into one multi-row
+    statement.
+    """
+    return conn.backend.insert_many(conn, table, columns, row_tuples(frame), batch_size)
 
-    # clear existing data
-    cursor.execute("TRUNCATE TABLE hts_full")
-    cursor.execute("TRUNCATE TABLE country_currency")
 
+def main(hts_csv=HTS_CSV, country_csv=COUNTRY_CSV, batch_size=BATCH_SIZE):
+    """
+    Reload hts_full and country_currency. Rows go into *_new copies of the
+    tables, which then replace the live ones in one atomic swap (a single
+    RENAME TABLE on MySQL), so readers never see an empty or half-filled
+    table.
+    """
     # ---------- HTS CSV ----------
-    hts_df = pd.read_csv(HTS_CSV)
-
-    for _, row in hts_df.iterrows():
-        cursor.execute(
-            """
-            INSERT INTO hts_full
-            (hts_code, industry, sub_industry,
-             general_duty, special_duty, column2_duty, year)
-            VALUES (%s,%s,%s,%s,%s,%s,%s)
-            """,
-            (
-                clean_str(row.get("HTS_Code")),
-                clean_str(row.get("industry")),
-                clean_str(row.get("sub-industry")),
-                clean_str(row.get("General_Duty")),
-                clean_str(row.get("Special_Duty")),
-                clean_str(row.get("Column2_Duty")),
-                to_int_or_none(row.get("Year")),
-            ),
-        )
-
-    print("Inserted HTS rows:", len(hts_df))
+    hts_df = pd.read_csv(hts_csv)
+    hts = pd.DataFrame(
+        {
+            "hts_code": clean_str(_column(hts_df, "HTS_Code")),
+            "industry": clean_str(_column(hts_df, "industry")),
+            "sub_industry": clean_str(_column(hts_df, "sub-industry")),
+            "general_duty": clean_str(_column(hts_df, "General_Duty")),
+            "special_duty": clean_str(_column(hts_df, "Special_Duty")),
+            "column2_duty": clean_str(_column(hts_df, "Column2_Duty")),
+            "year": to_int_or_none(_column(hts_df, "Year")),
+        }
+    )
 
     # ---------- COUNTRY / CURRENCY CSV ----------
-    country_df = pd.read_csv(COUNTRY_CSV)
-
-    for _, row in country_df.iterrows():
-        cursor.execute(
-            """
-            INSERT INTO country_currency (country, currency, code)
-            VALUES (%s,%s,%s)
-            """,
-            (
-                clean_str(row.get("country")),
-                clean_str(row.get("currency")),
-                clean_str(row.get("code")),
-            ),
-        )
-
-    print("Inserted country rows:", len(country_df))
+    country_df = pd.read_csv(country_csv)
+    country = pd.DataFrame(
+        {
+            "country": clean_str(_column(country_df, "country")),
+            "currency": clean_str(_column(country_df, "currency")),
+            "code": clean_str(_column(country_df, "code")),
+        }
+    )
 
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print("DONE")
+    backend = get_backend()
+    with backend.connection() as conn:
+        try:
+            for table, columns in TABLES.items():
+                backend.create_table(conn, table, columns, auto_id=True)
+                backend.drop_table(conn, f"{table}_new")
+                backend.create_table_like(conn, f"{table}_new", table)
+
+            n = insert_batches(conn, "hts_full_new", list(hts.columns), hts, batch_size)
+            logger.info(f"Inserted HTS rows: {n}")
+            n = insert_batches(conn, "country_currency_new", list(country.columns), country, batch_size)
+            logger.info(f"Inserted country rows: {n}")
+            conn.commit()
+
+            # swap both tables in one atomic step
+            backend.swap_tables(conn, {t: f"{t}_new" for t in TABLES})
+        except Exception:
+            conn.rollback()
+            for table in TABLES:
+                backend.drop_table(conn, f"{table}_new")
+            raise
+    logger.info("DONE")
 
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description="Reload hts_full and country_currency from CSV.")
+    ap.add_argument("--hts-csv", default=HTS_CSV)
+    ap.add_argument("--country-csv", default=COUNTRY_CSV)
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per multi-row INSERT")
+    args = ap.parse_args()
+    main(args.hts_csv, args.country_csv, args.batch_size)
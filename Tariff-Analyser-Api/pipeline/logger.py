@@ -1,17 +1,29 @@
 # logger.py
+"""
+The pipeline's logger, writing to the console and logs/automation.log.
+
+Importing it has no side effects: only the hts_automation logger is
+configured (not the root logger), and logs/ and the log file are created
+when the first record is written.
+"""
 import logging
 import os
 from config import LOG_DIR
 
-os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "automation.log")
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+class _LogFileHandler(logging.FileHandler):
+    """FileHandler that creates the log directory when it opens the file."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger("hts_automation")
\ No newline at end of file
+logger = logging.getLogger("hts_automation")
+logger.setLevel(logging.INFO)
+for _handler in (_LogFileHandler(LOG_FILE, delay=True), logging.StreamHandler()):
+    _handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(_handler)
@@ -0,0 +1,254 @@
+# metrics.py
+"""
+In-process metrics for the pipeline, next to the free-text log.
+
+    from metrics import metrics
+    metrics.inc("hts_download_bytes_total", size, chapter=ch)
+    metrics.set("hts_run_rows_per_second", rate)
+    with metrics.timer("hts_stage_seconds", stage="parse"):
+        ...
+
+Counters, gauges and histograms are kept per label set in one
+thread-safe registry per process. Worker processes (parse pool) do not
+report into it; their callers record what comes back. At the end of a
+run write_run_report() saves the snapshot as JSON (logs/run_report.json)
+and, when config.PROMETHEUS_TEXTFILE is set, in the Prometheus text
+format for node_exporter's textfile collector.
+"""
+import os
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from logger import logger
+from config import PROMETHEUS_TEXTFILE, RUN_REPORT_PATH
+
+# latency buckets (seconds) for every histogram unless given otherwise
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# row-count buckets for batch sizes
+ROW_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000)
+
+# HELP text of the metrics the pipeline reports
+METRIC_HELP = {
+    "hts_download_bytes_total": "Bytes of chapter exports downloaded.",
+    "hts_download_seconds": "Time to fetch one chapter (range + export).",
+    "hts_downloads_total": "Chapter downloads by result (changed, unchanged, failed).",
+    "hts_retries_total": "Attempts that failed and were retried by utils.retry.",
+    "hts_retry_exhausted_total": "Operations that failed on every retry attempt.",
+    "hts_circuit_opened_total": "Times a circuit breaker opened after consecutive failures.",
+    "hts_parsed_rows_total": "Rows parsed per chapter.",
+    "hts_parse_chapter_seconds": "Time to parse one chapter workbook.",
+    "hts_parse_cache_hits_total": "Chapters read from the parse cache instead of parsed.",
+    "hts_db_rows_written_total": "Rows written to the database per table.",
+    "hts_db_batch_rows": "Rows per executemany batch.",
+    "hts_db_batch_seconds": "Time per executemany batch or bulk load.",
+    "hts_db_load_seconds": "Time to load one parsed frame (all rows and special programs).",
+    "hts_search_chapters_total": "Chapters by search index update result (added, updated, unchanged, removed).",
+    "hts_search_query_seconds": "Time to answer one full-text search query.",
+    "hts_stage_seconds": "Wall time of a whole pipeline stage.",
+    "hts_chapter_stage_seconds": "Time spent on one chapter in a streaming pipeline stage.",
+    "hts_chapters_total": "Chapters by final status in a pipeline run.",
+    "hts_run_rows_per_second": "Rows loaded per second of pipeline wall time.",
+    "hts_run_duration_seconds": "Wall time of the last pipeline run.",
+    "hts_run_success": "1 if the last pipeline run succeeded, 0 otherwise.",
+    "hts_run_last_timestamp_seconds": "Unix time the last pipeline run finished.",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        total, out = 0, []
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "buckets": {str(bound): n for bound, n in self.cumulative()},
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe store of counters, gauges and histograms keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _series(self, kind, name, labels):
+        metric = self._metrics.setdefault(name, {"type": kind, "series": {}})
+        if metric["type"] != kind:
+            raise ValueError(f"Metric {name} is a {metric['type']}, not a {kind}")
+        return metric["series"], _label_key(labels)
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        with self._lock:
+            series, key = self._series("counter", name, labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        with self._lock:
+            series, key = self._series("gauge", name, labels)
+            series[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """Record one value in a histogram."""
+        with self._lock:
+            series, key = self._series("histogram", name, labels)
+            if key not in series:
+                series[key] = _Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, buckets=DEFAULT_BUCKETS, **labels):
+        """Observe the seconds spent in the block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, buckets, **labels)
+
+    def total(self, name):
+        """Sum of a counter over all its label sets (0 if never incremented)."""
+        with self._lock:
+            metric = self._metrics.get(name)
+            return sum(metric["series"].values()) if metric and metric["type"] == "counter" else 0
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def snapshot(self):
+        """All metrics as {name: {"type", "help", "series": [{"labels", "value"}]}}."""
+        with self._lock:
+            out = {}
+            for name, metric in sorted(self._metrics.items()):
+                series = []
+                for key, value in sorted(metric["series"].items()):
+                    if isinstance(value, _Histogram):
+                        value = value.to_dict()
+                    series.append({"labels": dict(key), "value": value})
+                out[name] = {
+                    "type": metric["type"],
+                    "help": METRIC_HELP.get(name, ""),
+                    "series": series,
+                }
+            return out
+
+    def to_prometheus(self):
+        """The snapshot in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in self.snapshot().items():
+            if metric["help"]:
+                lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for s in metric["series"]:
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_prom_labels(s['labels'])} {_prom_value(s['value'])}")
+                    continue
+                h = s["value"]
+                for bound, n in h["buckets"].items():
+                    labels = _prom_labels(dict(s["labels"], le=_prom_value(float(bound))))
+                    lines.append(f"{name}_bucket{labels} {n}")
+                labels = _prom_labels(dict(s["labels"], le="+Inf"))
+                lines.append(f"{name}_bucket{labels} {h['count']}")
+                lines.append(f"{name}_sum{_prom_labels(s['labels'])} {_prom_value(h['sum'])}")
+                lines.append(f"{name}_count{_prom_labels(s['labels'])} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _prom_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+# the registry every module reports into
+metrics = MetricsRegistry()
+
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp_path, path)
+
+
+def _utc(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def write_run_report(run, started_at, rows=None, path=RUN_REPORT_PATH,
+                     prometheus_path=PROMETHEUS_TEXTFILE):
+    """
+    Finish a run: set the hts_run_* gauges and write the JSON report
+    (run details, timings and the metrics snapshot) and, if
+    prometheus_path is set, the textfile export. run is a dict with at
+    least "status" ("ok", "partial" or "failed"); started_at is time.time()
+    at the start. Errors are logged, never raised. Returns the report.
+    """
+    finished_at = time.time()
+    seconds = finished_at - started_at
+    metrics.set("hts_run_duration_seconds", round(seconds, 3))
+    metrics.set("hts_run_success", int(run.get("status") == "ok"))
+    metrics.set("hts_run_last_timestamp_seconds", int(finished_at))
+    if rows is not None:
+        metrics.set("hts_run_rows_per_second", round(rows / seconds, 1) if seconds else 0)
+
+    report = dict(run)
+    report.update({
+        "started_at": _utc(started_at),
+        "finished_at": _utc(finished_at),
+        "seconds": round(seconds, 3),
+        "metrics": metrics.snapshot(),
+    })
+    try:
+        _write_atomic(path, json.dumps(report, indent=2, default=str))
+        logger.info(f"Run report written to {path}")
+        if prometheus_path:
+            _write_atomic(prometheus_path, metrics.to_prometheus())
+            logger.info(f"Prometheus metrics written to {prometheus_path}")
+    except OSError as e:
+        logger.warning(f"Could not write run report: {e}")
+    return report
@@ -0,0 +1,103 @@
+# parse_cache.py
+"""
+Per-chapter cache of parsed rows.
+
+Entries are keyed by the SHA-256 of the source workbook plus the parser
+version and live in parsed/cache/ as <Chapter_NN>.<sha256>.v<version>.pkl.
+Each entry is a sequence of pickled row batches, so the streaming parser
+can write and replay it batch by batch.
+"""
+import os
+import glob
+import pickle
+
+from logger import logger
+from config import PARSE_CACHE_DIR
+from utils import ensure_dirs, file_sha256
+
+
+def entry_path(xlsx_path, version, cache_dir=PARSE_CACHE_DIR):
+    """Cache entry for the current content of xlsx_path."""
+    stem = os.path.splitext(os.path.basename(xlsx_path))[0]
+    return os.path.join(cache_dir, f"{stem}.{file_sha256(xlsx_path)}.v{version}.pkl")
+
+
+def iter_batches(path):
+    """Yield the row batches stored in a cache entry."""
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                yield pickle.load(fh)
+            except EOFError:
+                return
+
+
+def load_rows(path):
+    """All rows of a cache entry, or None if it cannot be read."""
+    try:
+        rows = []
+        for batch in iter_batches(path):
+            rows.extend(batch)
+        return rows
+    except Exception as e:
+        logger.warning("Ignoring unreadable cache entry %s: %s", path, e)
+        return None
+
+
+class EntryWriter:
+    """
+    Write row batches to a cache entry. The entry only appears under its
+    final name when the block exits cleanly and at least one row was added.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".part"
+        self.rows = 0
+        self._fh = None
+
+    def __enter__(self):
+        ensure_dirs(os.path.dirname(self.path))
+        self._fh = open(self.tmp_path, "wb")
+        return self
+
+    def add(self, rows):
+        pickle.dump(rows, self._fh, protocol=pickle.HIGHEST_PROTOCOL)
+        self.rows += len(rows)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._fh.close()
+        if exc_type is None and self.rows:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
+
+
+def store_rows(path, rows):
+    with EntryWriter(path) as writer:
+        writer.add(rows)
+
+
+def evict_stale(keep, cache_dir=PARSE_CACHE_DIR, stems=None):
+    """
+    Remove every cache entry not in keep: older content hashes of a chapter,
+    entries from other parser versions and chapters that no longer exist.
+    When stems is given (a partial run), only entries of those chapters are
+    considered.
+    """
+    keep = {os.path.abspath(p) for p in keep}
+    removed = 0
+    for path in glob.glob(os.path.join(cache_dir, "*.pkl*")):
+        if os.path.abspath(path) in keep:
+            continue
+        if stems is not None and os.path.basename(path).split(".")[0] not in stems:
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning("Could not evict cache entry %s: %s", path, e)
+    if removed:
+        logger.info(f"Evicted {removed} stale parse cache entries")
+    return removed
@@ -0,0 +1,227 @@
+# parsed_io.py
+"""
+Reading and writing the parsed HTS rows (the parser -> loader handoff).
+
+Two formats, picked by file extension:
+
+    .parquet  Arrow/Parquet: repeated text columns (categories, units,
+              rates, section) dictionary-encoded, chapter stored as a
+              nullable int16. Read back memory-mapped or in record
+              batches, without re-parsing any value.
+    .csv      UTF-8-BOM CSV, the original format; kept for humans and
+              spreadsheet tools.
+
+config.PARSED_FORMAT chooses the default for new files. pyarrow is only
+imported when a Parquet file is read or written.
+
+    python parsed_io.py parsed/hts_all_chapters.parquet --to-csv out.csv
+"""
+import os
+import argparse
+
+import pandas as pd
+
+from config import PARSED_DIR, PARSED_FORMAT
+
+# column order of the parsed output
+PARSED_COLUMNS = [
+    "hts_code",
+    "main_category",
+    "subcategory",
+    "group",
+    "product",
+    "unit_of_quantity",
+    "general_rate_of_duty",
+    "special_rate_of_duty",
+    "column2_rate_of_duty",
+    "chapter",
+    "section",
+]
+
+# text columns with few distinct values, stored dictionary-encoded
+DICTIONARY_COLUMNS = [
+    "main_category",
+    "subcategory",
+    "group",
+    "unit_of_quantity",
+    "general_rate_of_duty",
+    "special_rate_of_duty",
+    "column2_rate_of_duty",
+    "section",
+]
+
+FORMATS = {"parquet": ".parquet", "csv": ".csv"}
+
+
+def parsed_path(name="hts_all_chapters", fmt=PARSED_FORMAT):
+    """Default location of a parsed file in parsed/ for the given format."""
+    return os.path.join(PARSED_DIR, name + FORMATS[fmt])
+
+
+def is_parquet(path):
+    return path.lower().endswith(FORMATS["parquet"])
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet output needs pyarrow (pip install pyarrow), "
+            "or set HTS_PARSED_FORMAT=csv"
+        ) from e
+    return pa, pq
+
+
+def arrow_schema():
+    pa, _ = _pyarrow()
+    fields = []
+    for col in PARSED_COLUMNS:
+        if col == "chapter":
+            fields.append(pa.field(col, pa.int16()))
+        elif col in DICTIONARY_COLUMNS:
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+def _to_arrow(df):
+    pa, _ = _pyarrow()
+    df = df.reindex(columns=PARSED_COLUMNS)
+    arrays = []
+    for field in arrow_schema():
+        values = df[field.name]
+        if field.name == "chapter":
+            chapter = pd.to_numeric(values, errors="coerce").astype("Int16")
+            arrays.append(pa.array(chapter, type=pa.int16(), from_pandas=True))
+        else:
+            text = values.astype(object).where(values.notna(), None)
+            array = pa.array(text.map(lambda v: v if v is None else str(v)), type=pa.string())
+            arrays.append(array.dictionary_encode() if field.name in DICTIONARY_COLUMNS else array)
+    return pa.Table.from_arrays(arrays, schema=arrow_schema())
+
+
+class ParsedWriter:
+    """
+    Append row batches (lists of row dicts or frames) to a parsed file. The
+    file appears under its final name only when the block exits cleanly
+    and at least one row was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".part"
+        self.rows = 0
+        self._fh = None
+        self._writer = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if is_parquet(self.path):
+            _, pq = _pyarrow()
+            self._writer = pq.ParquetWriter(self.tmp_path, arrow_schema(), compression="zstd")
+        else:
+            self._fh = open(self.tmp_path, "w", encoding="utf-8-sig", newline="")
+        return self
+
+    def write(self, rows):
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=PARSED_COLUMNS)
+        if df.empty:
+            return
+        if self._writer is not None:
+            self._writer.write_table(_to_arrow(df))
+        else:
+            df.to_csv(self._fh, header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self._fh.close()
+        if exc_type is None and self.rows:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
+
+
+def write_parsed(df, path):
+    """Write all parsed rows to path (format from the extension)."""
+    with ParsedWriter(path) as writer:
+        writer.write(df)
+    return path
+
+
+def _from_arrow(table):
+    df = table.to_pandas()
+    for col in df.columns:
+        if col == "chapter":
+            df[col] = df[col].astype("Int64")
+        else:
+            df[col] = df[col].astype(object).where(df[col].notna(), "")
+    return df
+
+
+def _chapter_column(values):
+    # anything int() rejects (blank, "3a") becomes NULL
+    text = values.str.strip()
+    return pd.to_numeric(text.where(text.str.fullmatch(r"[+-]?\d+")), errors="coerce").astype("Int64")
+
+
+def read_parsed(path, columns=None, memory_map=True):
+    """
+    All parsed rows as a frame: text columns as str ("" for missing),
+    chapter as nullable Int64. Parquet files are memory-mapped.
+    """
+    if is_parquet(path):
+        _, pq = _pyarrow()
+        return _from_arrow(pq.read_table(path, columns=columns, memory_map=memory_map))
+    df = pd.read_csv(path, dtype=str, keep_default_na=False, usecols=columns)
+    if "chapter" in df.columns:
+        df["chapter"] = _chapter_column(df["chapter"])
+    return df
+
+
+def iter_parsed_batches(path, batch_size=50_000, columns=None):
+    """Parsed rows as frames of up to batch_size rows (record batches for Parquet)."""
+    if is_parquet(path):
+        pa, pq = _pyarrow()
+        parquet = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+            yield _from_arrow(pa.Table.from_batches([batch]))
+        return
+    for chunk in pd.read_csv(
+        path, dtype=str, keep_default_na=False, usecols=columns, chunksize=batch_size
+    ):
+        if "chapter" in chunk.columns:
+            chunk["chapter"] = _chapter_column(chunk["chapter"])
+        yield chunk
+
+
+def export_csv(path, csv_path=None):
+    """Human-readable CSV copy of a parsed file."""
+    csv_path = csv_path or os.path.splitext(path)[0] + ".csv"
+    with ParsedWriter(csv_path) as writer:
+        for batch in iter_parsed_batches(path):
+            writer.write(batch)
+    return csv_path
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Inspect or convert a parsed HTS file.")
+    ap.add_argument("path", nargs="?", default=parsed_path())
+    ap.add_argument("--to-csv", nargs="?", const="", metavar="CSV", help="export a CSV copy")
+    args = ap.parse_args(argv)
+    if args.to_csv is not None:
+        print(export_csv(args.path, args.to_csv or None))
+    else:
+        df = read_parsed(args.path)
+        print(f"{args.path}: {len(df)} rows")
+        print(df.dtypes.to_string())
+
+
+if __name__ == "__main__":
+    main()
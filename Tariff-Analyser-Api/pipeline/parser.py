@@ -1,13 +1,27 @@
 # parser.py
 import os
 import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import pandas as pd
+from openpyxl import load_workbook
 
 from logger import logger
-from config import CHAPTERS_DIR, PARSED_DIR
-from utils import ensure_dirs
-
-ensure_dirs(PARSED_DIR)
+from metrics import metrics
+from config import (
+    CHAPTERS_DIR,
+    PARSE_WORKERS,
+    PARSE_ENGINE,
+    PARSE_BATCH_SIZE,
+    PARSE_CACHE,
+    PARSED_FORMAT,
+)
+from parsed_io import FORMATS, PARSED_COLUMNS, ParsedWriter, parsed_path, write_parsed
+import parse_cache
+
+# bump whenever a change alters parsed rows; invalidates the parse cache
+PARSER_VERSION = "1"
 
 SECTION_RANGES = {
     "I": range(1, 6),
@@ -34,6 +48,16 @@ SECTION_RANGES = {
     "XXII": range(98, 100),
 }
 
+# column order of the parsed output (hts_all_chapters.parquet / .csv)
+OUTPUT_COLUMNS = PARSED_COLUMNS
+
+# strings pd.read_excel treats as missing by default
+NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+}
+
 
 def get_section_for_chapter(chapter_num: int):
     for section, rng in SECTION_RANGES.items():
@@ -81,82 +105,119 @@ def clean_duty(d):
     return s
 
 
-def forward_fill_duties(df, gen_duty_col, spec_duty_col, col2_duty_col):
+def forward_fill_duties(df, gen_duty_col, spec_duty_col, col2_duty_col, carry=None):
     """
     Carry last non-empty duty values downwards so child HTS lines
     inherit the correct General/Special/Column 2 rates.
+    When a carry dict is given, values are also carried in from (and out to)
+    the previous batch of the same chapter.
     """
     for col in [gen_duty_col, spec_duty_col, col2_duty_col]:
         if not col:
             continue
-        df[col] = (
-            df[col]
-            .astype(str)
-            .replace(["nan", "NaN"], "")
-            .replace("", pd.NA)
-            .ffill()
-            .fillna("")
-        )
+        s = df[col].astype(str).replace(["nan", "NaN"], "").replace("", pd.NA)
+        if carry is not None:
+            if len(s) and pd.isna(s.iloc[0]) and col in carry:
+                s.iloc[0] = carry[col]
+            s = s.ffill()
+            if len(s) and not pd.isna(s.iloc[-1]):
+                carry[col] = s.iloc[-1]
+        df[col] = s.ffill().fillna("")
     return df
 
 
-def parse_single_chapter(xlsx_path):
-    logger.info(f"Parsing {xlsx_path}")
+def parse_indent(indent_raw):
+    """Indent level of a row; blank or unparseable values count as product rows (3)."""
+    try:
+        return int(float(indent_raw)) if str(indent_raw).strip() != "" else 3
+    except Exception:
+        return 3
+
+
+def detect_chapter_columns(df):
+    """Map the logical chapter fields to the workbook's column names (None if absent)."""
+    # detection with expanded options
+    return {
+        "hts": detect_column(
+            df,
+            ["HTS Number", "HTS", "HTSNumber", "Heading/Subheading", "Article number"],
+        ),
+        "indent": detect_column(
+            df,
+            ["Indent", "Indentation", "Level", "Indent Level", "Hierarchy", "Hierarchy Level"],
+        ),
+        "desc": detect_column(
+            df,
+            [
+                "Description",
+                "Desc",
+                "Product Description",
+                "Description 1",
+                "Description 2",
+                "Article Description",
+            ],
+        ),
+        "unit": detect_column(df, ["Unit of Quantity", "Unit", "Unit of Qty"]),
+        "gen_duty": detect_column(
+            df, ["General", "General Rate of Duty", "General Duty", "General Rate"]
+        ),
+        "spec_duty": detect_column(
+            df, ["Special", "Special Rate", "Special Rate of Duty", "Special Duty"]
+        ),
+        "col2_duty": detect_column(
+            df, ["Column 2", "Column 2 Rate", "Column2 Rate", "Column 2 Rate of Duty"]
+        ),
+    }
+
+
+def prepare_chapter_frame(df, cols, duty_carry=None):
+    """Add fallback indent/hts columns and forward-fill duties; returns (df, cols)."""
+    cols = dict(cols)
+    if not cols["indent"]:
+        df["_indent"] = df.index.map(lambda i: 3)  # assume product rows if no indent
+        cols["indent"] = "_indent"
+
+    if not cols["hts"]:
+        df["_hts"] = ""
+        cols["hts"] = "_hts"
+
+    # forward-fill duty columns so child rows inherit parent duty values
+    df = forward_fill_duties(
+        df, cols["gen_duty"], cols["spec_duty"], cols["col2_duty"], carry=duty_carry
+    )
+    return df, cols
+
+
+def read_chapter_frame(xlsx_path):
+    """
+    Read a chapter workbook and detect its columns.
+    Returns (df, cols) or (None, None) when the chapter cannot be parsed.
+    """
     try:
         df = pd.read_excel(xlsx_path, engine="openpyxl", dtype=str)
     except Exception as e:
         logger.exception("Failed to read %s: %s", xlsx_path, e)
-        return []
+        return None, None
 
     df.columns = [str(c).strip() for c in df.columns]
+    cols = detect_chapter_columns(df)
 
-    # detection with expanded options
-    hts_col = detect_column(
-        df,
-        ["HTS Number", "HTS", "HTSNumber", "Heading/Subheading", "Article number"],
-    )
-    indent_col = detect_column(
-        df,
-        ["Indent", "Indentation", "Level", "Indent Level", "Hierarchy", "Hierarchy Level"],
-    )
-    desc_col = detect_column(
-        df,
-        [
-            "Description",
-            "Desc",
-            "Product Description",
-            "Description 1",
-            "Description 2",
-            "Article Description",
-        ],
-    )
-    unit_col = detect_column(df, ["Unit of Quantity", "Unit", "Unit of Qty"])
-    gen_duty_col = detect_column(
-        df, ["General", "General Rate of Duty", "General Duty", "General Rate"]
-    )
-    spec_duty_col = detect_column(
-        df, ["Special", "Special Rate", "Special Rate of Duty", "Special Duty"]
-    )
-    col2_duty_col = detect_column(
-        df, ["Column 2", "Column 2 Rate", "Column2 Rate", "Column 2 Rate of Duty"]
-    )
-
-    if not desc_col:
+    if not cols["desc"]:
         logger.error(
             f"No description column detected in {xlsx_path} - columns: {df.columns.tolist()}"
         )
-        return []
+        return None, None
 
-    if not indent_col:
-        df["_indent"] = df.index.map(lambda i: 3)  # assume product rows if no indent
-        indent_col = "_indent"
+    return prepare_chapter_frame(df, cols)
 
-    if not hts_col:
-        df["_hts"] = ""
-        hts_col = "_hts"
 
-    # forward-fill duty columns so child rows inherit parent duty values
-    df = forward_fill_duties(df, gen_duty_col, spec_duty_col, col2_duty_col)
+def resolve_rows_loop(df, cols):
+    """Row-by-row hierarchy resolution (reference implementation)."""
+    desc_col, indent_col, hts_col = cols["desc"], cols["indent"], cols["hts"]
+    unit_col = cols["unit"]
+    gen_duty_col, spec_duty_col, col2_duty_col = (
+        cols["gen_duty"], cols["spec_duty"], cols["col2_duty"]
+    )
 
     rows = []
     main_category = subcategory = group = None
@@ -166,11 +227,7 @@ def parse_single_chapter(xlsx_path):
         if not desc:
             continue
 
-        try:
-            indent_raw = row.get(indent_col, "")
-            indent = int(float(indent_raw)) if str(indent_raw).strip() != "" else 3
-        except Exception:
-            indent = 3
+        indent = parse_indent(row.get(indent_col, ""))
 
         hts_code = normalize_hts(row.get(hts_col, ""))
         unit = clean_unit(row.get(unit_col, "")) if unit_col else ""
@@ -207,36 +264,488 @@ def parse_single_chapter(xlsx_path):
     return rows
 
 
-def parse_all_chapters():
-    all_rows = []
-    chapter_files = sorted(
-        [f for f in os.listdir(CHAPTERS_DIR) if f.endswith(".xlsx")],
-        key=lambda x: int(re.findall(r"\d+", x)[0]) if re.findall(r"\d+", x) else 0,
+def _clean_duty_column(s):
+    return (
+        s.astype(str)
+        .str.replace("\n", " ", regex=False)
+        .str.strip()
+        .str.replace(r"\s+", " ", regex=True)
+    )
+
+
+def _seeded_ffill(s, state, key):
+    """Forward-fill s, starting from (and updating) state[key] when state is given."""
+    if state is not None and state.get(key) is not None and pd.isna(s.iloc[0]):
+        s.iloc[0] = state[key]
+    s = s.ffill()
+    if state is not None:
+        state[key] = None if pd.isna(s.iloc[-1]) else s.iloc[-1]
+    return s
+
+
+def resolve_rows_vectorized(df, cols, state=None):
+    """
+    Column-wise equivalent of resolve_rows_loop: hierarchy columns come from
+    masked forward-fills keyed on indent, cleaning runs over whole columns.
+    Pass the same state dict for consecutive batches of one chapter to carry
+    the current main_category/subcategory/group across batch boundaries.
+    """
+    desc = df[cols["desc"]].astype(str).str.strip()
+    keep = desc != ""
+    df = df[keep]
+    desc = desc[keep]
+    if df.empty:
+        return []
+
+    # only a handful of distinct indent values, so parse each one once
+    indent_raw = df[cols["indent"]]
+    indent = indent_raw.map({v: parse_indent(v) for v in indent_raw.unique()})
+
+    # "" marks a reset (descriptions are never empty here); None before any parent
+    main_category = _seeded_ffill(desc.where(indent == 0), state, "main_category")
+    subcategory = _seeded_ffill(
+        desc.where(indent == 1).mask(indent == 0, ""), state, "subcategory"
+    )
+    group = _seeded_ffill(desc.where(indent == 2).mask(indent == 0, ""), state, "group")
+
+    products = indent >= 3
+    empty = pd.Series("", index=df.index)
+
+    def _hierarchy(s):
+        s = s[products].astype(object)
+        return s.where(s.notna() & (s != ""), None)
+
+    def _duty(col):
+        return _clean_duty_column(df.loc[products, col]) if col else empty[products]
+
+    out = pd.DataFrame(
+        {
+            "hts_code": df.loc[products, cols["hts"]]
+            .fillna("")
+            .astype(str)
+            .str.strip()
+            .str.replace("..", ".", regex=False)
+            .str.rstrip("."),
+            "main_category": _hierarchy(main_category),
+            "subcategory": _hierarchy(subcategory),
+            "group": _hierarchy(group),
+            "product": desc[products],
+            "unit_of_quantity": df.loc[products, cols["unit"]]
+            .fillna("")
+            .astype(str)
+            .str.replace(r"[\[\]\"']", "", regex=True)
+            .str.strip()
+            if cols["unit"]
+            else empty[products],
+            "general_rate_of_duty": _duty(cols["gen_duty"]),
+            "special_rate_of_duty": _duty(cols["spec_duty"]),
+            "column2_rate_of_duty": _duty(cols["col2_duty"]),
+        }
+    )
+    return out.to_dict("records")
+
+
+ENGINES = {
+    "loop": resolve_rows_loop,
+    "vectorized": resolve_rows_vectorized,
+}
+
+
+def parse_single_chapter(xlsx_path, engine=PARSE_ENGINE):
+    logger.info(f"Parsing {xlsx_path}")
+    df, cols = read_chapter_frame(xlsx_path)
+    if df is None:
+        return []
+    return ENGINES[engine](df, cols)
+
+
+def verify_engines(chapters_dir=CHAPTERS_DIR):
+    """
+    Run both engines over every chapter workbook and return the files whose
+    rows differ. Used to check the vectorized engine against the loop.
+    """
+    mismatched = []
+    for file in list_chapter_files(chapters_dir):
+        df, cols = read_chapter_frame(os.path.join(chapters_dir, file))
+        if df is None:
+            continue
+        if resolve_rows_loop(df, cols) != resolve_rows_vectorized(df, cols):
+            logger.error(f"Engine mismatch in {file}")
+            mismatched.append(file)
+    logger.info(f"Engine parity checked, mismatched chapters: {mismatched or 'none'}")
+    return mismatched
+
+
+def _cell_text(value):
+    """Convert an openpyxl cell value the way pd.read_excel(dtype=str) does."""
+    if value is None:
+        return float("nan")
+    if isinstance(value, str):
+        return float("nan") if value in NA_STRINGS else value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _header_names(header):
+    """Column names as pd.read_excel builds them (Unnamed: i, deduplicated .1/.2)."""
+    names, seen = [], {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name.strip())
+    return names
+
+
+def iter_chapter_batches(xlsx_path, batch_size=PARSE_BATCH_SIZE):
+    """
+    Stream a chapter workbook with openpyxl read-only mode and yield lists
+    of parsed row dicts, reading at most batch_size sheet rows at a time.
+    Produces the same rows as parse_single_chapter(engine="vectorized").
+    """
+    logger.info(f"Streaming {xlsx_path}")
+    try:
+        wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    except Exception as e:
+        logger.exception("Failed to read %s: %s", xlsx_path, e)
+        return
+
+    try:
+        sheet_rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(sheet_rows, None) or ()
+        columns = _header_names(header)
+        cols = detect_chapter_columns(pd.DataFrame(columns=columns))
+        if not cols["desc"]:
+            logger.error(
+                f"No description column detected in {xlsx_path} - columns: {columns}"
+            )
+            return
+
+        width = len(columns)
+        duty_carry, state = {}, {}
+        while True:
+            chunk = list(islice(sheet_rows, batch_size))
+            if not chunk:
+                break
+            records = []
+            for raw in chunk:
+                values = [_cell_text(v) for v in raw[:width]]
+                values += [float("nan")] * (width - len(values))
+                # read_excel drops rows with no values at all
+                if not all(isinstance(v, float) for v in values):
+                    records.append(values)
+            if not records:
+                continue
+            df, resolved = prepare_chapter_frame(
+                pd.DataFrame(records, columns=columns), cols, duty_carry
+            )
+            rows = resolve_rows_vectorized(df, resolved, state)
+            if rows:
+                yield rows
+    except Exception as e:
+        logger.exception("Failed to read %s: %s", xlsx_path, e)
+    finally:
+        wb.close()
+
+
+def chapter_number_from_filename(filename):
+    nums = re.findall(r"\d+", filename)
+    return int(nums[0]) if nums else 0
+
+
+def list_chapter_files(chapters_dir=CHAPTERS_DIR):
+    return sorted(
+        [f for f in os.listdir(chapters_dir) if f.endswith(".xlsx")],
+        key=chapter_number_from_filename,
     )
 
-    for file in chapter_files:
-        chapter_path = os.path.join(CHAPTERS_DIR, file)
-        chapter_number = int(re.findall(r"\d+", file)[0])
-        chapter_rows = parse_single_chapter(chapter_path)
-        section = get_section_for_chapter(chapter_number)
 
-        for r in chapter_rows:
-            r["chapter"] = chapter_number
-            r["section"] = section
+def _cache_entries(chapter_files, chapters_dir, use_cache):
+    """Cache entry path per chapter file ({} when caching is off)."""
+    if not use_cache:
+        return {}
+    return {
+        f: parse_cache.entry_path(os.path.join(chapters_dir, f), PARSER_VERSION)
+        for f in chapter_files
+    }
+
+
+def _is_cached(entry):
+    return bool(entry) and os.path.exists(entry)
 
+
+def _evict_stale_entries(entries, partial):
+    """Evict cache entries unused by this run (only for its own chapters if partial)."""
+    stems = {os.path.splitext(f)[0] for f in entries} if partial else None
+    parse_cache.evict_stale(entries.values(), stems=stems)
+
+
+def _select_chapter_files(chapters_dir, chapter_files):
+    """All chapter workbooks, or the given subset (basenames) in chapter order."""
+    if chapter_files is None:
+        return list_chapter_files(chapters_dir)
+    return sorted(
+        {os.path.basename(f) for f in chapter_files}, key=chapter_number_from_filename
+    )
+
+
+def parse_chapter_file(file, chapters_dir=CHAPTERS_DIR, engine=PARSE_ENGINE, cache_entry=None):
+    """
+    Parse one chapter workbook and tag its rows with chapter/section.
+    With a cache_entry the rows are read from it when present, and written
+    to it after a successful parse otherwise.
+    Top-level so it can be shipped to a worker process.
+    """
+    chapter_path = os.path.join(chapters_dir, file)
+    chapter_number = chapter_number_from_filename(file)
+
+    chapter_rows = None
+    if _is_cached(cache_entry):
+        chapter_rows = parse_cache.load_rows(cache_entry)
+        if chapter_rows is not None:
+            metrics.inc("hts_parse_cache_hits_total")
+            logger.info(f"Parse cache hit for {file}")
+    if chapter_rows is None:
+        chapter_rows = parse_single_chapter(chapter_path, engine=engine)
+        if cache_entry and chapter_rows:
+            parse_cache.store_rows(cache_entry, chapter_rows)
+
+    section = get_section_for_chapter(chapter_number)
+    for r in chapter_rows:
+        r["chapter"] = chapter_number
+        r["section"] = section
+
+    return chapter_rows
+
+
+def _timed_parse_chapter_file(file, chapters_dir, engine, cache_entry):
+    # in-process only: worker processes do not report metrics
+    with metrics.timer("hts_parse_chapter_seconds"):
+        return parse_chapter_file(file, chapters_dir, engine, cache_entry)
+
+
+def parse_chapter_path(chapter_path, engine=PARSE_ENGINE, use_cache=PARSE_CACHE):
+    """
+    parse_chapter_file for a single workbook path, through the parse cache
+    when use_cache is set (older entries of the chapter are evicted).
+    Top-level so it can be shipped to a worker process.
+    """
+    chapters_dir, file = os.path.split(chapter_path)
+    entries = _cache_entries([file], chapters_dir, use_cache)
+    rows = parse_chapter_file(file, chapters_dir, engine, entries.get(file))
+    if use_cache:
+        _evict_stale_entries(entries, partial=True)
+    return rows
+
+
+def _parse_chapters_in_pool(chapter_files, chapters_dir, workers, engine, entries):
+    """
+    Parse chapters in a process pool and return their rows in the same
+    order as chapter_files. The biggest workbooks are submitted first so
+    Chapter_84/Chapter_99 do not end up as the last task in the pool.
+    Cached chapters are read in this process and never reach the pool.
+    """
+    to_parse = sorted(
+        [f for f in chapter_files if not _is_cached(entries.get(f))],
+        key=lambda f: os.path.getsize(os.path.join(chapters_dir, f)),
+        reverse=True,
+    )
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            f: pool.submit(parse_chapter_file, f, chapters_dir, engine, entries.get(f))
+            for f in to_parse
+        }
+        for file in chapter_files:
+            if file not in futures:
+                results[file] = parse_chapter_file(
+                    file, chapters_dir, engine, entries.get(file)
+                )
+                continue
+            try:
+                results[file] = futures[file].result()
+            except Exception as e:
+                # a worker that dies is reported like any other unreadable chapter
+                logger.exception("Failed to parse %s: %s", file, e)
+                results[file] = []
+    return [results[f] for f in chapter_files]
+
+
+def _iter_chapter_file_batches(chapter_path, batch_size, cache_entry):
+    """Row batches of one chapter for the streaming parser, through the cache."""
+    if _is_cached(cache_entry):
+        metrics.inc("hts_parse_cache_hits_total")
+        logger.info(f"Parse cache hit for {os.path.basename(chapter_path)}")
+        yield from parse_cache.iter_batches(cache_entry)
+        return
+    if not cache_entry:
+        yield from iter_chapter_batches(chapter_path, batch_size)
+        return
+    with parse_cache.EntryWriter(cache_entry) as writer:
+        for rows in iter_chapter_batches(chapter_path, batch_size):
+            writer.add(rows)
+            yield rows
+
+
+def stream_all_chapters(
+    chapters_dir=CHAPTERS_DIR,
+    batch_size=PARSE_BATCH_SIZE,
+    use_cache=PARSE_CACHE,
+    chapter_files=None,
+    parsed_file=None,
+):
+    """
+    Bounded-memory variant of parse_all_chapters: chapters are read in
+    batch_size row batches and each batch is appended to the CSV as soon as
+    it is parsed, so only one batch is held in memory at a time.
+    """
+    parsed_file = parsed_file or parsed_path()
+    total = 0
+    partial = chapter_files is not None
+    chapter_files = _select_chapter_files(chapters_dir, chapter_files)
+    entries = _cache_entries(chapter_files, chapters_dir, use_cache)
+
+    with ParsedWriter(parsed_file) as writer:
+        for file in chapter_files:
+            chapter_number = chapter_number_from_filename(file)
+            section = get_section_for_chapter(chapter_number)
+            chapter_total = 0
+            batches = _iter_chapter_file_batches(
+                os.path.join(chapters_dir, file), batch_size, entries.get(file)
+            )
+            for rows in batches:
+                batch = pd.DataFrame(rows, columns=OUTPUT_COLUMNS)
+                batch["chapter"] = chapter_number
+                batch["section"] = section
+                writer.write(batch)
+                total += len(batch)
+                chapter_total += len(batch)
+            metrics.inc("hts_parsed_rows_total", chapter_total, chapter=chapter_number)
+            logger.info(f"Parsed {chapter_total} rows from {file}")
+
+    if use_cache:
+        _evict_stale_entries(entries, partial)
+
+    if not total:
+        logger.warning("No rows parsed from any chapters.")
+        return None
+
+    logger.info(f"Saved parsed HTS data → {parsed_file} (rows={total})")
+    return parsed_file
+
+
+def parse_all_chapters(
+    workers=PARSE_WORKERS,
+    chapters_dir=CHAPTERS_DIR,
+    engine=PARSE_ENGINE,
+    use_cache=PARSE_CACHE,
+    chapter_files=None,
+    parsed_file=None,
+):
+    """
+    Parse chapter workbooks into one file, hts_all_chapters.<parquet|csv>
+    in the config.PARSED_FORMAT by default (see parsed_io).
+    chapter_files restricts the run to those workbooks, e.g. the chapters
+    the downloader reported as changed.
+    """
+    all_rows = []
+    partial = chapter_files is not None
+    chapter_files = _select_chapter_files(chapters_dir, chapter_files)
+    entries = _cache_entries(chapter_files, chapters_dir, use_cache)
+    misses = sum(1 for f in chapter_files if not _is_cached(entries.get(f)))
+    workers = max(1, min(workers or 1, misses or 1))
+
+    if workers > 1:
+        logger.info(f"Parsing {misses} chapters with {workers} workers")
+        parsed = _parse_chapters_in_pool(
+            chapter_files, chapters_dir, workers, engine, entries
+        )
+    else:
+        parsed = (
+            _timed_parse_chapter_file(f, chapters_dir, engine, entries.get(f))
+            for f in chapter_files
+        )
+
+    for file, chapter_rows in zip(chapter_files, parsed):
         all_rows.extend(chapter_rows)
+        metrics.inc(
+            "hts_parsed_rows_total", len(chapter_rows), chapter=chapter_number_from_filename(file)
+        )
         logger.info(f"Parsed {len(chapter_rows)} rows from {file}")
 
+    if use_cache:
+        _evict_stale_entries(entries, partial)
+
     if not all_rows:
         logger.warning("No rows parsed from any chapters.")
         return None
 
     df_all = pd.DataFrame(all_rows)
-    parsed_file = os.path.join(PARSED_DIR, "hts_all_chapters.csv")
-    df_all.to_csv(parsed_file, index=False, encoding="utf-8-sig")
+    parsed_file = parsed_file or parsed_path()
+    write_parsed(df_all, parsed_file)
     logger.info(f"Saved parsed HTS data → {parsed_file} (rows={len(df_all)})")
     return parsed_file
 
 
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Parse downloaded HTS chapter workbooks.")
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=PARSE_WORKERS,
+        help="worker processes for parsing (1 = sequential)",
+    )
+    ap.add_argument(
+        "--engine",
+        choices=sorted(ENGINES),
+        default=PARSE_ENGINE,
+        help="hierarchy resolution engine",
+    )
+    ap.add_argument(
+        "--verify-engines",
+        action="store_true",
+        help="compare the vectorized engine with the loop on every chapter and exit",
+    )
+    ap.add_argument(
+        "--stream",
+        action="store_true",
+        help="bounded-memory mode: read chapters in batches and write them incrementally",
+    )
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=PARSE_BATCH_SIZE,
+        help="sheet rows per batch in --stream mode",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="re-parse every chapter and leave the parse cache untouched",
+    )
+    ap.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default=PARSED_FORMAT,
+        help="output format (csv is kept for reading by hand)",
+    )
+    args = ap.parse_args(argv)
+    parsed_file = parsed_path(fmt=args.format)
+    use_cache = PARSE_CACHE and not args.no_cache
+    if args.verify_engines:
+        raise SystemExit(1 if verify_engines() else 0)
+    if args.stream:
+        stream_all_chapters(
+            batch_size=args.batch_size, use_cache=use_cache, parsed_file=parsed_file
+        )
+    else:
+        parse_all_chapters(
+            workers=args.workers, engine=args.engine, use_cache=use_cache, parsed_file=parsed_file
+        )
+
+
 if __name__ == "__main__":
-    parse_all_chapters()
+    main()
@@ -1,49 +1,510 @@
+import os
 import sys
+import time
+import queue
+import argparse
+import threading
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import pandas as pd
 from logger import logger
-from downloader import download_all_chapters
-from parser import parse_all_chapters
-from db_loader import load_csv_to_db
+from metrics import metrics, write_run_report
+from config import (
+    CHECKPOINT_PATH, PARSE_CACHE, PARSE_ENGINE, PARSE_WORKERS, PIPELINE_QUEUE_SIZE,
+    SEARCH_INDEX, SEARCH_INDEX_PATH,
+)
+from downloader import iter_sync_chapters, mark_loaded
+from parser import parse_all_chapters, parse_chapter_path, chapter_number_from_filename
+from db_loader import ChapterLoader, load_csv_to_db
+from revision_store import save_revision, save_chapter_update
+from parsed_io import PARSED_COLUMNS, ParsedWriter, parsed_path, read_parsed
+from utils import file_sha256
+from checkpoint import CheckpointJournal
+from search_index import update_search_index
 
-def run_pipeline(start_chapter=1, end_chapter=99):
+CHANGED_FILE = parsed_path("hts_changed_chapters")
+# full-text search index updated after each load (None: not updated)
+DEFAULT_SEARCH_INDEX = SEARCH_INDEX_PATH if SEARCH_INDEX else None
+
+
+def record_revision(parsed_file, files, incremental):
+    """Keep the parsed snapshot in the revision store (revisions/)."""
+    df = read_parsed(parsed_file)
+    sources = {os.path.basename(f): file_sha256(f) for f in files}
+    if incremental:
+        chapters = [chapter_number_from_filename(os.path.basename(f)) for f in files]
+        meta = save_chapter_update(df, chapters, sources)
+    else:
+        meta = save_revision(df, sources)
+    logger.info(f"Revision {meta['id']} ({meta['rows']} rows)")
+    return meta
+
+
+def update_search(parsed_file, prune, path):
+    """
+    Bring the search index at path up to date with the loaded rows of
+    parsed_file (see search_index.py). Like the revision, a failure is
+    logged and does not fail the run.
+    """
+    try:
+        with metrics.timer("hts_stage_seconds", stage="index"):
+            update_search_index(parsed_file, prune=prune, path=path)
+    except Exception as e:
+        logger.exception(f"Could not update the search index: {e}")
+
+
+def run_pipeline(start_chapter=1, end_chapter=99, incremental=True, resume=False,
+                 checkpoint_path=CHECKPOINT_PATH, search_index=DEFAULT_SEARCH_INDEX):
+    """
+    Download, parse and load one stage after the other. Every run, failed
+    ones included, ends with a run report (see metrics.write_run_report).
+
+    Progress is journaled to checkpoint_path (see checkpoint.py): each
+    chapter as it downloads, the parse, the revision and every committed
+    load batch. With resume, an unfinished journaled run is continued from
+    its first incomplete unit, with that run's chapter range and mode.
+
+    The loaded rows are then added to the full-text search index at
+    search_index (None to skip it).
+    """
+    metrics.reset()
+    started_at = time.time()
+    params = {"mode": "batch", "start_chapter": start_chapter, "end_chapter": end_chapter,
+              "incremental": incremental}
+    run = dict(params, status="failed")
+    with CheckpointJournal(checkpoint_path) as journal:
+        if journal.open(params, resume):
+            params = dict(journal.state.params)
+            run.update(params, resumed=True)
+        try:
+            failed = _run_pipeline_steps(
+                params["start_chapter"], params["end_chapter"], params["incremental"], journal,
+                search_index,
+            )
+            run["status"] = "partial" if failed else "ok"
+        except SystemExit as e:
+            if not e.code:
+                run["status"] = "ok"
+            raise
+        finally:
+            journal.record(event="finish", status=run["status"])
+            if run["status"] != "ok":
+                logger.info("Run `pipeline.py --resume` to continue from the first incomplete step.")
+            write_run_report(run, started_at, rows=metrics.total("hts_parsed_rows_total"))
+
+
+def _sync_pending_chapters(start_chapter, end_chapter, incremental, journal):
+    """
+    Download every chapter of the range the journal does not have yet and
+    journal each as it lands. Returns (paths of downloaded chapters still
+    to load in chapter order, chapters that failed, any chapter synced).
+    """
+    state = journal.state
+    todo = [ch for ch in range(start_chapter, end_chapter + 1)
+            if ch not in state.loaded and state.downloaded(ch) is None]
+    if len(todo) < end_chapter - start_chapter + 1:
+        logger.info(f"Resuming: {len(todo)} chapters left to download.")
+    failed = []
+    if todo:
+        # --full re-fetches every chapter (force) but still goes chapter by chapter
+        for ch, status, path in iter_sync_chapters(chapters=todo, force=not incremental):
+            if status == "failed":
+                failed.append(ch)
+            journal.record(stage="download", chapter=ch, status=status, path=path,
+                           sha256=file_sha256(path) if status == "changed" else None)
+    synced = [ch for ch in range(start_chapter, end_chapter + 1) if state.downloaded(ch)]
+    files = [state.downloads[ch]["path"] for ch in synced
+             if ch not in state.loaded and state.downloads[ch]["status"] == "changed"]
+    return files, failed, bool(synced) or bool(state.loaded)
+
+
+def _run_pipeline_steps(start_chapter, end_chapter, incremental, journal, search_index=None):
+    """The steps of run_pipeline; returns the chapters that failed to download."""
     logger.info("===== Starting HTS Pipeline =====")
+    state = journal.state
     try:
-        # Step 1: Download all chapters (with specific range)
-        files = download_all_chapters(start=start_chapter, end=end_chapter)
-        if not files:
+        # Step 1: Download chapters (with specific range); only the changed ones
+        # move on in incremental mode
+        with metrics.timer("hts_stage_seconds", stage="download"):
+            files, failed, synced = _sync_pending_chapters(
+                start_chapter, end_chapter, incremental, journal
+            )
+        if not synced:
             logger.error("No chapter files downloaded. Exiting pipeline.")
             sys.exit(1)
+        if failed:
+            logger.warning(f"Chapters that failed to download: {failed}")
+        if not files:
+            logger.info("No chapter left to parse or load.")
+            # a resumed run may have stopped between its load and the index update
+            parsed_file = state.parse and state.parsed(state.parse["chapters"])
+            if search_index and parsed_file:
+                update_search(parsed_file, prune=False, path=search_index)
+            return failed
+        logger.info(f"{len(files)} chapters to parse and load.")
 
-        logger.info(f"Downloaded {len(files)} chapters successfully.")
         for f in files:
             logger.info(f" - {f}")
+        chapters = [chapter_number_from_filename(os.path.basename(f)) for f in files]
+        # a full run that loaded some chapters already only parses the rest
+        subset = incremental or bool(state.loaded)
 
-        # Step 2: Parse all chapters to CSV
-        try:
-            csv_path = parse_all_chapters()
-        except Exception as e:
-            logger.exception(f"Failed during parsing chapters: {e}")
-            sys.exit(1)
+        # Step 2: Parse the downloaded chapters (Parquet or CSV, see parsed_io)
+        parsed_file = state.parsed(chapters)
+        if parsed_file:
+            logger.info(f"Reusing the parse of these chapters: {parsed_file}")
+        else:
+            try:
+                with metrics.timer("hts_stage_seconds", stage="parse"):
+                    if subset:
+                        parsed_file = parse_all_chapters(chapter_files=files, parsed_file=CHANGED_FILE)
+                    else:
+                        parsed_file = parse_all_chapters()
+            except Exception as e:
+                logger.exception(f"Failed during parsing chapters: {e}")
+                sys.exit(1)
 
-        if not csv_path or not csv_path.endswith(".csv"):
-            logger.error("No valid CSV produced after parsing. Exiting pipeline.")
-            sys.exit(1)
+            if not parsed_file or not os.path.exists(parsed_file):
+                logger.error("No parsed file produced after parsing. Exiting pipeline.")
+                sys.exit(1)
+            journal.record(stage="parse", chapters=chapters, path=parsed_file,
+                           sha256=file_sha256(parsed_file))
+
+        logger.info(f"Parsed file saved at: {parsed_file}")
+
+        # history only: a failure here must not block the load
+        if tuple(chapters) not in state.revisions:
+            try:
+                record_revision(parsed_file, files, subset)
+                journal.record(stage="revision", chapters=chapters)
+            except Exception as e:
+                logger.exception(f"Could not record revision: {e}")
+
+        # Step 3: Load parsed rows into database, continuing after the last
+        # batch a previous attempt committed
+        parsed_sha = state.parse["sha256"]
+        skip_rows = state.load_rows.get(parsed_sha, 0)
+        if skip_rows:
+            logger.info(f"Resuming the load after {skip_rows} committed rows.")
 
-        logger.info(f"Parsed CSV saved at: {csv_path}")
+        def committed(rows):
+            journal.record(stage="load", chapters=chapters, sha256=parsed_sha, rows=rows)
 
-        # Step 3: Load CSV into database
         try:
-            load_csv_to_db(csv_path)
+            with metrics.timer("hts_stage_seconds", stage="load"):
+                load_csv_to_db(parsed_file, skip_rows=skip_rows, on_commit=committed)
         except Exception as e:
             logger.exception(f"Failed during DB load: {e}")
             sys.exit(1)
+        journal.record(stage="load", chapters=chapters, status="done")
+
+        mark_loaded(files)
+
+        # Step 4: Index the loaded descriptions for full-text search; a full
+        # parse covers every local chapter, so chapters missing from it go
+        if search_index:
+            update_search(parsed_file, prune=not subset, path=search_index)
 
         logger.info("Pipeline finished successfully!")
+        return failed
 
     except Exception as e:
         logger.exception(f"Unexpected error in pipeline: {e}")
         sys.exit(1)
 
 
+_DONE = object()
+
+
+class _Stage:
+    """Busy time of one streaming stage, also recorded per chapter as a metric."""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+
+    def add(self, seconds):
+        self.busy += seconds
+        metrics.observe("hts_chapter_stage_seconds", seconds, stage=self.name)
+
+    def timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.add(time.perf_counter() - started)
+
+
+def _download_stage(report, out_q, timer, start, end, incremental, download_options, journal=None):
+    """
+    Sync chapters and hand every changed one to the parse stage as soon as
+    it lands. With a resumed journal, chapters it has loaded are skipped and
+    the ones it has downloaded intact go to the parse stage without a sync.
+    """
+    try:
+        todo = list(range(start, end + 1))
+        if journal is not None:
+            state = journal.state
+            for ch in todo:
+                record = None if ch in state.loaded else state.downloaded(ch)
+                if ch in state.loaded:
+                    report[ch] = {"status": "loaded_earlier"}
+                elif record is not None and record["status"] == "changed":
+                    out_q.put((ch, record["path"]))
+                elif record is not None:
+                    report[ch] = {"status": "unchanged"}
+            todo = [ch for ch in todo if ch not in state.loaded and state.downloaded(ch) is None]
+        results = iter_sync_chapters(start, end, force=not incremental, chapters=todo, **download_options)
+        while True:
+            started = time.perf_counter()
+            item = next(results, None)
+            if item is None:
+                timer.busy += time.perf_counter() - started
+                break
+            timer.add(time.perf_counter() - started)
+            ch, status, path = item
+            if journal is not None:
+                journal.record(stage="download", chapter=ch, status=status, path=path,
+                               sha256=file_sha256(path) if status == "changed" else None)
+            if status == "changed":
+                out_q.put((ch, path))  # blocks while the parse stage is behind
+            else:
+                report[ch] = {"status": "download_failed" if status == "failed" else status}
+    except Exception as e:
+        logger.exception(f"Download stage stopped: {e}")
+        report["download_stage"] = {"status": "failed", "error": str(e)}
+    finally:
+        out_q.put(_DONE)
+
+
+def _parse_stage(report, in_q, out_q, timer, workers, engine, use_cache):
+    """Parse chapters as they arrive; up to `workers` at a time in worker processes."""
+
+    def forward(ch, path, rows=None, error=None):
+        if error is None and not rows:
+            error = "no rows parsed"
+        if error is not None:
+            report[ch] = {"status": "parse_failed", "error": error}
+            return
+        metrics.inc("hts_parsed_rows_total", len(rows), chapter=ch)
+        frame = pd.DataFrame(rows, columns=PARSED_COLUMNS)
+        frame["chapter"] = frame["chapter"].astype("Int64")
+        out_q.put((ch, path, frame))  # blocks while the load stage is behind
+
+    try:
+        if workers <= 1:
+            while (item := in_q.get()) is not _DONE:
+                ch, path = item
+                try:
+                    forward(ch, path, timer.timed(parse_chapter_path, path, engine, use_cache))
+                except Exception as e:
+                    logger.exception(f"Failed to parse Chapter {ch}: {e}")
+                    forward(ch, path, error=str(e))
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = {}
+
+            def drain():
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    ch, path, started = in_flight.pop(fut)
+                    timer.add(time.perf_counter() - started)
+                    try:
+                        forward(ch, path, fut.result())
+                    except Exception as e:
+                        logger.exception(f"Failed to parse Chapter {ch}: {e}")
+                        forward(ch, path, error=str(e))
+
+            while (item := in_q.get()) is not _DONE:
+                ch, path = item
+                fut = pool.submit(parse_chapter_path, path, engine, use_cache)
+                in_flight[fut] = (ch, path, time.perf_counter())
+                while len(in_flight) >= workers:
+                    drain()
+            while in_flight:
+                drain()
+    finally:
+        out_q.put(_DONE)
+
+
+def run_streaming_pipeline(
+    start_chapter=1,
+    end_chapter=99,
+    incremental=True,
+    queue_size=PIPELINE_QUEUE_SIZE,
+    parse_workers=PARSE_WORKERS,
+    engine=PARSE_ENGINE,
+    use_cache=PARSE_CACHE,
+    load_chapter=None,
+    download_options=None,
+    changed_file=CHANGED_FILE,
+    record=True,
+    write_report=True,
+    resume=False,
+    checkpoint_path=CHECKPOINT_PATH,
+    search_index=DEFAULT_SEARCH_INDEX,
+):
+    """
+    Download, parse and load chapters with the three stages overlapping.
+
+    Each chapter moves to parsing as soon as its download finishes and to
+    loading as soon as it is parsed. The stages are connected by queues of
+    at most queue_size chapters, so a slow stage holds back the ones before
+    it and memory stays bounded. A chapter that fails in any stage is
+    recorded and skipped; the others carry on.
+
+    load_chapter takes a chapter's parsed rows (a frame) and returns the
+    number of rows written; by default db_loader.ChapterLoader loads them
+    into MySQL. download_options are passed to downloader.iter_sync_chapters
+    (save_dir, base, workers, rate, manifest_path, ...). The loaded rows
+    are also written to changed_file and, with record=True, kept in the
+    revision store. With write_report the run ends with a run report (see
+    metrics.write_run_report).
+
+    Downloads and loaded chapters are journaled to checkpoint_path (see
+    checkpoint.py; None for no journal). With resume, an unfinished
+    journaled streaming run is continued with its chapter range and mode:
+    chapters it loaded are skipped ("loaded_earlier") and chapters it
+    downloaded are parsed without downloading them again.
+
+    The loaded chapters are then added to the full-text search index at
+    search_index (None to skip it).
+
+    Returns {"chapters": {chapter: {"status": ..., ...}}, "failed": [...],
+    "loaded": n, "rows": n, "seconds": wall time, "stage_seconds": busy time
+    per stage}.
+    """
+    logger.info("===== Starting HTS Pipeline (streaming) =====")
+    journal = CheckpointJournal(checkpoint_path) if checkpoint_path else None
+    resumed = False
+    if journal is not None:
+        params = {"mode": "stream", "start_chapter": start_chapter, "end_chapter": end_chapter,
+                  "incremental": incremental}
+        resumed = journal.open(params, resume)
+        if resumed:
+            params = journal.state.params
+            start_chapter, end_chapter = params["start_chapter"], params["end_chapter"]
+            incremental = params["incremental"]
+    metrics.reset()
+    started_at = time.time()
+    started = time.perf_counter()
+    report = {}
+    timers = {name: _Stage(name) for name in ("download", "parse", "load")}
+    parse_q = queue.Queue(maxsize=queue_size)
+    load_q = queue.Queue(maxsize=queue_size)
+
+    threads = [
+        threading.Thread(
+            target=_download_stage,
+            args=(report, parse_q, timers["download"], start_chapter, end_chapter,
+                  incremental, download_options or {}, journal),
+            name="download",
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_parse_stage,
+            args=(report, parse_q, load_q, timers["parse"], parse_workers, engine, use_cache),
+            name="parse",
+            daemon=True,
+        ),
+    ]
+    for t in threads:
+        t.start()
+
+    loaded_files = []
+    loader = nullcontext(load_chapter) if load_chapter else ChapterLoader()
+    with ParsedWriter(changed_file) as changed, loader as load:
+        while (item := load_q.get()) is not _DONE:
+            ch, path, frame = item
+            try:
+                rows = timers["load"].timed(load, frame)
+            except Exception as e:
+                logger.exception(f"Failed to load Chapter {ch}: {e}")
+                report[ch] = {"status": "load_failed", "error": str(e)}
+                continue
+            changed.write(frame)
+            loaded_files.append(path)
+            if journal is not None:
+                journal.record(stage="load", chapters=[ch], status="done")
+            report[ch] = {"status": "loaded", "rows": len(frame), "written": rows}
+            logger.info(f"Chapter {ch} loaded ({len(frame)} rows)")
+    for t in threads:
+        t.join()
+
+    if loaded_files:
+        mark_loaded(loaded_files, **{k: v for k, v in (download_options or {}).items()
+                                     if k == "manifest_path"})
+    if loaded_files and record:
+        # history only: a failure here must not fail the run
+        try:
+            failed_any = any(r["status"].endswith("failed") for r in report.values())
+            record_revision(changed_file, loaded_files, incremental or failed_any or resumed)
+        except Exception as e:
+            logger.exception(f"Could not record revision: {e}")
+    if loaded_files and search_index:
+        update_search(changed_file, prune=False, path=search_index)
+
+    # chapter numbers first, then stage-level entries such as "download_stage"
+    chapters = {k: report[k] for k in sorted(report, key=lambda k: (isinstance(k, str), str(k).zfill(3)))}
+    summary = {
+        "chapters": chapters,
+        "failed": [k for k, r in chapters.items() if r["status"].endswith("failed")],
+        "loaded": len(loaded_files),
+        "rows": sum(r.get("rows", 0) for r in chapters.values()),
+        "seconds": round(time.perf_counter() - started, 3),
+        "stage_seconds": {name: round(t.busy, 3) for name, t in timers.items()},
+    }
+    for r in chapters.values():
+        metrics.inc("hts_chapters_total", status=r["status"])
+    if journal is not None:
+        journal.record(event="finish", status="partial" if summary["failed"] else "ok")
+        journal.close()
+    if write_report:
+        write_run_report(
+            {"mode": "stream", "start_chapter": start_chapter, "end_chapter": end_chapter,
+             "incremental": incremental, "status": "partial" if summary["failed"] else "ok",
+             "summary": summary},
+            started_at,
+            rows=summary["rows"],
+        )
+    logger.info(
+        f"Streaming pipeline finished in {summary['seconds']}s: {summary['loaded']} chapters "
+        f"loaded, {len(summary['failed'])} failed {summary['failed'] or ''}; "
+        f"busy seconds per stage {summary['stage_seconds']}"
+    )
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Download, parse and load the HTS schedule.")
+    ap.add_argument("start", type=int, nargs="?", default=1)
+    ap.add_argument("end", type=int, nargs="?", default=99)
+    ap.add_argument("--full", action="store_true",
+                    help="re-download and reload every chapter instead of only changed ones")
+    ap.add_argument("--stream", action="store_true",
+                    help="overlap download, parse and load per chapter; failures are per chapter")
+    ap.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE,
+                    help="--stream: max chapters waiting between two stages")
+    ap.add_argument("--resume", action="store_true",
+                    help="continue the last unfinished run (its chapters and mode) from the checkpoint journal")
+    ap.add_argument("--no-search-index", action="store_true",
+                    help="do not update the full-text search index after the load")
+    args = ap.parse_args(argv)
+    search_index = None if args.no_search_index else DEFAULT_SEARCH_INDEX
+    if args.stream:
+        result = run_streaming_pipeline(
+            start_chapter=args.start,
+            end_chapter=args.end,
+            incremental=not args.full,
+            queue_size=args.queue_size,
+            resume=args.resume,
+            search_index=search_index,
+        )
+        sys.exit(1 if result["failed"] else 0)
+    run_pipeline(start_chapter=args.start, end_chapter=args.end, incremental=not args.full,
+                 resume=args.resume, search_index=search_index)
+
+
 if __name__ == "__main__":
-    # You can specify start and end chapters here
-    run_pipeline(start_chapter=1, end_chapter=99)
\ No newline at end of file
+    main()
@@ -0,0 +1,259 @@
+# revision_store.py
+"""
+Revision store for parsed HTS snapshots, and a diff engine over them.
+
+Every snapshot lives in revisions/<revision id>/:
+
+    meta.json         id, created_at, rows, content hash, source workbook hashes
+    snapshot.parquet  the parsed rows, written by parsed_io (repeated
+                      category/rate strings dictionary-encoded)
+
+Revision ids are UTC timestamps (20250301T120000Z), so they sort in
+creation order; saves within the same second get -2, -3, ... appended.
+Saving a snapshot identical to the latest revision is a no-op.
+
+    python revision_store.py list
+    python revision_store.py save parsed/hts_all_chapters.parquet
+    python revision_store.py diff previous latest --out parsed/rate_changes.csv
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from logger import logger
+from config import REVISIONS_DIR
+from utils import ensure_dirs
+from parsed_io import PARSED_COLUMNS, read_parsed, write_parsed
+
+SNAPSHOT_FILE = "snapshot.parquet"
+META_FILE = "meta.json"
+
+RATE_COLUMNS = ["general_rate_of_duty", "special_rate_of_duty", "column2_rate_of_duty"]
+
+
+# ---------- storage ----------
+def content_hash(df):
+    """SHA-256 over the row hashes of df (column names and order included)."""
+    h = hashlib.sha256("\x1f".join(df.columns).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _as_text(df):
+    """Snapshots store every column as text, "" for missing."""
+    return df.astype(object).where(df.notna(), "").astype(str)
+
+
+def _id_key(rev_id):
+    # "20250301T120000Z" < "...Z-2" < ... < "...Z-10"
+    base, _, n = rev_id.partition("-")
+    return base, int(n or 1)
+
+
+def _next_id(timestamp, latest_id=None):
+    """timestamp as a revision id, or the next counter after latest_id if that is not older."""
+    if latest_id is None:
+        return timestamp
+    base, n = _id_key(latest_id)
+    return timestamp if base < timestamp else f"{base}-{n + 1}"
+
+
+def list_revisions(store_dir=REVISIONS_DIR):
+    """
+    Metadata of every stored revision, oldest first. A <id>.part directory
+    is a save that did not finish (see save_revision) and is skipped.
+    """
+    if not os.path.isdir(store_dir):
+        return []
+    metas = []
+    names = [n for n in os.listdir(store_dir) if not n.endswith(".part")]
+    for name in sorted(names, key=_id_key):
+        meta_path = os.path.join(store_dir, name, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as fh:
+                metas.append(json.load(fh))
+    return metas
+
+
+def resolve_revision(ref, store_dir=REVISIONS_DIR):
+    """Revision id for ref: an id, "latest", "previous", or a negative index ("-3")."""
+    ids = [m["id"] for m in list_revisions(store_dir)]
+    if not ids:
+        raise LookupError(f"No revisions stored in {store_dir}")
+    position = {"latest": -1, "previous": -2}.get(ref)
+    if position is None and ref.startswith("-") and ref[1:].isdigit():
+        position = int(ref)
+    if position is not None:
+        if -position > len(ids):
+            raise LookupError(f"Only {len(ids)} revisions stored; {ref} does not exist")
+        return ids[position]
+    if ref in ids:  # a full id also prefixes its -2, -3, ... siblings
+        return ref
+    matches = [i for i in ids if i.startswith(ref)]
+    if len(matches) != 1:
+        raise LookupError(f"Revision {ref!r} matches {len(matches)} stored revisions")
+    return matches[0]
+
+
+def load_revision(ref="latest", store_dir=REVISIONS_DIR):
+    rev_id = resolve_revision(ref, store_dir)
+    return _as_text(read_parsed(os.path.join(store_dir, rev_id, SNAPSHOT_FILE)))
+
+
+def save_revision(df, sources=None, note=None, store_dir=REVISIONS_DIR):
+    """
+    Store df as a new revision and return its metadata. sources maps each
+    source workbook to its SHA-256. If df matches the latest revision, that
+    revision is returned instead of writing a new one.
+    """
+    if df.empty:
+        raise ValueError("Refusing to store an empty snapshot")
+    df = _as_text(df.reindex(columns=PARSED_COLUMNS)).reset_index(drop=True)
+    digest = content_hash(df)
+    existing = list_revisions(store_dir)
+    if existing and existing[-1]["content_sha256"] == digest:
+        logger.info(f"Snapshot unchanged; latest revision is {existing[-1]['id']}")
+        return existing[-1]
+
+    now = datetime.now(timezone.utc)
+    rev_id = _next_id(now.strftime("%Y%m%dT%H%M%SZ"), existing[-1]["id"] if existing else None)
+    meta = {
+        "id": rev_id,
+        "created_at": now.isoformat(timespec="seconds"),
+        "rows": len(df),
+        "content_sha256": digest,
+        "sources": dict(sorted((sources or {}).items())),
+        "note": note,
+    }
+
+    ensure_dirs(store_dir)
+    final_dir = os.path.join(store_dir, rev_id)
+    tmp_dir = final_dir + ".part"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    write_parsed(df, os.path.join(tmp_dir, SNAPSHOT_FILE))
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as fh:
+        json.dump(meta, fh, indent=2)
+    os.replace(tmp_dir, final_dir)
+    logger.info(f"Saved revision {rev_id} ({len(df)} rows)")
+    return meta
+
+
+def save_chapter_update(df, chapters, sources=None, note=None, store_dir=REVISIONS_DIR):
+    """
+    New revision from the latest one with the rows of the given chapters
+    replaced by df (the re-parsed chapters). Without a previous revision df
+    is stored as is.
+    """
+    if not list_revisions(store_dir):
+        return save_revision(df, sources, note, store_dir)
+    previous = load_revision("latest", store_dir)
+    latest_meta = list_revisions(store_dir)[-1]
+    chapters = {str(int(c)) for c in chapters}
+    df = _as_text(df)
+    merged = pd.concat([previous[~previous["chapter"].isin(chapters)], df], ignore_index=True)
+    order = pd.to_numeric(merged["chapter"], errors="coerce")
+    merged = merged.iloc[np.argsort(order.to_numpy(), kind="stable")]
+    return save_revision(
+        merged, {**latest_meta.get("sources", {}), **(sources or {})}, note, store_dir
+    )
+
+
+# ---------- diff ----------
+def _keyed(df):
+    df = df[df["hts_code"] != ""].drop_duplicates(subset="hts_code", keep="last")
+    rates = df.reindex(columns=RATE_COLUMNS, fill_value="")
+    return pd.DataFrame(
+        {
+            "hts_code": df["hts_code"].to_numpy(),
+            "rate_hash": pd.util.hash_pandas_object(rates, index=False).to_numpy(),
+            **{c: rates[c].to_numpy() for c in RATE_COLUMNS},
+        }
+    )
+
+
+def diff_frames(old, new):
+    """
+    Compare two snapshots on hts_code (hash join). Returns a dict of frames:
+    added and removed (hts_code + rates), and changed with the old and new
+    value of every rate column for lines whose rates differ.
+    """
+    merged = _keyed(old).merge(
+        _keyed(new), on="hts_code", how="outer", suffixes=("_old", "_new"), indicator=True
+    )
+    added = merged["_merge"] == "right_only"
+    removed = merged["_merge"] == "left_only"
+    changed = (merged["_merge"] == "both") & (merged["rate_hash_old"] != merged["rate_hash_new"])
+
+    def pick(mask, suffix):
+        out = merged.loc[mask, ["hts_code"] + [c + suffix for c in RATE_COLUMNS]]
+        return out.rename(columns=lambda c: c[: -len(suffix)] if c.endswith(suffix) else c)
+
+    rate_pairs = [f"{c}{s}" for c in RATE_COLUMNS for s in ("_old", "_new")]
+    return {
+        "added": pick(added, "_new").reset_index(drop=True),
+        "removed": pick(removed, "_old").reset_index(drop=True),
+        "changed": merged.loc[changed, ["hts_code"] + rate_pairs].reset_index(drop=True),
+    }
+
+
+def diff_revisions(old_ref="previous", new_ref="latest", store_dir=REVISIONS_DIR):
+    return diff_frames(load_revision(old_ref, store_dir), load_revision(new_ref, store_dir))
+
+
+def diff_to_frame(diff):
+    """
+    One long frame with a change column (added/removed/changed) and the
+    _old/_new value of every rate column.
+    """
+    suffix = {"added": "_new", "removed": "_old"}
+    parts = [
+        frame.rename(columns={c: c + suffix[kind] for c in RATE_COLUMNS} if kind in suffix else {})
+        .assign(change=kind)
+        for kind, frame in diff.items()
+    ]
+    rate_pairs = [f"{c}{s}" for c in RATE_COLUMNS for s in ("_old", "_new")]
+    return pd.concat(parts, ignore_index=True).reindex(columns=["change", "hts_code"] + rate_pairs)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="HTS revision store and diff.")
+    ap.add_argument("--store", default=REVISIONS_DIR)
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list stored revisions")
+    save_p = sub.add_parser("save", help="store a parsed file (Parquet or CSV) as a new revision")
+    save_p.add_argument("parsed_file")
+    save_p.add_argument("--note")
+    diff_p = sub.add_parser("diff", help="added / removed / rate-changed lines between revisions")
+    diff_p.add_argument("old", nargs="?", default="previous")
+    diff_p.add_argument("new", nargs="?", default="latest")
+    diff_p.add_argument("--out", help="write the diff to this CSV")
+    args = ap.parse_args(argv)
+
+    if args.command == "list":
+        for meta in list_revisions(args.store):
+            print(f"{meta['id']}  rows={meta['rows']}  sources={len(meta['sources'])}  {meta.get('note') or ''}")
+    elif args.command == "save":
+        df = read_parsed(args.parsed_file)
+        print(save_revision(df, note=args.note, store_dir=args.store)["id"])
+    else:
+        try:
+            result = diff_revisions(args.old, args.new, args.store)
+        except LookupError as e:
+            sys.exit(str(e))
+        for kind, frame in result.items():
+            print(f"{kind}: {len(frame)}")
+        if args.out:
+            diff_to_frame(result).to_csv(args.out, index=False, encoding="utf-8-sig")
+            print(f"written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
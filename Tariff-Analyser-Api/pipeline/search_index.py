@@ -0,0 +1,335 @@
+# search_index.py
+"""
+Full-text search over the parsed product descriptions.
+
+product_table.product has no index, so a description search in MySQL is a
+LIKE scan of the whole table. This index is a SQLite FTS5 sidecar
+(config.SEARCH_INDEX_PATH, parsed/hts_search.sqlite3): a local file that
+needs no server. It covers each row's product text and its hierarchy path
+(main_category, subcategory, group), with the Porter stemmer, so "shrimps"
+finds "shrimp". Results are ranked by BM25, with a match in the product
+text weighing more than one in the group, subcategory or main category
+(FIELD_WEIGHTS).
+
+The rows of chapter c have the rowids c * ROWID_SPAN + 0, 1, 2, ..., so a
+chapter is replaced by deleting a rowid range and chapter filters are range
+scans. update() keeps a fingerprint per chapter and only rewrites chapters
+whose rows changed; the pipeline calls it after every load with the rows
+it loaded.
+
+    with SearchIndex() as idx:
+        idx.update(read_parsed("parsed/hts_changed_chapters.parquet"))
+        idx.search("frozen shrimp")
+        idx.search('"lithium-ion" batter*', chapter=85, limit=5)
+        idx.search("fillets -salted", highlight=True)
+
+Query syntax (to_match): words must all match; "quoted words" match as a
+phrase; word* matches a prefix; -word excludes; OR between two words
+matches either. raw=True passes an FTS5 expression through unchanged.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import argparse
+
+import pandas as pd
+
+from logger import logger
+from metrics import metrics
+from config import SEARCH_INDEX_PATH
+from utils import ensure_dirs
+
+INDEX_VERSION = 1
+# indexed columns in table order, with their BM25 weights
+SEARCH_FIELDS = ["product", "main_category", "subcategory", "group"]
+FIELD_WEIGHTS = {"product": 4.0, "main_category": 1.0, "subcategory": 1.5, "group": 2.0}
+# returned with each hit, not searchable
+STORED_FIELDS = ["hts_code", "general_rate_of_duty", "unit_of_quantity"]
+ROWID_SPAN = 1_000_000  # rows per chapter at most
+TOKENIZER = "porter unicode61 remove_diacritics 2"
+
+_TOKEN = re.compile(r'-?"[^"]*"\*?|\S+')
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _columns(names):
+    return ", ".join(f'"{c}"' for c in names)  # "group" is an SQL keyword
+
+
+def to_match(query):
+    """
+    FTS5 MATCH expression for a user query, or None if it has no terms.
+    Every term is quoted, so punctuation ("lithium-ion", "8471.30") never
+    reaches the FTS5 parser as syntax.
+    """
+    include, exclude = [], []
+    pending_or = False
+    for token in _TOKEN.findall(query):
+        if token == "OR" and include:
+            pending_or = True
+            continue
+        negate = token.startswith("-") and len(token) > 1
+        token = token[1:] if negate else token
+        prefix = token.endswith("*")
+        text = token.rstrip("*").strip('"')
+        if not re.search(r"\w", text):
+            continue
+        term = _quote(text) + ("*" if prefix else "")
+        if negate:
+            exclude.append(term)
+        elif pending_or:
+            include[-1] = f"({include[-1]} OR {term})"
+        else:
+            include.append(term)
+        pending_or = False
+    if not include:
+        return None
+    expr = " AND ".join(include)
+    if exclude:
+        expr = f"({expr}) NOT " + " NOT ".join(exclude)
+    return expr
+
+
+def chapter_fingerprint(rows):
+    """Content hash of one chapter's rows (indexed and stored columns, in order)."""
+    cols = [c for c in STORED_FIELDS + SEARCH_FIELDS if c in rows.columns]
+    values = rows[cols].astype(object).where(rows[cols].notna(), "").astype(str)
+    return hashlib.sha256(pd.util.hash_pandas_object(values, index=False).values.tobytes()).hexdigest()
+
+
+class SearchIndex:
+    """The FTS5 sidecar at path; created on first use."""
+
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        if path != ":memory:":
+            ensure_dirs(os.path.dirname(path) or ".")
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create()
+
+    # ---------- schema ----------
+    def _create(self, drop=False):
+        with self.conn:
+            version = None
+            if self.conn.execute("SELECT name FROM sqlite_master WHERE name = 'search_meta'").fetchone():
+                row = self.conn.execute("SELECT value FROM search_meta WHERE key = 'version'").fetchone()
+                version = int(row[0]) if row else None
+            if drop or (version is not None and version != INDEX_VERSION):
+                if not drop:
+                    logger.warning(f"{self.path}: search index version {version}, rebuilding as {INDEX_VERSION}")
+                for table in ("hts_search", "search_chapters", "search_meta"):
+                    self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+            stored = ", ".join(f"{c} UNINDEXED" for c in STORED_FIELDS)
+            self.conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS hts_search USING fts5("
+                f"{_columns(SEARCH_FIELDS)}, {stored}, tokenize = '{TOKENIZER}')"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_chapters ("
+                "chapter INTEGER PRIMARY KEY, rows INTEGER, fingerprint TEXT, updated_at REAL)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS search_meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO search_meta VALUES ('version', ?)", (str(INDEX_VERSION),)
+            )
+
+    def clear(self):
+        """Drop every indexed row."""
+        self._create(drop=True)
+
+    # ---------- updates ----------
+    def chapters(self):
+        """{chapter: (rows, fingerprint)} of the indexed chapters."""
+        return {
+            ch: (rows, fingerprint)
+            for ch, rows, fingerprint in self.conn.execute(
+                "SELECT chapter, rows, fingerprint FROM search_chapters"
+            )
+        }
+
+    def _delete_chapter(self, chapter):
+        lo = chapter * ROWID_SPAN
+        self.conn.execute("DELETE FROM hts_search WHERE rowid BETWEEN ? AND ?", (lo, lo + ROWID_SPAN - 1))
+        self.conn.execute("DELETE FROM search_chapters WHERE chapter = ?", (chapter,))
+
+    def _insert_chapter(self, chapter, rows, fingerprint):
+        if len(rows) > ROWID_SPAN:
+            raise ValueError(f"Chapter {chapter}: {len(rows)} rows, at most {ROWID_SPAN} can be indexed")
+        cols = SEARCH_FIELDS + STORED_FIELDS
+        values = rows.reindex(columns=cols).astype(object)
+        values = values.where(values.notna(), None)
+        base = chapter * ROWID_SPAN
+        placeholders = ", ".join("?" * (len(cols) + 1))
+        self.conn.executemany(
+            f"INSERT INTO hts_search (rowid, {_columns(cols)}) VALUES ({placeholders})",
+            ((base + i,) + tuple(row) for i, row in enumerate(values.itertuples(index=False, name=None))),
+        )
+        self.conn.execute(
+            "INSERT INTO search_chapters VALUES (?, ?, ?, ?)",
+            (chapter, len(rows), fingerprint, time.time()),
+        )
+
+    def update(self, df, prune=False, replace=False):
+        """
+        Index the parsed rows in df (any number of chapters), rewriting only
+        the chapters whose rows changed since they were indexed. With prune,
+        df is the whole schedule and indexed chapters missing from it are
+        removed; replace also rewrites the unchanged chapters. One
+        transaction: readers see the old or the new index.
+
+        Returns {"added": [...], "updated": [...], "unchanged": [...],
+        "removed": [...], "rows": rows written}.
+        """
+        result = {"added": [], "updated": [], "unchanged": [], "removed": [], "rows": 0}
+        df = df[df["chapter"].notna()]
+        indexed = self.chapters()
+        with self.conn:
+            if replace:
+                self.conn.execute("DELETE FROM hts_search")
+                self.conn.execute("DELETE FROM search_chapters")
+            for chapter, rows in df.groupby(df["chapter"].astype(int), sort=True):
+                chapter = int(chapter)  # sqlite3 does not bind numpy integers
+                fingerprint = chapter_fingerprint(rows)
+                previous = indexed.get(chapter)
+                if previous and previous[1] == fingerprint and not replace:
+                    result["unchanged"].append(chapter)
+                    continue
+                if previous and not replace:
+                    self._delete_chapter(chapter)
+                self._insert_chapter(chapter, rows, fingerprint)
+                result["updated" if previous else "added"].append(chapter)
+                result["rows"] += len(rows)
+            if prune or replace:
+                present = set(df["chapter"].astype(int).tolist())
+                for chapter in sorted(set(indexed) - present):
+                    if not replace:
+                        self._delete_chapter(chapter)
+                    result["removed"].append(chapter)
+        if result["added"] or result["updated"] or result["removed"]:
+            # merge the b-tree segments the update left behind
+            self.conn.execute("INSERT INTO hts_search (hts_search) VALUES ('optimize')")
+            self.conn.commit()
+        for status in ("added", "updated", "unchanged", "removed"):
+            if result[status]:
+                metrics.inc("hts_search_chapters_total", len(result[status]), status=status)
+        logger.info(
+            f"Search index {self.path}: {len(result['added'])} chapters added, "
+            f"{len(result['updated'])} updated, {len(result['unchanged'])} unchanged, "
+            f"{len(result['removed'])} removed ({result['rows']} rows written)"
+        )
+        return result
+
+    def rebuild(self, df):
+        """
+        Index df from scratch, in one transaction: until it commits readers
+        keep the old index, and a failed rebuild leaves it in place.
+        """
+        return self.update(df, replace=True)
+
+    # ---------- queries ----------
+    def _where(self, query, chapter, raw):
+        match = query if raw else to_match(query)
+        if match is None:
+            return None, None
+        where, params = "hts_search MATCH ?", [match]
+        if chapter is not None:
+            where += " AND rowid BETWEEN ? AND ?"
+            params += [int(chapter) * ROWID_SPAN, int(chapter) * ROWID_SPAN + ROWID_SPAN - 1]
+        return where, params
+
+    def search(self, query, limit=20, offset=0, chapter=None, highlight=False, raw=False):
+        """
+        Best matches of query, best first: dicts with chapter, STORED_FIELDS,
+        SEARCH_FIELDS and score (higher is better). With highlight, matched
+        terms in the product text are wrapped in [ ].
+        """
+        where, params = self._where(query, chapter, raw)
+        if where is None:
+            return []
+        weights = ", ".join(str(FIELD_WEIGHTS[c]) for c in SEARCH_FIELDS) + ", 0" * len(STORED_FIELDS)
+        product = "highlight(hts_search, 0, '[', ']')" if highlight else '"product"'
+        others = _columns(SEARCH_FIELDS[1:] + STORED_FIELDS)
+        started = time.perf_counter()
+        cursor = self.conn.execute(
+            f"SELECT rowid, {product}, {others}, bm25(hts_search, {weights}) AS rank "
+            f"FROM hts_search WHERE {where} ORDER BY rank, rowid LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+        names = ["product"] + SEARCH_FIELDS[1:] + STORED_FIELDS
+        hits = []
+        for rowid, *values, rank in cursor:
+            hit = {"chapter": rowid // ROWID_SPAN}
+            hit.update(zip(names, values))
+            hit["score"] = -rank
+            hits.append(hit)
+        metrics.observe("hts_search_query_seconds", time.perf_counter() - started)
+        return hits
+
+    def count(self, query, chapter=None, raw=False):
+        """Number of rows matching query."""
+        where, params = self._where(query, chapter, raw)
+        if where is None:
+            return 0
+        return self.conn.execute(f"SELECT COUNT(*) FROM hts_search WHERE {where}", params).fetchone()[0]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COALESCE(SUM(rows), 0) FROM search_chapters").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def update_search_index(parsed_file, prune=False, path=SEARCH_INDEX_PATH):
+    """Index the rows of a parsed file (Parquet or CSV, see parsed_io)."""
+    from parsed_io import read_parsed
+
+    df = read_parsed(parsed_file, columns=["chapter"] + SEARCH_FIELDS + STORED_FIELDS)
+    with SearchIndex(path) as idx:
+        return idx.update(df, prune=prune)
+
+
+def main(argv=None):
+    from parsed_io import parsed_path
+
+    ap = argparse.ArgumentParser(description="Build or query the full-text product search index.")
+    ap.add_argument("query", nargs="?", help='e.g. "frozen shrimp", \'"lithium-ion" -parts\'')
+    ap.add_argument("--index", default=SEARCH_INDEX_PATH)
+    ap.add_argument("--update", metavar="PARSED_FILE", nargs="?", const=parsed_path(),
+                    help="index the changed chapters of a parsed file (default: the full schedule)")
+    ap.add_argument("--prune", action="store_true",
+                    help="with --update: the file is the full schedule; drop indexed chapters missing from it")
+    ap.add_argument("--rebuild", action="store_true", help="with --update: index from scratch")
+    ap.add_argument("--chapter", type=int, help="only search this chapter")
+    ap.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    if args.update:
+        if args.rebuild:
+            from parsed_io import read_parsed
+
+            with SearchIndex(args.index) as idx:
+                idx.rebuild(read_parsed(args.update, columns=["chapter"] + SEARCH_FIELDS + STORED_FIELDS))
+        else:
+            update_search_index(args.update, prune=args.prune, path=args.index)
+    if args.query:
+        with SearchIndex(args.index) as idx:
+            for hit in idx.search(args.query, limit=args.limit, chapter=args.chapter, highlight=True):
+                path = " > ".join(str(hit[c]) for c in SEARCH_FIELDS[1:] if hit[c])
+                print(f"{hit['score']:>8.3f}  {hit['hts_code'] or '':<14} {hit['product']}  ({path})")
+
+
+if __name__ == "__main__":
+    main()
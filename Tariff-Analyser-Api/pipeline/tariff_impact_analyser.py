@@ -0,0 +1,232 @@
+# tariff_impact_analyser.py
+"""
+Load the impact-analysis workbooks (currency, duty type, tariff dataset)
+into the database (db.get_backend(), MySQL by default) with typed columns.
+
+Column types are inferred from the data (SMALLINT/INT/BIGINT, DECIMAL,
+DATE/DATETIME, sized VARCHAR), the filter columns used by the impact
+queries are indexed, and rows are inserted in multi-row batches. Each
+table is rebuilt as <table>_new and swapped in atomically (RENAME TABLE
+on MySQL). When the tariff table loads, the impact cube
+(impact_cube.py) is refreshed from it incrementally. With HTS_FX_CONVERT
+set (e.g. "EUR,GBP"), amount columns also get converted copies (fx.py).
+
+    python tariff_impact_analyser.py --tariff parsed/tariff_dataset_500_rows.xlsx
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+from logger import logger
+from config import PARSED_DIR, FX_CONVERT
+from db import get_backend, row_tuples
+
+BATCH_SIZE = 1000
+
+# (cli flag, default workbook, table)
+SOURCES = [
+    ("currency", os.path.join(PARSED_DIR, "currency.xlsx"), "currency_table"),
+    ("duty_type", os.path.join(PARSED_DIR, "duty_type.xlsx"), "duty_type_table"),
+    ("tariff", os.path.join(PARSED_DIR, "tariff_dataset_500_rows.xlsx"), "tariff_table"),
+]
+
+# columns the impact queries filter on; indexed whenever a table has them
+INDEX_COLUMNS = [
+    "Year",
+    "Product_Category",
+    "Subcategory",
+    "Origin_Country",
+    "Destination_Country",
+]
+
+# identifier columns kept as text even when every value looks numeric
+TEXT_COLUMNS = {"HTS_Code", "hts_code"}
+
+MAX_DECIMAL_SCALE = 6
+MAX_VARCHAR = 1024
+
+
+def normalize_columns(columns):
+    return [
+        f"col_{i}" if str(col) == "nan"
+        else str(col).strip().replace(" ", "_").replace("-", "_")
+        for i, col in enumerate(columns)
+    ]
+
+
+def _integer_type(values):
+    lo, hi = values.min(), values.max()
+    if -32768 <= lo and hi <= 32767:
+        return "SMALLINT"
+    if -2147483648 <= lo and hi <= 2147483647:
+        return "INT"
+    return "BIGINT"
+
+
+def _decimal_type(values):
+    scale = MAX_DECIMAL_SCALE
+    for s in range(MAX_DECIMAL_SCALE + 1):
+        if np.allclose(values, values.round(s), rtol=0, atol=1e-9):
+            scale = s
+            break
+    digits = len(str(int(np.abs(values).max())))
+    return f"DECIMAL({digits + scale},{scale})", scale
+
+
+def _varchar_type(values):
+    width = int(values.astype(str).str.len().max())
+    if width > MAX_VARCHAR:
+        return "TEXT"
+    return f"VARCHAR({max(16, -(-width // 16) * 16)})"
+
+
+def infer_column(col, name=None):
+    """
+    Pick a compact MySQL type for col. Returns (sql_type, converted column),
+    where the converted column holds the values to insert (NaN/NaT as None).
+    """
+    values = col.dropna()
+    if values.empty:
+        return "VARCHAR(16)", pd.Series(None, index=col.index, dtype=object)
+
+    if name not in TEXT_COLUMNS:
+        if pd.api.types.is_bool_dtype(values):
+            return "TINYINT(1)", col
+
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return _date_column(col)
+
+        numeric = col if pd.api.types.is_numeric_dtype(values) else None
+        if numeric is None:
+            text = values.astype(str).str.strip()
+            converted = pd.to_numeric(text, errors="coerce")
+            if converted.notna().all():
+                numeric = pd.to_numeric(col.astype(str).str.strip().where(col.notna()), errors="coerce")
+            elif text.str.fullmatch(r"\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?").all():
+                return _date_column(pd.to_datetime(col, errors="coerce"))
+
+        if numeric is not None:
+            present = numeric.dropna().astype(float)
+            if np.isfinite(present).all():
+                if (present == np.trunc(present)).all():
+                    return _integer_type(present), numeric.astype("Int64")
+                sql_type, scale = _decimal_type(present)
+                return sql_type, numeric.astype(float).round(scale)
+
+    text = col.astype(str).str.strip().where(col.notna(), None)
+    if name in TEXT_COLUMNS and pd.api.types.is_float_dtype(col):
+        text = col.astype("Int64").astype(str).where(col.notna(), None)
+    return _varchar_type(text.dropna()), text
+
+
+def _date_column(col):
+    present = col.dropna()
+    if (present == present.dt.normalize()).all():
+        return "DATE", col.dt.date.where(col.notna(), None)
+    return "DATETIME", col.dt.to_pydatetime().astype(object)
+
+
+def infer_schema(df):
+    """Return (typed frame, {column: sql_type}) for a frame with normalized columns."""
+    types, typed = {}, {}
+    for name in df.columns:
+        types[name], typed[name] = infer_column(df[name], name)
+    return pd.DataFrame(typed, index=df.index), types
+
+
+def create_table(conn, table, types):
+    """Create table with the inferred types and the INDEX_COLUMNS it has."""
+    indexes = [("idx_" + name.lower(), [name]) for name in INDEX_COLUMNS if name in types]
+    conn.backend.create_table(
+        conn, table, list(types.items()), indexes=indexes, if_not_exists=False
+    )
+
+
+def insert_batches(conn, table, frame, batch_size=BATCH_SIZE):
+    """Insert frame in executemany() chunks (one multi-row INSERT each on MySQL)."""
+    return conn.backend.insert_many(
+        conn, table, list(frame.columns), row_tuples(frame), batch_size
+    )
+
+
+def with_converted_amounts(df, currencies=FX_CONVERT):
+    """df with <amount>_<CCY> columns (fx.convert_columns); unchanged without a rates file."""
+    from fx import convert_columns  # imports this module
+
+    try:
+        return convert_columns(df, currencies)
+    except FileNotFoundError as e:
+        logger.warning(f"No FX conversion ({e})")
+        return df
+
+
+def insert_excel_to_mysql(excel_path, table_name, conn, batch_size=BATCH_SIZE):
+    """
+    Load one workbook into table_name, replacing its previous contents.
+    Returns the number of rows loaded, or None if the file is missing.
+    """
+    if not os.path.exists(excel_path):
+        logger.error(f"File not found: {excel_path}")
+        return None
+
+    df = pd.read_excel(excel_path)
+    df.columns = normalize_columns(df.columns)
+    if FX_CONVERT:
+        df = with_converted_amounts(df)
+    typed, types = infer_schema(df)
+    logger.info(
+        f"{os.path.basename(excel_path)}: {len(df)} rows, "
+        + ", ".join(f"{c} {t}" for c, t in types.items())
+    )
+
+    backend = conn.backend
+    new_table = f"{table_name}_new"
+    try:
+        backend.drop_table(conn, new_table)
+        create_table(conn, new_table, types)
+        n = insert_batches(conn, new_table, typed, batch_size)
+        conn.commit()
+        backend.swap_tables(conn, {table_name: new_table})
+    except Exception:
+        conn.rollback()
+        backend.drop_table(conn, new_table)
+        raise
+
+    logger.info(f"Inserted {n} rows into `{table_name}`")
+    return n
+
+
+def load_all(paths=None, batch_size=BATCH_SIZE, cube=True):
+    """
+    Load every workbook in SOURCES. paths maps a source name (currency,
+    duty_type, tariff) to a workbook path overriding the default. With
+    cube, the impact cube is refreshed after the tariff table loads.
+    """
+    paths = paths or {}
+    with get_backend().connection() as conn:
+        loaded = {
+            table: insert_excel_to_mysql(paths.get(name) or default, table, conn, batch_size)
+            for name, default, table in SOURCES
+        }
+    if cube and loaded.get("tariff_table") is not None:
+        from impact_cube import refresh_cube  # imports this module
+
+        refresh_cube()
+    return loaded
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load the impact-analysis workbooks into the database.")
+    for name, default, table in SOURCES:
+        ap.add_argument(
+            "--" + name.replace("_", "-"), dest=name, default=default, help=f"workbook for {table}"
+        )
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per multi-row INSERT")
+    ap.add_argument("--no-cube", action="store_true", help="skip the impact cube refresh")
+    args = ap.parse_args(argv)
+    load_all({name: getattr(args, name) for name, _, _ in SOURCES}, args.batch_size, not args.no_cube)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# conftest.py
+"""The pipeline modules import each other by name: put pipeline/ on sys.path."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
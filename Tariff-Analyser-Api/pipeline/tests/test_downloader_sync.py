@@ -0,0 +1,53 @@
+# test_downloader_sync.py
+"""
+Incremental sync (downloader.sync_chapters) against the local stand-in of
+hts.usitc.gov: chapters without a manifest entry are "changed" even when
+the workbook on disk already matches the export, and stay so until
+mark_loaded().
+"""
+import os
+import shutil
+
+import pytest
+
+import downloader
+from bench_fixtures import StubHtsServer, write_synthetic_chapters
+
+CHAPTERS = 3
+
+
+@pytest.fixture
+def server(tmp_path):
+    source = tmp_path / "source"
+    write_synthetic_chapters(str(source), CHAPTERS, 200, seed=1)
+    with StubHtsServer(str(source)) as stub:
+        yield stub
+
+
+def _sync(server, tmp_path):
+    return downloader.sync_chapters(
+        1, CHAPTERS, save_dir=str(tmp_path / "chapters"), workers=1, rate=1000, burst=1000,
+        base=server.base_url, manifest_path=str(tmp_path / "manifest.json"),
+    )
+
+
+def test_first_sync_without_manifest_loads_chapters_already_on_disk(server, tmp_path):
+    # the workbooks are on disk (like the bundled chapters/) but were never loaded
+    shutil.copytree(server.chapters_dir, tmp_path / "chapters")
+    result = _sync(server, tmp_path)
+    assert [os.path.basename(p) for p in result["changed"]] == [
+        f"Chapter_{ch:02d}.xlsx" for ch in range(1, CHAPTERS + 1)
+    ]
+    assert result["unchanged"] == [] and result["failed"] == []
+
+    # still pending until loaded, then unchanged
+    assert len(_sync(server, tmp_path)["changed"]) == CHAPTERS
+    downloader.mark_loaded(result["changed"], manifest_path=str(tmp_path / "manifest.json"))
+    result = _sync(server, tmp_path)
+    assert result["changed"] == [] and len(result["unchanged"]) == CHAPTERS
+
+
+def test_first_sync_downloads_missing_chapters(server, tmp_path):
+    result = _sync(server, tmp_path)
+    assert len(result["changed"]) == CHAPTERS
+    assert all(os.path.exists(p) for p in result["changed"])
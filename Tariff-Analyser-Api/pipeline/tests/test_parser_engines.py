@@ -0,0 +1,56 @@
+# test_parser_engines.py
+"""
+Every bundled chapter workbook (chapters/) parses to the same rows with the
+loop and vectorized hierarchy engines, with the streaming reader, and
+through the parse cache (written on a miss, replayed on a hit; a chapter
+without rows is not cached).
+"""
+import os
+
+import pytest
+
+import parser
+from config import CHAPTERS_DIR
+
+pytestmark = pytest.mark.filterwarnings("ignore:Workbook contains no default style")
+
+CHAPTER_FILES = parser.list_chapter_files(CHAPTERS_DIR) if os.path.isdir(CHAPTERS_DIR) else []
+# small enough that most chapters span several batches
+STREAM_BATCH_SIZE = 100
+
+chapters = pytest.mark.parametrize("file", CHAPTER_FILES or [pytest.param(None, marks=pytest.mark.skip("no chapters/"))])
+
+
+@chapters
+def test_engines_agree(file):
+    df, cols = parser.read_chapter_frame(os.path.join(CHAPTERS_DIR, file))
+    assert df is not None
+    assert parser.resolve_rows_loop(df, cols) == parser.resolve_rows_vectorized(df, cols)
+
+
+@chapters
+def test_stream_matches_vectorized(file):
+    path = os.path.join(CHAPTERS_DIR, file)
+    streamed = [row for batch in parser.iter_chapter_batches(path, STREAM_BATCH_SIZE) for row in batch]
+    assert streamed == parser.parse_single_chapter(path, engine="vectorized")
+
+
+@chapters
+def test_cache_round_trip(file, tmp_path):
+    entry = str(tmp_path / f"{file}.pkl")
+    uncached = parser.parse_chapter_file(file, CHAPTERS_DIR, "vectorized")
+    assert parser.parse_chapter_file(file, CHAPTERS_DIR, "vectorized", entry) == uncached
+    # chapters without rows (e.g. reserved ones) are not cached
+    assert os.path.exists(entry) == bool(uncached)
+    assert parser.parse_chapter_file(file, CHAPTERS_DIR, "vectorized", entry) == uncached
+
+
+@chapters
+def test_stream_cache_round_trip(file, tmp_path):
+    path = os.path.join(CHAPTERS_DIR, file)
+    entry = str(tmp_path / f"{file}.pkl")
+    expected = parser.parse_single_chapter(path, engine="vectorized")
+    written = [row for batch in parser._iter_chapter_file_batches(path, STREAM_BATCH_SIZE, entry) for row in batch]
+    assert os.path.exists(entry) == bool(expected)
+    replayed = [row for batch in parser._iter_chapter_file_batches(path, STREAM_BATCH_SIZE, entry) for row in batch]
+    assert written == replayed == expected
@@ -1,22 +1,124 @@
 import time
 import functools
 import os
+import random
+import hashlib
+import threading
 from logger import logger
+from metrics import metrics
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an operation whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker shared by the calls to one upstream. After
+    failure_threshold consecutive failures it opens and calls fail at once
+    with CircuitOpenError; reset_timeout seconds later one trial call is
+    let through (half-open), which closes the breaker on success and
+    reopens it on failure.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+                raise CircuitOpenError(f"{self.name}: circuit open after {self.failures} failures")
+            self._trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._trial = False
+                metrics.inc("hts_circuit_opened_total", breaker=self.name)
+                logger.warning(f"{self.name}: circuit opened after {self.failures} consecutive failures")
+
+
+def _retry_predicate(retry_on):
+    """retry_on as a predicate: exception types match by isinstance."""
+    if isinstance(retry_on, (type, tuple)):
+        return lambda e: isinstance(e, retry_on)
+    return retry_on
+
+
+def retry(times=3, delay=5, error_message="Operation failed", backoff=2.0, max_delay=60.0,
+          jitter=0.5, retry_on=Exception, breaker=None):
+    """
+    Retry decorator with logging and exponential backoff between attempts:
+    the n-th retry waits delay * backoff ** (n - 1) seconds, capped at
+    max_delay, of which a random fraction up to jitter is taken off so
+    concurrent callers do not retry in lockstep (backoff=1, jitter=0 is
+    a fixed delay).
+
+    Only exceptions matching retry_on (exception types, or a predicate
+    taking the exception) are retried; others are raised at once. With a
+    CircuitBreaker, calls fail fast while it is open, every retryable
+    failure counts towards opening it and any other outcome resets it.
+
+    Failed attempts and operations that fail every attempt are counted in
+    the hts_retries_total / hts_retry_exhausted_total metrics, labelled
+    with error_message.
+    """
+    is_retryable = _retry_predicate(retry_on)
 
-def retry(times=3, delay=5, error_message="Operation failed"):
-    """Retry decorator with logging and delay between attempts."""
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             last_exc = None
             for attempt in range(1, times + 1):
+                if breaker is not None:
+                    breaker.before_call()
                 try:
-                    return func(*args, **kwargs)
+                    result = func(*args, **kwargs)
+                except CircuitOpenError:
+                    raise
                 except Exception as e:
+                    if not is_retryable(e):
+                        # the upstream answered; the error is the caller's
+                        if breaker is not None:
+                            breaker.record_success()
+                        raise
+                    if breaker is not None:
+                        breaker.record_failure()
                     last_exc = e
                     logger.warning(f"{error_message}: {e} (Attempt {attempt}/{times})")
                     if attempt < times:
-                        time.sleep(delay)
+                        metrics.inc("hts_retries_total", operation=error_message)
+                        wait = min(max_delay, delay * backoff ** (attempt - 1))
+                        time.sleep(wait * (1 - jitter * random.random()))
+                    continue
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            metrics.inc("hts_retry_exhausted_total", operation=error_message)
             raise last_exc
         return wrapper
     return decorator
@@ -31,4 +133,42 @@ def ensure_dirs(*dirs):
             logger.error(f"Failed to create directory '{d}': {e}")
             raise e
         else:
-            logger.info(f"Directory ready: {d}")
\ No newline at end of file
+            logger.info(f"Directory ready: {d}")
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hex SHA-256 of a file's contents, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter: allows bursts of up to capacity
+    calls, refilled at rate tokens per second. acquire() blocks until a
+    token is available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(max(capacity, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)